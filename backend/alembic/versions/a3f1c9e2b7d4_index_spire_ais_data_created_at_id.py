@@ -0,0 +1,28 @@
+"""index_spire_ais_data_created_at_id
+
+Revision ID: a3f1c9e2b7d4
+Revises: c16b5dd42d2c
+Create Date: 2026-10-18 15:02:11.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c9e2b7d4'
+down_revision = 'c16b5dd42d2c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # keyset pagination of clean_positions on (created_at, id), also used by the queries on
+    # created_at alone
+    op.create_index("i_spire_ais_data_created_at_id", "spire_ais_data", ["created_at", "id"])
+    op.drop_index("i_spire_ais_data_created_at")
+
+
+def downgrade() -> None:
+    op.create_index("i_spire_ais_data_created_at", "spire_ais_data", ["created_at"])
+    op.drop_index("i_spire_ais_data_created_at_id")
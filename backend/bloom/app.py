@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi import Request
 
@@ -16,12 +18,23 @@ from starlette.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 
 from bloom.config import settings
+from bloom.dependencies import create_response_cache
+from bloom.infra.cache import GZIP_COMPRESSLEVEL, GZIP_MINIMUM_SIZE
 
 API_PREFIX_V1='/api/v1'
 API_PREFIX_V2='/api/v2'
 
-app = FastAPI()
-app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one Redis connection pool shared by the requests using the response cache
+    app.state.response_cache = create_response_cache()
+    yield
+    await app.state.response_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE,
+                   compresslevel=GZIP_COMPRESSLEVEL)
 
 
 @app.get("/", include_in_schema=False)
@@ -36,6 +36,16 @@ class Settings(BaseSettings):
     postgres_db: str = Field(min_length=1, max_length=32, pattern=r'^(?:[a-zA-Z]|_)[\w\d_]*$')
     srid: int = Field(default=4326)
     spire_token: str = Field(default='')
+    spire_api_url: str = Field(default='https://api.sml.kpler.com/graphql')
+    # GraphQL schema of the Spire API, downloaded on first use
+    spire_schema_path: str = Field(default=str(Path(__file__).parent.parent.parent.joinpath('./data/spire_schema.graphql')))
+    # vessels queried by request, number of requests sent at once, retries of a failed request
+    spire_shard_size: int = Field(default=100, gt=0)
+    spire_max_concurrency: int = Field(default=4, gt=0)
+    spire_max_retries: int = Field(default=3, ge=0)
+    # delay before the first retry in seconds, doubled for each following retry
+    spire_retry_backoff: float = Field(default=1.0, ge=0)
+    spire_timeout: int = Field(default=30, gt=0)
     data_folder: str = Field(default=str(Path(__file__).parent.parent.parent.joinpath('./data')))
     db_url: str = Field(default='')
 
@@ -43,13 +53,33 @@ class Settings(BaseSettings):
     redis_port: int = Field(default=6379)
     redis_password: str = Field(default='bloom',min_length=1)
     redis_cache_expiration: int = Field(default=900)
+    redis_max_connections: int = Field(default=50, gt=0)
+    # stale entries are served for this time (seconds) after their expiration, while rebuilt
+    redis_cache_stale_expiration: int = Field(default=900, ge=0)
+    # maximal time (seconds) a worker waits for the build of an entry by another worker
+    redis_cache_lock_timeout: int = Field(default=60, gt=0)
     
     kpler_api_root: str = Field(default='')
     kpler_token: str = Field(default='')
     messages_page_size: int = Field(default = 100)
+    # number of ais-latest requests sent at once
+    kpler_max_concurrency: int = Field(default=4, gt=0)
+    # connections kept open to the Kpler API and how long an idle one is kept (seconds)
+    kpler_pool_size: int = Field(default=10, gt=0)
+    kpler_keepalive_timeout: float = Field(default=30, ge=0)
+    # timeout of a request (seconds), retries of a request answered with 429 or 5xx
+    kpler_timeout: float = Field(default=60, gt=0)
+    kpler_max_retries: int = Field(default=3, ge=0)
+    # delay before the first retry when the API sends no Retry-After (seconds), then doubled
+    kpler_retry_backoff: float = Field(default=1.0, ge=0)
+    # requests per second to the Kpler API, 0 for no limit
+    kpler_rate_limit: float = Field(default=5, ge=0)
     
     api_pooling_period: timedelta = Field(default=timedelta(minutes=2))
 
+    # number of rows above which batch inserts are written with COPY
+    bulk_copy_threshold: int = Field(default=10000, gt=0)
+
     logging_level:str=Field(
                                 default="INFO",
                                 pattern=r'NOTSET|DEBUG|INFO|WARNING|ERROR|CRITICAL'
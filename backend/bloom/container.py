@@ -17,6 +17,7 @@ from bloom.services.metrics import MetricsService
 from bloom.usecase.GenerateAlerts import GenerateAlerts
 from dependency_injector import containers, providers
 import redis
+import redis.asyncio
 
 
 class UseCases(containers.DeclarativeContainer):
@@ -35,6 +36,16 @@ class UseCases(containers.DeclarativeContainer):
         db=0
     )
 
+    # asyncio client of the API, created once at startup (see bloom.app)
+    async_cache_service = providers.Factory(
+        redis.asyncio.Redis,
+        host=settings.redis_host,
+        port=settings.redis_port,
+        password=settings.redis_password,
+        db=0,
+        max_connections=settings.redis_max_connections,
+    )
+
     vessel_repository = providers.Factory(
         VesselRepository,
         session_factory=db.provided.session,
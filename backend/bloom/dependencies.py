@@ -1,12 +1,16 @@
 from fastapi import Request, HTTPException, Depends
+from fastapi.responses import Response
 from bloom.config import settings
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel
+from collections.abc import Iterable
 from functools import wraps
+import re
 import time
-import json
+from urllib.parse import urlencode
 from bloom.logger import logger
 from bloom.container import UseCases
+from bloom.infra.cache import CachedResponse, ResponseCache
 from bloom.routers.requests import RangeHeader
 ## Reference for pagination design
 ## https://jayhawk24.hashnode.dev/how-to-implement-pagination-in-fastapi-feat-sqlalchemy
@@ -25,31 +29,108 @@ from fastapi.encoders import jsonable_encoder
 #                          nocache:bool = False,    # needed by @cache
 #                        ):
 #         ...
-def cache(func):
+def create_response_cache() -> ResponseCache:
+    return ResponseCache(UseCases().async_cache_service(),
+                         settings.redis_cache_expiration,
+                         stale_expiration=settings.redis_cache_stale_expiration,
+                         lock_timeout=settings.redis_cache_lock_timeout)
+
+
+def get_response_cache(request: Request) -> ResponseCache:
+    """Response cache of the application, created at startup (or on first use without
+    lifespan)"""
+    response_cache = getattr(request.app.state, "response_cache", None)
+    if response_cache is None:
+        response_cache = create_response_cache()
+        request.app.state.response_cache = response_cache
+    return response_cache
+
+
+def cache_key(request: Request) -> str:
+    """Key of a response in the cache: path, query parameters sorted by name except nocache, and
+    Range header"""
+    params = sorted((name, value) for name, value in request.query_params.multi_items()
+                    if name != 'nocache')
+    key = f"{request.url.path}/{urlencode(params)}"
+    if 'range' in request.headers:
+        key += f"#{request.headers['range'].replace(' ', '')}"
+    return key
+
+
+# path parameters identifying an entity, and the prefix of its tag
+ENTITY_TAGS = {"vessel_id": "vessel", "zone_id": "zone", "zones_id": "zone", "port_id": "port"}
+
+
+def cache_tags(request: Request, tags: Iterable[str] = ()) -> list[str]:
+    """Tags of a response in the cache: family of the route (vessels, zones, ports, metrics),
+    entities of the path (vessel:{id}, zone:{id}, port:{id}) and tags of the endpoint"""
+    route=getattr(request.scope.get('route'), 'path', request.url.path)
+    segments=[segment for segment in route.split('/')
+              if segment and segment != 'api' and not re.fullmatch(r'v\d+', segment)]
+    result=[segments[0]] if segments else []
+    result+=[f"{ENTITY_TAGS[name]}:{value}" for name, value in request.path_params.items()
+             if name in ENTITY_TAGS]
+    return result+[tag for tag in tags if tag not in result]
+
+
+def cache(func=None, *, tags: Iterable[str] = ()):
+    """Caches the responses of an endpoint, used as @cache or @cache(tags=[...]) to add tags to
+    the ones of cache_tags. The API key of the endpoint (key parameter) is checked before the
+    lookup, a cached response is not served to an unauthorized request."""
+    if func is None:
+        return lambda func: cache(func, tags=tags)
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        start = time.time()
+        start = time.perf_counter()
         request=kwargs['request']
-        cache_service=UseCases().cache_service()
+        if 'key' in kwargs:
+            check_apikey(kwargs['key'])
+        response_cache=get_response_cache(request)
         nocache=True if request.query_params.get('nocache') \
                             and request.query_params.get('nocache').lower() == 'true' \
                      else False
-        cache_key=f"{request.url.path}/{request.query_params}"
-        incache= cache_service.get(cache_key)
+        key=cache_key(request)
+        route=getattr(request.scope.get('route'), 'path', request.url.path)
+        incache=None if nocache else await response_cache.get(key)
         #logger.debug(f"nocache: {nocache}")
         #logger.debug(f"incache: {True if incache is not None else False}")
-        
 
-        if incache and not nocache:
-            #logger.debug(f"{cache_key} cached ({settings.redis_cache_expiration})s")
+        async def build():
+            # read before the build: an invalidation during the build prevents its storage
+            entry_tags=cache_tags(request, tags)
+            generations=await response_cache.generations(entry_tags)
+            payload=await func(*args, **kwargs)
+            if isinstance(payload, Response):
+                cached=CachedResponse.from_response(payload)
+                if cached is None:
+                    return payload
+            else:
+                cached=CachedResponse.from_payload(payload)
+            return await response_cache.set(key, cached, tags=entry_tags,
+                                            generations=generations)
+
+        stale=incache is not None and not incache.is_fresh()
+        if incache and not stale:
+            #logger.debug(f"{key} cached ({settings.redis_cache_expiration})s")
             logger.debug(f"Getting response from cache")
-            payload=json.loads(incache)
+            cached=incache
+        elif incache:
+            # stale-while-revalidate: served as is, rebuilt in the background
+            logger.debug(f"Getting stale response from cache")
+            response_cache.revalidate(key, build)
+            cached=incache
+        elif nocache:
+            cached=await build()
         else:
-            payload=await func(*args, **kwargs)
-            cache_service.set(cache_key, json.dumps(jsonable_encoder(payload)))
-            cache_service.expire(cache_key,settings.redis_cache_expiration)
-        logger.debug(f"{cache_key} elapsed Time: {time.time()-start}")
-        return payload
+            # single-flight: concurrent misses of the key share the same build
+            cached=await response_cache.coalesce(key, build)
+        if isinstance(cached, Response):
+            return cached
+        elapsed=time.perf_counter()-start
+        response_cache.record(route, incache is not None, elapsed, stale)
+        logger.debug(f"{key} elapsed Time: {elapsed}")
+        return cached.to_response(request)
     return wrapper
 
 
@@ -0,0 +1,366 @@
+"""Response cache of the API endpoints decorated with @cache, stored in Redis.
+
+One ResponseCache is created at the startup of the application, with the asyncio Redis client of
+the container: its connection pool is shared by all the requests and closed at shutdown.
+
+Entries are the final bytes of the responses (CachedResponse): the JSON body serialized once
+with orjson, gzip compressed when it is large enough, with its content type and ETag. A hit is
+sent as is, without decoding nor encoding the payload again.
+
+Entries are tagged (vessels, zones, metrics, vessel:{id}...): the set tag:<tag> holds the keys
+of the entries of a tag, so that the tasks changing data evict only the entries depending on it.
+Each eviction increments the generation of the tag (gen:<tag>): an entry whose build started
+before an eviction of one of its tags is not stored, it may hold data read before the change.
+
+Entries are fresh for the expiration, then kept stale for stale_expiration: a stale entry is
+served while it is rebuilt in the background. Only one build of a key runs at a time, the other
+requests wait for its result: within a process through a future, across the workers through a
+short Redis lock (lock:<key>).
+"""
+import asyncio
+import dataclasses
+import gzip
+import hashlib
+import secrets
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+
+import orjson
+import redis
+import redis.asyncio
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from bloom.logger import logger
+
+# same thresholds as the GZipMiddleware of the application
+GZIP_MINIMUM_SIZE = 1000
+GZIP_COMPRESSLEVEL = 5
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+# deletes the entries of the tag sets (first half of KEYS) and the sets, increments the
+# generations of the tags (second half of KEYS), returns the number of entries deleted
+INVALIDATE_SCRIPT = """
+local count = 0
+local tags = #KEYS / 2
+for t = 1, tags do
+    local keys = redis.call('SMEMBERS', KEYS[t])
+    for i = 1, #keys, 1000 do
+        count = count + redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+    end
+    redis.call('DEL', KEYS[t])
+    redis.call('INCR', KEYS[tags + t])
+end
+return count
+"""
+
+# stores the entry KEYS[1] (value ARGV[1], expiration ARGV[2]) and adds it to the tag sets (KEYS
+# 2 to tags + 1) if the generations of the tags (next KEYS) are still the ones read before its
+# build (ARGV 3 to tags + 2), returns 1 if stored
+SET_SCRIPT = """
+local tags = (#KEYS - 1) / 2
+for t = 1, tags do
+    if (redis.call('GET', KEYS[1 + tags + t]) or '0') ~= ARGV[2 + t] then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+for t = 1, tags do
+    redis.call('SADD', KEYS[1 + t], KEYS[1])
+    redis.call('EXPIRE', KEYS[1 + t], ARGV[2])
+end
+return 1
+"""
+
+
+# deletes the lock KEYS[1] if it is still held by the token ARGV[1]
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def tag_key(tag: str) -> str:
+    return f"tag:{tag}"
+
+
+def generation_key(tag: str) -> str:
+    return f"gen:{tag}"
+
+
+def invalidate_keys(tags: Iterable[str]) -> list[str]:
+    """KEYS of INVALIDATE_SCRIPT: the sets of the tags then their generations"""
+    tags = sorted(set(tags))
+    return [tag_key(tag) for tag in tags] + [generation_key(tag) for tag in tags]
+
+
+def invalidate_tags(client: redis.Redis, tags: Iterable[str]) -> int:
+    """Evicts the entries of any of the tags, with the synchronous client of the tasks
+
+    :return int: number of entries evicted
+    """
+    keys = invalidate_keys(tags)
+    if not keys:
+        return 0
+    return client.register_script(INVALIDATE_SCRIPT)(keys=keys)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header lists the ETag (weak comparison) or is *"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """Body of a response as sent to the clients, gzipped if it is at least GZIP_MINIMUM_SIZE
+    bytes long. The ETag is computed on the uncompressed body. Partial responses (206) keep
+    their Content-Range."""
+    body: bytes
+    etag: str
+    media_type: str = "application/json"
+    gzipped: bool = False
+    # timestamp after which the entry is stale, set when it is stored
+    fresh_until: float = 0.0
+    status_code: int = 200
+    content_range: str = ""
+
+    @classmethod
+    def from_body(cls, body: bytes, media_type: str = "application/json",
+                  status_code: int = 200, content_range: str = "") -> "CachedResponse":
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        gzipped = len(body) >= GZIP_MINIMUM_SIZE
+        if gzipped:
+            body = gzip.compress(body, GZIP_COMPRESSLEVEL, mtime=0)
+        return cls(body, etag, media_type, gzipped, status_code=status_code,
+                   content_range=content_range)
+
+    @classmethod
+    def from_payload(cls, payload: Any) -> "CachedResponse":
+        return cls.from_body(orjson.dumps(payload, default=jsonable_encoder,
+                                          option=ORJSON_OPTIONS))
+
+    @classmethod
+    def from_response(cls, response: Response) -> Optional["CachedResponse"]:
+        """CachedResponse of a response returned by an endpoint, None if it can't be cached: not
+        a 200 or 206 response, already encoded or without body (streaming)"""
+        if (response.status_code not in (200, 206) or "content-encoding" in response.headers
+                or not isinstance(getattr(response, "body", None), bytes)):
+            return None
+        media_type = response.headers.get("content-type", response.media_type or "")
+        content_range = ", ".join(response.headers.getlist("content-range"))
+        return cls.from_body(response.body, media_type, response.status_code, content_range)
+
+    def dumps(self) -> bytes:
+        """Redis value: a header line "etag<TAB>media type<TAB>gzipped<TAB>fresh
+        until<TAB>status code<TAB>content range" followed by the body"""
+        header = "\t".join([self.etag, self.media_type, str(int(self.gzipped)),
+                            str(self.fresh_until), str(self.status_code), self.content_range])
+        return f"{header}\n".encode() + self.body
+
+    @classmethod
+    def loads(cls, value: bytes) -> Optional["CachedResponse"]:
+        """CachedResponse of a Redis value, None if the value has another format"""
+        header, separator, body = value.partition(b"\n")
+        fields = header.decode(errors="replace").split("\t")
+        if not separator or len(fields) != 6:
+            return None
+        etag, media_type, gzipped, fresh_until, status_code, content_range = fields
+        return cls(body, etag, media_type, gzipped == "1", float(fresh_until), int(status_code),
+                   content_range)
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.fresh_until
+
+    def to_response(self, request: Request) -> Response:
+        """Response to a request: 304 if the client has the same version, the gzipped body if
+        the client accepts it, otherwise the uncompressed body"""
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding"}
+        if self.content_range:
+            headers["Content-Range"] = self.content_range
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+        body = self.body
+        if self.gzipped:
+            if "gzip" in request.headers.get("accept-encoding", ""):
+                headers["Content-Encoding"] = "gzip"
+            else:
+                body = gzip.decompress(body)
+        return Response(body, status_code=self.status_code, media_type=self.media_type,
+                        headers=headers)
+
+
+class RouteMetrics:
+    """Hits (stale ones included), misses and total time spent (in seconds) by a route using the
+    cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.hit_time = 0.0
+        self.miss_time = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / (self.hits + self.misses)
+                          if self.hits + self.misses else None),
+            "average_hit_time": self.hit_time / self.hits if self.hits else None,
+            "average_miss_time": self.miss_time / self.misses if self.misses else None,
+        }
+
+
+# builds a response and stores it in the cache, or returns a response not to cache
+Build = Callable[[], Awaitable[Union[CachedResponse, Response]]]
+
+
+class ResponseCache:
+    def __init__(self, client: redis.asyncio.Redis, expiration: int, stale_expiration: int = 0,
+                 lock_timeout: float = 60, lock_poll: float = 0.1):
+        self.client = client
+        self.expiration = expiration
+        self.stale_expiration = stale_expiration
+        self.lock_timeout = lock_timeout
+        self.lock_poll = lock_poll
+        self.metrics: dict[str, RouteMetrics] = {}
+        self.builds: dict[str, asyncio.Future] = {}
+        self.revalidations: set[asyncio.Task] = set()
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        value = await self.client.get(key)
+        return CachedResponse.loads(value) if value is not None else None
+
+    async def generations(self, tags: Iterable[str]) -> list[int]:
+        """Generations of the tags, to read before building an entry and give to set"""
+        tags = list(tags)
+        if not tags:
+            return []
+        return [int(value or 0) for value in
+                await self.client.mget([generation_key(tag) for tag in tags])]
+
+    async def set(self, key: str, response: CachedResponse, expiration: Optional[int] = None,
+                  tags: Iterable[str] = (),
+                  generations: Optional[list[int]] = None) -> CachedResponse:
+        """Stores an entry, fresh for expiration then stale for stale_expiration, and adds its
+        key to the sets of its tags, atomically. The sets expire with their last entry.
+
+        The entry is not stored if one of its tags has been invalidated since the generations
+        were read (current generations if not given).
+
+        :return CachedResponse: the entry, stored or not
+        """
+        tags = list(tags)
+        if generations is None:
+            generations = await self.generations(tags)
+        expiration = expiration or self.expiration
+        response = dataclasses.replace(response, fresh_until=time.time() + expiration)
+        keys = [key] + [tag_key(tag) for tag in tags] + [generation_key(tag) for tag in tags]
+        args = [response.dumps(), expiration + self.stale_expiration] + generations
+        if not await self.client.register_script(SET_SCRIPT)(keys=keys, args=args):
+            logger.info(f"{key} not cached, invalidated while it was built")
+        return response
+
+    async def coalesce(self, key: str, build: Build) -> Union[CachedResponse, Response]:
+        """Response of a missing entry: the requests of the process share the same build, which
+        waits for the build of another worker if it holds the lock of the key"""
+        future = self.builds.get(key)
+        if future is not None:
+            response = await asyncio.shield(future)
+            if response is not None:
+                return response
+            # revalidation left to another worker, the entry has been evicted since
+            return await self.coalesce(key, build)
+        future = asyncio.get_running_loop().create_future()
+        self.builds[key] = future
+        try:
+            response = await self._build_locked(key, build, wait=True)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised to the waiters, if any
+            future.exception()
+            raise
+        finally:
+            del self.builds[key]
+
+    def revalidate(self, key: str, build: Build) -> None:
+        """Rebuilds a stale entry in the background, unless it is already being rebuilt by the
+        process or by another worker"""
+        if key in self.builds:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.builds[key] = future
+
+        async def run() -> None:
+            try:
+                future.set_result(await self._build_locked(key, build, wait=False))
+            except Exception as e:
+                logger.warning(f"Revalidation of {key} failed: {e!r}")
+                future.set_exception(e)
+                future.exception()
+            finally:
+                del self.builds[key]
+
+        task = asyncio.create_task(run())
+        self.revalidations.add(task)
+        task.add_done_callback(self.revalidations.discard)
+
+    async def _build_locked(self, key: str, build: Build,
+                            wait: bool) -> Optional[Union[CachedResponse, Response]]:
+        """Builds the entry holding the Redis lock of the key. If another worker holds it, waits
+        for the entry it stores (builds it anyway after lock_timeout) or returns None if not
+        wait"""
+        lock = f"lock:{key}"
+        token = secrets.token_hex(16)
+        deadline = time.monotonic() + self.lock_timeout
+        while not await self.client.set(lock, token, nx=True, px=int(self.lock_timeout * 1000)):
+            if not wait:
+                return None
+            await asyncio.sleep(self.lock_poll)
+            response = await self.get(key)
+            if response is not None and response.is_fresh():
+                return response
+            if time.monotonic() > deadline:
+                logger.warning(f"Lock of {key} not released after {self.lock_timeout}s")
+                return await build()
+        try:
+            return await build()
+        finally:
+            await self.client.register_script(RELEASE_LOCK_SCRIPT)(keys=[lock], args=[token])
+
+    async def invalidate(self, tags: Iterable[str]) -> int:
+        """Evicts the entries of any of the tags, returns the number of entries evicted"""
+        keys = invalidate_keys(tags)
+        if not keys:
+            return 0
+        return await self.client.register_script(INVALIDATE_SCRIPT)(keys=keys)
+
+    async def flush(self) -> None:
+        await self.client.flushall()
+
+    def record(self, route: str, hit: bool, elapsed: float, stale: bool = False) -> None:
+        metrics = self.metrics.setdefault(route, RouteMetrics())
+        if hit:
+            metrics.hits += 1
+            metrics.stale_hits += stale
+            metrics.hit_time += elapsed
+        else:
+            metrics.misses += 1
+            metrics.miss_time += elapsed
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,143 @@
+"""Bulk writes with COPY ... FROM STDIN, for the tables filled by the batch tasks.
+
+Rows are written as CSV (geometries as EWKB hex strings) on the connection of the session, so
+they belong to its transaction. Columns missing from the copied columns get their server default.
+"""
+import binascii
+import io
+import math
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import Geometry
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from bloom.config import settings
+
+# rows sent by COPY statement, to keep the CSV buffer memory bounded
+COPY_CHUNK_SIZE = 100_000
+
+
+def format_value(value: Any) -> str:
+    """Converts a python value to a CSV field for COPY. Missing values (None, NaN, NaT, pd.NA)
+    are written as an unquoted empty field (NULL), as by copy_frame, other non numeric values
+    are quoted so that an empty string is not NULL. Numpy scalars are written as their python
+    value."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, float) and math.isinf(value):
+        value = "Infinity" if value > 0 else "-Infinity"
+    elif isinstance(value, (int, float)):
+        return repr(value)
+    elif isinstance(value, Geometry):
+        if shapely.get_srid(value) == 0:
+            value = shapely.set_srid(value, settings.srid)
+        value = shapely.to_wkb(value, hex=True, include_srid=True)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, timedelta):
+        value = f"{value.total_seconds()} seconds"
+    value = str(value).replace('"', '""')
+    return f'"{value}"'
+
+
+def copy_rows(session: Session, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+    """Writes rows to a table with COPY ... FROM STDIN (FORMAT csv).
+
+    :param str table: table name
+    :param Sequence[str] columns: copied columns, in the order of the values of each row
+    :param Iterable rows: rows of python values (None, bool, int, float, str, datetime, timedelta,
+        shapely geometry)
+
+    :return int: number of rows written
+    """
+    # pending ORM objects first, rows may reference them
+    session.flush()
+    cursor = session.connection().connection.cursor()
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    sql = f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+    count = 0
+    rows = iter(rows)
+    try:
+        while chunk := list(islice(rows, COPY_CHUNK_SIZE)):
+            buffer = io.StringIO()
+            buffer.writelines(",".join(format_value(v) for v in row) + "\n" for row in chunk)
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+            count += len(chunk)
+    finally:
+        cursor.close()
+    return count
+
+
+def write_csv(df: pd.DataFrame, buffer: io.StringIO) -> None:
+    """Writes a DataFrame as CSV for COPY"""
+    df = df.copy()
+    # pandas formats timestamps with time zone slowly, ISO strings are built with numpy
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.DatetimeTZDtype):
+            values = df[column].dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+            iso = np.char.add(np.datetime_as_string(values, unit="us"), "+00:00")
+            df[column] = np.where(pd.isna(values), "", iso)
+    df.to_csv(buffer, header=False, index=False)
+
+
+def copy_frame(session: Session, table: str, df: pd.DataFrame) -> int:
+    """Writes the rows of a DataFrame to a table with COPY ... FROM STDIN (FORMAT csv), one column
+    per DataFrame column. The CSV is written by pandas: missing values (NaN, NaT, None) and empty
+    strings are written as NULL, geometries must be EWKB hex strings.
+
+    :return int: number of rows written
+    """
+    session.flush()
+    cursor = session.connection().connection.cursor()
+    column_list = ", ".join(f'"{column}"' for column in df.columns)
+    sql = f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+    try:
+        for start in range(0, len(df), COPY_CHUNK_SIZE):
+            buffer = io.StringIO()
+            write_csv(df.iloc[start:start + COPY_CHUNK_SIZE], buffer)
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+    return len(df)
+
+
+# little endian EWKB of a point with SRID
+EWKB_POINT = np.dtype([("byte_order", "u1"), ("type", "<u4"), ("srid", "<u4"), ("x", "<f8"), ("y", "<f8")])
+EWKB_POINT_WITH_SRID = 0x20000001
+
+
+def to_ewkb(longitudes, latitudes) -> np.ndarray:
+    """EWKB hex strings of points, to copy a geometry column. Same result as shapely.to_wkb with
+    hex=True and include_srid=True, without building the shapely geometries."""
+    points = np.empty(len(longitudes), dtype=EWKB_POINT)
+    points["byte_order"] = 1
+    points["type"] = EWKB_POINT_WITH_SRID
+    points["srid"] = settings.srid
+    points["x"] = longitudes
+    points["y"] = latitudes
+    hexa = binascii.hexlify(points.tobytes()).upper()
+    return np.frombuffer(hexa, dtype=f"S{2 * EWKB_POINT.itemsize}").astype(str)
+
+
+def allocate_ids(session: Session, table: str, count: int, column: str = "id") -> list[int]:
+    """Reserves count values of the sequence of a serial column, to copy rows with their id."""
+    if count == 0:
+        return []
+    result = session.execute(
+        text("SELECT nextval(pg_get_serial_sequence(:table, :column)) FROM generate_series(1, :count)"),
+        {"table": table, "column": column, "count": count},
+    )
+    return list(result.scalars())
@@ -0,0 +1,64 @@
+"""Columnar reads of query results into DataFrames, for the repository methods returning DataFrames.
+
+The statement is executed on the DBAPI cursor, without building a SQLAlchemy Row per record, and
+each column is converted once to an explicit dtype. Geometries stay raw WKB bytes unless they are
+asked for, they are then decoded in one vectorized shapely call.
+"""
+from collections.abc import Sequence
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import shapely
+from sqlalchemy import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+# dtype of timestamp columns, values are converted to UTC
+DATETIME = "datetime64[ns, UTC]"
+# dtype of geometry columns, WKB bytes or shapely geometries
+GEOMETRY = "geometry"
+
+
+def to_frame(rows: Sequence[tuple], dtypes: dict[str, str], decode_geometries: bool = False) -> pd.DataFrame:
+    """Builds a DataFrame from result rows, one column per dtypes entry, in the order of the values
+    of each row.
+
+    :param Sequence[tuple] rows: result rows
+    :param dict dtypes: {column name: dtype}. Integer columns with NULL values must be float64,
+        DATETIME columns are converted to UTC, GEOMETRY columns hold WKB bytes (None if NULL)
+    :param bool decode_geometries: decodes GEOMETRY columns to shapely geometries
+
+    :return pd.DataFrame: columns of dtypes
+    """
+    values = list(zip(*rows)) if rows else [()] * len(dtypes)
+    columns = {}
+    for (name, dtype), column in zip(dtypes.items(), values):
+        if dtype == DATETIME:
+            columns[name] = pd.to_datetime(pd.Series(column, dtype=object), utc=True)
+        elif dtype == GEOMETRY:
+            column = np.array([None if v is None else bytes(v) for v in column], dtype=object)
+            columns[name] = shapely.from_wkb(column) if decode_geometries else column
+        elif dtype == "float64":
+            columns[name] = np.array(column, dtype=float)
+        else:
+            columns[name] = pd.Series(column, dtype=dtype)
+    return pd.DataFrame(columns, columns=list(dtypes))
+
+
+def fetch_frame(executor: Union[Session, Connection], stmt: Select, dtypes: dict[str, str],
+                decode_geometries: bool = False) -> pd.DataFrame:
+    """Executes a statement on the DBAPI cursor of a session or connection and returns its result
+    as a DataFrame, see to_frame.
+
+    :param Select stmt: statement selecting the columns of dtypes, in the same order
+    """
+    connection = executor.connection() if isinstance(executor, Session) else executor
+    compiled = stmt.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(compiled.string, compiled.params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    return to_frame(rows, dtypes, decode_geometries)
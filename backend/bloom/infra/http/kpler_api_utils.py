@@ -8,4 +8,60 @@ def map_raw_messages_to_domain(raw_messages: list[dict[str, Any]]) -> list[Kpler
     kpler_ais_data = []
     for vessel in raw_messages:
         kpler_ais_data.append(KplerAisData.map_from_kpler(vessel))
-    return kpler_ais_data
\ No newline at end of file
+    return kpler_ais_data
+
+# columns of kpler_ais_data and key of their value in the properties of a Kpler feature
+KPLER_AIS_DATA_PROPERTIES = {
+    "vessel_uid": "vesselUid",
+    "vessel_flag": "flag",
+    "vessel_name": "vesselName",
+    "vessel_callsign": "callsign",
+    "vessel_mmsi": "mmsi",
+    "vessel_imo": "imo",
+    "vessel_marinetraffic_type": "vesselType",
+    "vessel_ais_type": "vesselTypeAis",
+    "vessel_width": "width",
+    "vessel_length": "length",
+    "vessel_grt": "grt",
+    "vessel_dwt": "dwt",
+    "static_timestamp": "staticDt",
+    "static_source": "staticSrc",
+    "static_message_type": "staticMsgType",
+    "position_message_type": "posMsgType",
+    "position_source": "posSrc",
+    "position_course": "cog",
+    "position_heading": "heading",
+    "position_longitude": "longitude",
+    "position_latitude": "latitude",
+    "position_navigational_status": "navStatus",
+    "position_rot": "rot",
+    "position_speed": "sog",
+    "position_timestamp": "posDt",
+    "position_kpler_insert_timestamp": "insertDt",
+    "voyage_destination": "destination",
+    "voyage_draught": "draught",
+    "voyage_eta": "eta",
+}
+INTEGER_COLUMNS = {"position_id", "vessel_uid", "vessel_mmsi", "vessel_imo",
+                   "vessel_ais_type", "static_message_type", "position_message_type",
+                   "position_navigational_status"}
+
+
+def map_raw_messages_to_columns(raw_messages: list[dict[str, Any]]) -> dict[str, list]:
+    """Extracts the kpler_ais_data columns of the features in one pass, without building a
+    KplerAisData per message. The feature itself is kept in the "payload" column.
+
+    :return dict: {column: values, in the order of the features}
+    """
+    properties_columns = list(KPLER_AIS_DATA_PROPERTIES.items())
+    columns = {"position_id": [], **{column: [] for column, _ in properties_columns},
+               "payload": []}
+    for message in raw_messages:
+        properties = message.get("properties") or {}
+        columns["position_id"].append(message.get("id"))
+        for column, key in properties_columns:
+            columns[column].append(properties.get(key))
+        columns["payload"].append(message)
+    for column in INTEGER_COLUMNS:
+        columns[column] = [None if value is None else int(value) for value in columns[column]]
+    return columns
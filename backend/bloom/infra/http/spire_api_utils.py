@@ -1,6 +1,8 @@
+from datetime import datetime, timezone
 from typing import Any
 from bloom.domain.spire_ais_data import SpireAisData
 from gql import Client, gql
+from pydantic import TypeAdapter
 
 from bloom.logger import logger
 
@@ -12,6 +14,84 @@ def map_raw_vessels_to_domain(raw_vessels: list[dict[str, Any]]) -> list[SpireAi
     return spire_ais_data
 
 
+# range of the integer columns of spire_ais_data
+INTEGER_MIN, INTEGER_MAX = -2**31, 2**31 - 1
+
+
+# parses as the pydantic model SpireAisData: any number of digits of fractional seconds (rounded
+# to microseconds), unlike datetime.fromisoformat before Python 3.11
+DATETIME_ADAPTER = TypeAdapter(datetime)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Datetime of an ISO 8601 timestamp of Spire, UTC if it has no time zone"""
+    if not isinstance(value, str):
+        raise TypeError(f"not a timestamp: {value!r}")
+    timestamp = DATETIME_ADAPTER.validate_python(value)
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+# columns of spire_ais_data, with the path of their value in a Spire vessel node and the type
+# it is converted to
+SPIRE_AIS_DATA_FIELDS = {
+    "spire_update_statement": (("updateTimestamp",), parse_timestamp),
+    "vessel_ais_class": (("staticData", "aisClass"), str),
+    "vessel_flag": (("staticData", "flag"), str),
+    "vessel_name": (("staticData", "name"), str),
+    "vessel_callsign": (("staticData", "callsign"), str),
+    "vessel_timestamp": (("staticData", "timestamp"), parse_timestamp),
+    "vessel_update_timestamp": (("staticData", "updateTimestamp"), parse_timestamp),
+    "vessel_ship_type": (("staticData", "shipType"), str),
+    "vessel_sub_ship_type": (("staticData", "shipSubType"), str),
+    "vessel_mmsi": (("staticData", "mmsi"), int),
+    "vessel_imo": (("staticData", "imo"), int),
+    "vessel_width": (("staticData", "dimensions", "width"), int),
+    "vessel_length": (("staticData", "dimensions", "length"), int),
+    "position_accuracy": (("lastPositionUpdate", "accuracy"), str),
+    "position_collection_type": (("lastPositionUpdate", "collectionType"), str),
+    "position_course": (("lastPositionUpdate", "course"), float),
+    "position_heading": (("lastPositionUpdate", "heading"), float),
+    "position_latitude": (("lastPositionUpdate", "latitude"), float),
+    "position_longitude": (("lastPositionUpdate", "longitude"), float),
+    "position_maneuver": (("lastPositionUpdate", "maneuver"), str),
+    "position_navigational_status": (("lastPositionUpdate", "navigationalStatus"), str),
+    "position_rot": (("lastPositionUpdate", "rot"), float),
+    "position_speed": (("lastPositionUpdate", "speed"), float),
+    "position_timestamp": (("lastPositionUpdate", "timestamp"), parse_timestamp),
+    "position_update_timestamp": (("lastPositionUpdate", "updateTimestamp"), parse_timestamp),
+    "voyage_destination": (("currentVoyage", "destination"), str),
+    "voyage_draught": (("currentVoyage", "draught"), float),
+    "voyage_eta": (("currentVoyage", "eta"), parse_timestamp),
+    "voyage_timestamp": (("currentVoyage", "timestamp"), parse_timestamp),
+    "voyage_update_timestamp": (("currentVoyage", "updateTimestamp"), parse_timestamp),
+}
+
+
+def map_raw_vessel_to_row(vessel: dict[str, Any]) -> tuple:
+    """Maps a Spire vessel node to the values of the SPIRE_AIS_DATA_FIELDS columns, without
+    building a SpireAisData. Raises ValueError if a value can't be converted to its type, is not a
+    valid timestamp or is out of the range of its integer column.
+    """
+    row = []
+    for path, convert in SPIRE_AIS_DATA_FIELDS.values():
+        try:
+            value = vessel
+            for key in path:
+                value = value.get(key)
+                if value is None:
+                    break
+            if value is not None and type(value) is not convert:
+                if convert is int and value != int(value):
+                    raise ValueError("not an integer")
+                value = convert(value)
+            if convert is int and value is not None and not INTEGER_MIN <= value <= INTEGER_MAX:
+                raise ValueError(f"{value} out of range")
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f"{'.'.join(path)}: {e}") from e
+        row.append(value)
+    return tuple(row)
+
+
 class Paging:
     def __init__(self, vessel_list: list[str] = None) -> None:
         self._vessel_list = vessel_list
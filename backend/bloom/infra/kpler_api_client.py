@@ -1,5 +1,10 @@
 from bloom.config import settings
-from typing import Any
+from typing import Any, Optional
+import asyncio
+import json
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, perf_counter
 import aiohttp
 from urllib.parse import urljoin
 from bloom.logger import logger
@@ -8,14 +13,87 @@ from bloom.logger import logger
 class KplerApiError(Exception):
     pass
 
+
+class TokenBucket:
+    """Rate limiter shared by concurrent requests: a request takes a token, tokens are refilled
+    at rate per second up to capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = monotonic()
+                refill = (now - self.updated_at) * self.rate
+                self.tokens = min(self.capacity, self.tokens + refill)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Delay in seconds of a Retry-After header (seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        delay = parsedate_to_datetime(value) - datetime.now(timezone.utc)
+        return max(0.0, delay.total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
 class KplerApiClient:
+    """Client of the Kpler API, to use as an async context manager so that its connections
+    are closed. Connections are pooled and kept alive between requests. Requests answered with
+    429 or 5xx, or whose connection failed, are retried honouring Retry-After. All the requests
+    of the client are rate limited by the same token bucket.
+
+    Counters: request_count, retry_count, bytes_received, latency (total time of the requests,
+    in seconds)
+    """
     FORMAT = 'json'
 
-    def __init__(self):
+    def __init__(self, rate_limiter: Optional[TokenBucket] = None):
         self.api_root = settings.kpler_api_root
         self.api_token = settings.kpler_token
-        conn = aiohttp.TCPConnector()
-        self.http_session = aiohttp.ClientSession(connector=conn)
+        self.max_retries = settings.kpler_max_retries
+        self.retry_backoff = settings.kpler_retry_backoff
+        self.rate_limiter = rate_limiter or TokenBucket(settings.kpler_rate_limit)
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        self.request_count = 0
+        self.retry_count = 0
+        self.bytes_received = 0
+        self.latency = 0.0
+
+    def open(self) -> aiohttp.ClientSession:
+        if self.http_session is None or self.http_session.closed:
+            conn = aiohttp.TCPConnector(limit=settings.kpler_pool_size,
+                                        keepalive_timeout=settings.kpler_keepalive_timeout)
+            self.http_session = aiohttp.ClientSession(
+                connector=conn,
+                timeout=aiohttp.ClientTimeout(total=settings.kpler_timeout),
+            )
+        return self.http_session
+
+    async def __aenter__(self) -> "KplerApiClient":
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
 
     async def get(self, endpoint: str, params=None, **kwargs) -> Any:
         if params is None:
@@ -24,16 +102,39 @@ class KplerApiClient:
         headers={"Authorization": "Basic " + self.api_token,
                  "Accept": "application/json"}
         path = urljoin(self.api_root, endpoint)
+        http_session = self.open()
 
-        logger.debug(f"GET {path}, params={params}")
-        async with self.http_session.get(path, params=params, headers=headers) as resp:
-            if resp.status == 204:
-                return None
-            elif resp.ok:
-                response = await resp.json()
-                return response
-            else:
-                resp.raise_for_status()
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            logger.debug(f"GET {path}, params={params}")
+            start = perf_counter()
+            delay = None
+            try:
+                async with http_session.get(path, params=params, headers=headers) as resp:
+                    body = await resp.read()
+                    self.bytes_received += len(body)
+                    if resp.status == 204:
+                        return None
+                    elif resp.ok:
+                        return json.loads(body)
+                    elif (resp.status != 429 and resp.status < 500
+                          or attempt == self.max_retries):
+                        resp.raise_for_status()
+                    delay = retry_after(resp.headers.get("Retry-After"))
+                    error = f"HTTP {resp.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                error = repr(e)
+            finally:
+                self.request_count += 1
+                self.latency += perf_counter() - start
+            if delay is None:
+                delay = self.retry_backoff * 2 ** attempt
+            self.retry_count += 1
+            logger.warning(f"GET {path}: {error}, nouvel essai dans {delay:.1f}s")
+            await asyncio.sleep(delay)
 
     async def close(self):
-        await self.http_session.close()
\ No newline at end of file
+        if self.http_session is not None:
+            await self.http_session.close()
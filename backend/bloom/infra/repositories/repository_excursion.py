@@ -6,18 +6,40 @@ from bloom.routers.requests import DatetimeRangeRequest
 from dependency_injector.providers import Callable
 from geoalchemy2.shape import from_shape, to_shape
 from sqlalchemy import desc, and_, or_
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, values, column, func, Integer, DateTime, Double
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import and_,or_, asc, desc
 
+from bloom.config import settings
 from bloom.domain.excursion import Excursion
 from bloom.infra.database import sql_model
+from bloom.infra.database.frame_reader import DATETIME, fetch_frame
 
 from bloom.routers.requests import ( DatetimeRangeRequest,
                                      OrderByRequest,
                                         PageParams,
                                         OrderByEnum)
 
+# number of ids of the IN clauses of the queries by ids
+IDS_CHUNK_SIZE = 5000
+
+CURRENT_EXCURSIONS_DTYPES = {"excursion_id": "int64", "vessel_id": "int64", "arrival_at": DATETIME}
+
+# columns updated with the time spent in each type of zone
+EXCURSION_DURATIONS_COLUMNS = [
+    "id",
+    "excursion_duration",
+    "total_time_at_sea",
+    "total_time_in_amp",
+    "total_time_in_territorial_waters",
+    "total_time_in_zones_with_no_fishing_rights",
+    "total_time_fishing",
+    "total_time_fishing_in_amp",
+    "total_time_fishing_in_territorial_waters",
+    "total_time_fishing_in_zones_with_no_fishing_rights",
+    "total_time_default_ais",
+]
+
 
 class ExcursionRepository:
     def __init__(
@@ -41,6 +63,27 @@ class ExcursionRepository:
             return None
         return {"arrival_port_id": result.arrival_port_id, "arrival_position": result.arrival_position}
 
+    def get_last_excursions_arrivals(self, session: Session, vessel_ids: list[int]) -> dict[int, dict]:
+        """Recherche en une requête l'excursion la plus récente de chaque bateau et retourne pour chacun
+        l'arrival_port_id et la position d'arrivée (comme get_param_from_last_excursion)."""
+        if not vessel_ids:
+            return {}
+        sql = select(
+            sql_model.Excursion.vessel_id,
+            sql_model.Excursion.arrival_port_id,
+            sql_model.Excursion.arrival_position
+        ).where(
+            sql_model.Excursion.vessel_id.in_(vessel_ids)
+        ).distinct(
+            sql_model.Excursion.vessel_id
+        ).order_by(
+            sql_model.Excursion.vessel_id,
+            desc(sql_model.Excursion.departure_at)
+        )
+        return {r.vessel_id: {"arrival_port_id": r.arrival_port_id,
+                              "arrival_position": to_shape(r.arrival_position) if r.arrival_position else None}
+                for r in session.execute(sql)}
+
     def get_excursions_by_vessel_id(self,
                                     session: Session,
                                     vessel_id: int,
@@ -86,6 +129,16 @@ class ExcursionRepository:
             return None
         return ExcursionRepository.map_to_domain(e)
 
+    def get_excursions_by_ids(self, session: Session, ids: list[int]) -> dict[int, Excursion]:
+        """Recherche les excursions, indexées par id, par requêtes de IDS_CHUNK_SIZE ids"""
+        result = {}
+        for start in range(0, len(ids), IDS_CHUNK_SIZE):
+            sql = select(sql_model.Excursion).where(
+                sql_model.Excursion.id.in_(ids[start:start + IDS_CHUNK_SIZE]))
+            result.update((e.id, ExcursionRepository.map_to_domain(e))
+                          for e in session.execute(sql).scalars())
+        return result
+
     def get_vessel_current_excursion(self, session: Session, vessel_id: int) -> Union[Excursion, None]:
         """Recheche l'excursion en cours d'un bateau, c'est-à-dire l'excursion qui n'a pas de date d'arrivée"""
         sql = select(sql_model.Excursion).where(sql_model.Excursion.vessel_id == vessel_id).where(
@@ -102,10 +155,7 @@ class ExcursionRepository:
             sql_model.Excursion.vessel_id,
             sql_model.Excursion.arrival_at
         ).where(sql_model.Excursion.arrival_at == None)
-        excursions = session.execute(sql)
-        if not excursions:
-            return None
-        return pd.DataFrame(excursions, columns=["excursion_id", "vessel_id", "arrival_at"])
+        return fetch_frame(session, sql, CURRENT_EXCURSIONS_DTYPES)
 
     def create_excursion(self, session: Session, excursion: Excursion) -> Excursion:
         orm_excursion = ExcursionRepository.map_to_sql(excursion)
@@ -119,6 +169,46 @@ class ExcursionRepository:
         session.flush()
         return [ExcursionRepository.map_to_domain(orm) for orm in orm_list]
 
+    def batch_insert_excursion(self, session: Session, excursions: list[Excursion]) -> list[int]:
+        """Insère les excursions en une requête et retourne leurs id, dans l'ordre de la liste"""
+        if not excursions:
+            return []
+        items = []
+        for excursion in excursions:
+            item = excursion.model_dump(exclude={"id", "created_at", "updated_at"})
+            for position in ("departure_position", "arrival_position"):
+                if item[position] is not None:
+                    item[position] = from_shape(item[position], srid=settings.srid)
+            items.append(item)
+        stmt = insert(sql_model.Excursion).returning(sql_model.Excursion.id, sort_by_parameter_order=True)
+        return list(session.scalars(stmt, items))
+
+    def batch_close_excursion(self, session: Session, closures: list[dict[str, Any]]) -> None:
+        """Clôture les excursions en une requête UPDATE ... FROM (VALUES ...)
+
+        :param list closures: fields "id", "arrival_port_id", "arrival_at", "longitude", "latitude"
+        """
+        if not closures:
+            return
+        closed = values(
+            column("id", Integer),
+            column("arrival_port_id", Integer),
+            column("arrival_at", DateTime(timezone=True)),
+            column("longitude", Double),
+            column("latitude", Double),
+            name="closed",
+        ).data([(c["id"], c["arrival_port_id"], c["arrival_at"], c["longitude"], c["latitude"])
+                for c in closures])
+        stmt = update(sql_model.Excursion).where(
+            sql_model.Excursion.id == closed.c.id
+        ).values(
+            arrival_port_id=closed.c.arrival_port_id,
+            arrival_at=closed.c.arrival_at,
+            arrival_position=func.ST_SetSRID(func.ST_MakePoint(closed.c.longitude, closed.c.latitude),
+                                             settings.srid),
+        ).execution_options(synchronize_session=False)
+        session.execute(stmt)
+
     def update_excursion(self, session: Session, excursion: Excursion) -> Excursion:
         orm_excursion = ExcursionRepository.map_to_sql(excursion)
         res = session.merge(orm_excursion)
@@ -134,6 +224,15 @@ class ExcursionRepository:
             updated_excursion.append(ExcursionRepository.map_to_domain(orm))
         return updated_excursion
 
+    def batch_update_excursion_durations(self, session: Session, excursions: list[Excursion]) -> None:
+        """Mise à jour en une requête des seules durées cumulées des excursions"""
+        if not excursions:
+            return
+        session.execute(update(sql_model.Excursion), [
+            {column: getattr(excursion, column) for column in EXCURSION_DURATIONS_COLUMNS}
+            for excursion in excursions
+        ])
+
     def get_excursion_by_id(self, session: Session, excursion_id: int) -> Excursion:
         entity = session.get(sql_model.Excursion, excursion_id)  # .scalar()
         if entity is not None:
@@ -181,7 +280,7 @@ class ExcursionRepository:
             excursion_duration=excursion.excursion_duration,
             total_time_at_sea=excursion.total_time_at_sea,
             total_time_in_amp=excursion.total_time_in_amp,
-            total_time_in_territorial_waters=excursion.total_time_fishing_in_territorial_waters,
+            total_time_in_territorial_waters=excursion.total_time_in_territorial_waters,
             total_time_in_zones_with_no_fishing_rights=excursion.total_time_in_zones_with_no_fishing_rights,
             total_time_fishing=excursion.total_time_fishing,
             total_time_fishing_in_amp=excursion.total_time_fishing_in_amp,
@@ -207,7 +306,7 @@ class ExcursionRepository:
             excursion_duration=excursion.excursion_duration,
             total_time_at_sea=excursion.total_time_at_sea,
             total_time_in_amp=excursion.total_time_in_amp,
-            total_time_in_territorial_waters=excursion.total_time_fishing_in_territorial_waters,
+            total_time_in_territorial_waters=excursion.total_time_in_territorial_waters,
             total_time_in_zones_with_no_fishing_rights=excursion.total_time_in_zones_with_no_fishing_rights,
             total_time_fishing=excursion.total_time_fishing,
             total_time_fishing_in_amp=excursion.total_time_fishing_in_amp,
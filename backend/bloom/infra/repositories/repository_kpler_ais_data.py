@@ -1,7 +1,13 @@
+import json
+from typing import Optional
+
+from bloom.config import settings
 from bloom.domain.kpler_ais_data import KplerAisData
 import pandas as pd
 from bloom.infra.database import sql_model
+from bloom.infra.database.bulk_copy import copy_rows
 from dependency_injector.providers import Callable
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
 
@@ -11,12 +17,33 @@ class KplerAisDataRepository:
         self.session_factory = session_factory
 
     def batch_create_ais_data(
-            self, ais_list: list[KplerAisData], session: Session
-    ) -> list[KplerAisData]:
+            self, ais_list: list[KplerAisData], session: Session, map_result: bool = True
+    ) -> Optional[list[KplerAisData]]:
         orm_list = [KplerAisDataRepository.map_to_orm(ais) for ais in ais_list]
         session.add_all(orm_list)
+        if not map_result:
+            return None
         return [KplerAisDataRepository.map_to_domain(orm) for orm in orm_list]
-    
+
+    def batch_insert_ais_data_columns(self, session: Session, columns: dict[str, list]) -> int:
+        """Inserts the messages extracted by map_raw_messages_to_columns, with COPY from
+        bulk_copy_threshold messages and one multi-row INSERT below
+
+        :return int: number of messages inserted
+        """
+        count = len(columns["payload"])
+        if count >= settings.bulk_copy_threshold:
+            # the payload is written as JSON text, cast to jsonb by COPY
+            payloads = [json.dumps(payload) for payload in columns["payload"]]
+            columns = columns | {"payload": payloads}
+            return copy_rows(session, sql_model.KplerAisData.__tablename__, list(columns),
+                             zip(*columns.values()))
+        if count > 0:
+            names = list(columns)
+            session.execute(insert(sql_model.KplerAisData),
+                            [dict(zip(names, row)) for row in zip(*columns.values())])
+        return count
+
     @staticmethod
     def map_to_orm(data: KplerAisData) -> sql_model.KplerAisData:
         return sql_model.KplerAisData(**data.__dict__)
@@ -10,7 +10,25 @@ from bloom.infra.database import sql_model
 
 from sqlalchemy import and_, or_, select, update, text, join
 
-
+from bloom.config import settings
+from bloom.infra.database.bulk_copy import copy_rows
+
+# fct_metrics columns written by COPY, "enable" is left to its server default
+METRICS_COPY_COLUMNS = [
+    "timestamp",
+    "vessel_id",
+    "type",
+    "vessel_mmsi",
+    "ship_name",
+    "vessel_country_iso3",
+    "vessel_imo",
+    "duration_total",
+    "duration_fishing",
+    "zone_name",
+    "zone_id",
+    "zone_category",
+    "zone_sub_category",
+]
 
 
 class MetricsRepository:
@@ -47,6 +65,10 @@ class MetricsRepository:
     def batch_create_metrics(
             self, session: Session, metricss: list[Metrics]
     ) -> list[Metrics]:
+        if len(metricss) >= settings.bulk_copy_threshold:
+            copy_rows(session, sql_model.Metrics.__tablename__, METRICS_COPY_COLUMNS,
+                      ([getattr(metrics, c) for c in METRICS_COPY_COLUMNS] for metrics in metricss))
+            return metricss
         orm_list = [MetricsRepository.map_to_orm(metrics) for metrics in metricss]
         session.add_all(orm_list)
         return [MetricsRepository.map_to_domain(orm) for orm in orm_list]
@@ -2,6 +2,9 @@
 from datetime import datetime
 from typing import Any, List, Union
 
+import pandas as pd
+import shapely
+
 from bloom.config import settings
 from bloom.domain.port import Port
 from bloom.infra.database import sql_model
@@ -100,6 +103,18 @@ class PortRepository:
         return res
 
 
+    def get_ports_buffers(self, session: Session) -> pd.DataFrame:
+        """Returns id, geometry_point coordinates and geometry_buffer of every port with a buffer,
+        in one query, to build a geo.PortIndex
+
+        :return pd.DataFrame: fields "id", "longitude", "latitude", "geometry_buffer" (shapely)
+        """
+        rows = session.execute(text("""SELECT id, ST_X(geometry_point), ST_Y(geometry_point), ST_AsBinary(geometry_buffer)
+                                FROM dim_port WHERE geometry_buffer IS NOT NULL AND geometry_point IS NOT NULL""")).all()
+        df = pd.DataFrame(rows, columns=["id", "longitude", "latitude", "geometry_buffer"])
+        df["geometry_buffer"] = shapely.from_wkb([bytes(wkb) for wkb in df["geometry_buffer"]])
+        return df
+
     def update_port_has_excursion(self, session : Session, port_id: int ):
         stmt = (
             update(sql_model.Port)
@@ -108,6 +123,17 @@ class PortRepository:
         )
         session.execute(stmt)
 
+    def batch_update_port_has_excursion(self, session: Session, port_ids: set[int]) -> None:
+        if not port_ids:
+            return
+        stmt = (
+            update(sql_model.Port)
+            .where(sql_model.Port.id.in_(list(port_ids)))
+            .values(has_excursion=True)
+            .execution_options(synchronize_session=False)
+        )
+        session.execute(stmt)
+
     def has_excursion_for_port(self, session: Session, port_id: int) -> bool:
         stmt = select(sql_model.Excursion).where(
             (sql_model.Excursion.departure_port_id == port_id) |
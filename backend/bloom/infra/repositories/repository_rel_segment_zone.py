@@ -1,13 +1,19 @@
 from sqlalchemy.orm import Session
 
+from bloom.config import settings
 from bloom.domain.rel_segment_zone import RelSegmentZone
 from bloom.infra.database import sql_model
+from bloom.infra.database.bulk_copy import copy_rows
 
 
 class RelSegmentZoneRepository:
 
     @staticmethod
     def batch_create_rel_segment_zone(session: Session, rels: list[RelSegmentZone]) -> list[RelSegmentZone]:
+        if len(rels) >= settings.bulk_copy_threshold:
+            copy_rows(session, sql_model.RelSegmentZone.__tablename__, ["segment_id", "zone_id"],
+                      ((rel.segment_id, rel.zone_id) for rel in rels))
+            return rels
         orm_list = [RelSegmentZoneRepository.map_to_orm(rel) for rel in rels]
         session.add_all(orm_list)
         session.flush()
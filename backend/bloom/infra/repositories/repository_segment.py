@@ -4,12 +4,12 @@ from typing import Any, List, Union
 
 import pandas as pd
 from dependency_injector.providers import Callable
-from geoalchemy2.functions import ST_Within
+from geoalchemy2.functions import ST_Within, ST_X, ST_Y
 from geoalchemy2.shape import from_shape, to_shape
-from shapely import wkb
 from sqlalchemy import and_, or_, select, update, text, join
 from sqlalchemy.orm import Session
 
+from bloom.config import settings
 from bloom.logger import logger
 from bloom.domain.segment import Segment
 from bloom.domain.vessel import Vessel
@@ -17,9 +17,53 @@ from bloom.domain.vessel import Vessel
 from bloom.domain.vessel_last_position import VesselLastPosition
 from bloom.domain.zone import Zone
 from bloom.infra.database import sql_model
+from bloom.infra.database.bulk_copy import allocate_ids, copy_rows
+from bloom.infra.database.frame_reader import DATETIME, GEOMETRY, fetch_frame
+from bloom.infra.repositories.repository_excursion import IDS_CHUNK_SIZE
 from bloom.infra.repositories.repository_zone import ZoneRepository
 from bloom.infra.repositories.repository_vessel import VesselRepository
 
+LAST_VESSEL_SEGMENTS_DTYPES = {
+    "vessel_id": "int64",
+    "segment_id": "int64",
+    "excursion_id": "int64",
+    "timestamp_end": DATETIME,
+    "heading_at_end": "float64",
+    "speed_at_end": "float64",
+    "arrival_port_id": "float64",
+    "mmsi": "Int64",
+    "end_position": GEOMETRY,
+}
+SEGMENT_COPY_COLUMNS = [
+    "id",
+    "excursion_id",
+    "timestamp_start",
+    "timestamp_end",
+    "segment_duration",
+    "start_position",
+    "end_position",
+    "course",
+    "distance",
+    "average_speed",
+    "speed_at_start",
+    "speed_at_end",
+    "heading_at_start",
+    "heading_at_end",
+    "type",
+    "in_amp_zone",
+    "in_territorial_waters",
+    "in_zone_with_no_fishing_rights",
+    "last_vessel_segment",
+]
+
+# columns updated once the zones of the segments are known
+SEGMENT_ZONES_FLAGS_COLUMNS = [
+    "id",
+    "in_amp_zone",
+    "in_territorial_waters",
+    "in_zone_with_no_fishing_rights",
+]
+
 
 class SegmentRepository:
     def __init__(
@@ -135,16 +179,29 @@ class SegmentRepository:
         else:
             return []
 
-    def get_last_vessel_id_segments(self, session: Session) -> pd.DataFrame:
+    def get_last_vessel_id_segments(self, session: Session, coordinates: bool = False) -> pd.DataFrame:
+        """Last segment of each vessel, with the arrival port of its excursion.
+
+        :param bool coordinates: returns the end position as float columns "longitude" and
+            "latitude" (read with ST_X/ST_Y) instead of a column "end_position" of shapely points
+        """
+        dtypes = dict(LAST_VESSEL_SEGMENTS_DTYPES)
+        if coordinates:
+            end_position = [ST_X(sql_model.Segment.end_position), ST_Y(sql_model.Segment.end_position)]
+            del dtypes["end_position"]
+            dtypes.update(longitude="float64", latitude="float64")
+        else:
+            end_position = [sql_model.Segment.end_position]
         stmt = select(
             sql_model.Vessel.id,
+            sql_model.Segment.id,
             sql_model.Segment.excursion_id,
-            sql_model.Segment.end_position,
             sql_model.Segment.timestamp_end,
             sql_model.Segment.heading_at_end,
             sql_model.Segment.speed_at_end,
             sql_model.Excursion.arrival_port_id,
-            sql_model.Vessel.mmsi
+            sql_model.Vessel.mmsi,
+            *end_position,
         ).join(
             sql_model.Excursion,
             sql_model.Segment.excursion_id == sql_model.Excursion.id
@@ -155,53 +212,14 @@ class SegmentRepository:
         ).filter(
             sql_model.Segment.last_vessel_segment == True
         )
-        q = session.execute(stmt)
-        if not q:
-            return None
-        df = pd.DataFrame(q, columns=["vessel_id", "excursion_id", "end_position", "timestamp_end", 'heading_at_end',
-                                      'speed_at_end', 'arrival_port_id', 'mmsi'])
-        df["end_position"] = df["end_position"].astype(str).apply(wkb.loads)
-        return df
-
-    
-    def get_vessel_attribute_by_segment(self, session: Session, segment_id: int) -> str:
-        stmt = select(
-        sql_model.Vessel.country_iso3
-    ).select_from(
-        sql_model.Segment
-    ).join(
-        sql_model.Excursion, sql_model.Segment.excursion_id == sql_model.Excursion.id
-    ).join(
-        sql_model.Vessel, sql_model.Excursion.vessel_id == sql_model.Vessel.id
-    ).filter(
-        sql_model.Segment.id == segment_id
-    )
-        
-        result = session.execute(stmt).scalar()
+        return fetch_frame(session, stmt, dtypes, decode_geometries=True)
 
-        return result
-    
 
-    def get_vessel_attribute_by_segment_created_updated_after(self, session: Session, segment_id: int, created_updated_after: datetime) -> Vessel:
+    def get_vessels_by_segment_ids(self, session: Session, segment_ids: list[int]) -> dict[int, Vessel]:
+        """Recherche le bateau de chaque segment, indexé par id de segment, par requêtes de
+        IDS_CHUNK_SIZE ids"""
         stmt = (
-            select(
-                sql_model.Vessel
-                
-                #ql_model.Vessel.id,
-                #sql_model.Vessel.mmsi,
-                #sql_model.Vessel.ship_name,
-                #sql_model.Vessel.country_iso3,
-                #sql_model.Vessel.imo
-            )
-            .where(
-                or_(
-                    and_(
-                        sql_model.Segment.updated_at.is_(None),
-                        sql_model.Segment.created_at > created_updated_after
-                    ),
-                    sql_model.Segment.updated_at > created_updated_after
-                )
-            )
+            select(sql_model.Segment.id, sql_model.Vessel)
             .select_from(sql_model.Segment)
             .join(
                 sql_model.Excursion, sql_model.Segment.excursion_id == sql_model.Excursion.id
@@ -209,24 +227,36 @@ class SegmentRepository:
             .join(
                 sql_model.Vessel, sql_model.Excursion.vessel_id == sql_model.Vessel.id
             )
-            .filter(sql_model.Segment.id == segment_id)
         )
-
-        vessel = session.execute(stmt).scalar()
-        if not vessel:
-            return None
-        else:
-            return VesselRepository.map_to_domain(vessel)
-        #df = pd.DataFrame(result, columns=["vessel_id", "vessel_mmsi", "ship_name", "vessel_country_iso3","vessel_imo"])
-        #return df
+        vessels = {}
+        result = {}
+        for start in range(0, len(segment_ids), IDS_CHUNK_SIZE):
+            chunk = segment_ids[start:start + IDS_CHUNK_SIZE]
+            for segment_id, vessel in session.execute(stmt.where(sql_model.Segment.id.in_(chunk))):
+                if vessel.id not in vessels:
+                    vessels[vessel.id] = VesselRepository.map_to_domain(vessel)
+                result[segment_id] = vessels[vessel.id]
+        return result
 
     def batch_create_segment(
             self, session: Session, segments: list[Segment]
     ) -> list[Segment]:
+        if len(segments) >= settings.bulk_copy_threshold:
+            return SegmentRepository.copy_segments(session, segments)
         orm_list = [SegmentRepository.map_to_orm(segment) for segment in segments]
         session.add_all(orm_list)
         return [SegmentRepository.map_to_domain(orm) for orm in orm_list]
 
+    @staticmethod
+    def copy_segments(session: Session, segments: list[Segment]) -> list[Segment]:
+        """Writes the segments with COPY, their ids are allocated beforehand and set on the segments"""
+        ids = allocate_ids(session, sql_model.Segment.__tablename__, len(segments))
+        for segment, id in zip(segments, ids):
+            segment.id = id
+        copy_rows(session, sql_model.Segment.__tablename__, SEGMENT_COPY_COLUMNS,
+                  ([getattr(segment, c) for c in SEGMENT_COPY_COLUMNS] for segment in segments))
+        return segments
+
     def get_segments_created_updated_after(self, session: Session, created_updated_after: datetime) -> list[Segment]:
         stmt = select(sql_model.Segment).where(
             or_(and_(sql_model.Segment.updated_at == None, sql_model.Segment.created_at > created_updated_after),
@@ -254,23 +284,11 @@ class SegmentRepository:
         return dict
     
 
-    def find_segments_in_zones_created_updated_after(self, session: Session, created_after: datetime) -> dict[
-        Segment, list[Zone]]:
-        stmt = select(sql_model.Segment, sql_model.Zone).where(sql_model.Segment.created_at > created_after
-                                                               ).outerjoin(sql_model.Zone, and_(
-            ST_Within(sql_model.Segment.start_position, sql_model.Zone.geometry),
-            ST_Within(sql_model.Segment.end_position, sql_model.Zone.geometry))
-                                                                           ).order_by(
-            sql_model.Segment.created_at.asc())
-        result = session.execute(stmt)
-        dict = {}
-        for (segment_orm, zone_orm) in result:
-            segment = SegmentRepository.map_to_domain(segment_orm)
-            dict.setdefault(segment, [])
-            zone = ZoneRepository.map_to_domain(zone_orm) if zone_orm else None
-            if zone:
-                dict[segment].append(zone)
-        return dict
+    def get_segments_created_after(self, session: Session, created_after: datetime) -> list[Segment]:
+        stmt = select(sql_model.Segment).where(sql_model.Segment.created_at > created_after
+                                               ).order_by(sql_model.Segment.created_at.asc())
+        result = session.execute(stmt).scalars()
+        return [SegmentRepository.map_to_domain(orm) for orm in result]
 
     def batch_update_segment(self, session: Session, segments: list[Segment]) -> list[Segment]:
         updated_segments = []
@@ -281,27 +299,46 @@ class SegmentRepository:
             updated_segments.append(SegmentRepository.map_to_domain(orm))
         return updated_segments
 
-    # Mise à jour des derniers segments des excursions. En 2 étapes
-    # passe à False de la colonne last_vessel_segment pour tous les segments des excursions transmises
-    # passe à True la colonne last_vessel_segment pour tous les Id de segments les plus récent de chaque excursion
+    def batch_update_segment_zones_flags(self, session: Session, segments: list[Segment]) -> None:
+        """Mise à jour en une requête des seuls indicateurs de présence en zone des segments"""
+        if not segments:
+            return
+        session.execute(update(sql_model.Segment), [
+            {column: getattr(segment, column) for column in SEGMENT_ZONES_FLAGS_COLUMNS}
+            for segment in segments
+        ])
+
+    # Mise à jour des derniers segments des bateaux en une requête
+    # passe à True la colonne last_vessel_segment pour le segment le plus récent de chaque bateau transmis
+    # et à False pour ses autres segments
     def update_last_segments(self, session: Session, vessel_ids: list[int]) -> int:
-        for v_id in vessel_ids:
-            upd1 = (update(sql_model.Segment).
-                where(
-                    sql_model.Segment.id.in_(select(sql_model.Segment.id).join(sql_model.Excursion).where(sql_model.Excursion.vessel_id == v_id))).
-            values(last_vessel_segment=False))
-            session.execute(upd1)
-        session.flush()
-        last_segments = session.execute(text("""SELECT DISTINCT ON (vessel_id) s.id FROM fct_segment s
-                                                JOIN fct_excursion e ON e.id = s.excursion_id
-                                                WHERE vessel_id in :vessel_ids 
-                                                ORDER BY vessel_id, timestamp_start DESC"""),
-                                        {"vessel_ids": tuple(vessel_ids)}).all()
-        ids = [r[0] for r in last_segments]
-        upd2 = update(sql_model.Segment).where(sql_model.Segment.id.in_(ids)).values(
-            last_vessel_segment=True)
-        session.execute(upd2)
-        return len(ids)
+        if not vessel_ids:
+            return 0
+        # only the segments whose flag changes are updated, the statement returns the number of last segments
+        return session.execute(text("""WITH last AS (
+                                            SELECT DISTINCT ON (e.vessel_id) s.id FROM fct_segment s
+                                            JOIN fct_excursion e ON e.id = s.excursion_id
+                                            WHERE e.vessel_id = ANY(:vessel_ids)
+                                            ORDER BY e.vessel_id, s.timestamp_start DESC
+                                        ), updated AS (
+                                            UPDATE fct_segment s
+                                            SET last_vessel_segment = s.id IN (SELECT id FROM last), updated_at = now()
+                                            FROM fct_excursion e
+                                            WHERE e.id = s.excursion_id AND e.vessel_id = ANY(:vessel_ids)
+                                            AND s.last_vessel_segment IS DISTINCT FROM (s.id IN (SELECT id FROM last))
+                                        )
+                                        SELECT count(*) FROM last"""),
+                               {"vessel_ids": list(vessel_ids)}).scalar_one()
+
+    def replace_last_segments(self, session: Session, previous_ids: list[int], new_ids: list[int]) -> int:
+        """Mise à jour incrémentale des derniers segments, quand ils sont déjà connus : seuls les anciens
+        et les nouveaux derniers segments de chaque bateau sont modifiés"""
+        if not new_ids:
+            return 0
+        session.execute(text("""UPDATE fct_segment SET last_vessel_segment = (id = ANY(:new_ids)), updated_at = now()
+                                WHERE id = ANY(:ids)"""),
+                        {"new_ids": list(new_ids), "ids": list(previous_ids) + list(new_ids)})
+        return len(new_ids)
 
     @staticmethod
     def map_to_domain(segment: sql_model.Segment) -> Segment:
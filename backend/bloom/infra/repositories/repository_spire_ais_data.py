@@ -1,10 +1,14 @@
 import pandas as pd
 from bloom.domain.spire_ais_data import SpireAisData
 from bloom.infra.database import sql_model
+from bloom.infra.database.bulk_copy import copy_frame, copy_rows
+from bloom.infra.database.frame_reader import DATETIME, fetch_frame, to_frame
+from bloom.infra.http.spire_api_utils import SPIRE_AIS_DATA_FIELDS
 from dependency_injector.providers import Callable
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_
+from sqlalchemy import Select, select, and_, tuple_
 from datetime import datetime
+from typing import Iterable, Iterator
 from bloom.logger import logger
 
 
@@ -13,6 +17,26 @@ class SpireAisDataRepository:
     ORDER_BY_POSITION = "position"
     ORDER_BY_VOYAGE = "VOYAGE"
 
+    DATA_BETWEEN_DATE_DTYPES = {
+        "id": "int64",
+        "spire_update_statement": DATETIME,
+        "vessel_mmsi": "Int64",
+        "vessel_id": "int64",
+        "position_accuracy": "object",
+        "position_collection_type": "object",
+        "position_course": "float64",
+        "position_heading": "float64",
+        "position_latitude": "float64",
+        "position_longitude": "float64",
+        "position_maneuver": "object",
+        "position_navigational_status": "object",
+        "position_rot": "float64",
+        "position_speed": "float64",
+        "position_timestamp": DATETIME,
+        "position_update_timestamp": DATETIME,
+        "created_at": DATETIME,
+    }
+
     def __init__(self, session_factory: Callable) -> None:
         self.session_factory = session_factory
 
@@ -30,6 +54,20 @@ class SpireAisDataRepository:
         session.add_all(orm_list)
         return [SpireAisDataRepository.map_to_domain(orm) for orm in orm_list]
 
+    def copy_ais_data_rows(self, session: Session, rows: Iterable[tuple]) -> int:
+        """Writes rows of the SPIRE_AIS_DATA_FIELDS columns (see map_raw_vessel_to_row) with COPY
+
+        :return int: number of rows written
+        """
+        return copy_rows(session, "spire_ais_data", list(SPIRE_AIS_DATA_FIELDS), rows)
+
+    def copy_ais_data_frame(self, session: Session, df: pd.DataFrame) -> int:
+        """Writes a DataFrame of spire_ais_data columns with COPY (see bulk_copy.copy_frame)
+
+        :return int: number of rows written
+        """
+        return copy_frame(session, "spire_ais_data", df)
+
     def get_all_data_after_date(
             self, session: Session, created_updated_after: datetime
     ) -> pd.DataFrame:
@@ -85,7 +123,41 @@ class SpireAisDataRepository:
     def get_all_data_between_date(
             self, session: Session, created_updated_after: datetime, created_updated_before: datetime
     ) -> pd.DataFrame:
-        stmt = select(
+        stmt = SpireAisDataRepository.data_between_date_statement(created_updated_after, created_updated_before)
+        return fetch_frame(session, stmt, SpireAisDataRepository.DATA_BETWEEN_DATE_DTYPES)
+
+    def iter_data_between_date(
+            self, session: Session, created_updated_after: datetime, created_updated_before: datetime,
+            chunk_size: int
+    ) -> Iterator[pd.DataFrame]:
+        """Same data as get_all_data_between_date, read in chunks of at most chunk_size rows
+        by keyset pagination on (created_at, id): each chunk is a query resuming after the
+        created_at and id of the last row of the previous chunk. The session can be committed
+        between the chunks.
+
+        The rows with the same created_at (a whole Spire load) may be split over several chunks.
+        """
+        stmt = SpireAisDataRepository.data_between_date_statement(created_updated_after, created_updated_before)
+        last = None
+        while True:
+            page = stmt
+            if last is not None:
+                # the bound on created_at alone is the index condition of the row comparison
+                page = stmt.where(
+                    sql_model.SpireAisData.created_at >= last[0],
+                    tuple_(sql_model.SpireAisData.created_at, sql_model.SpireAisData.id) > last,
+                )
+            rows = session.execute(page.limit(chunk_size)).all()
+            if rows:
+                yield to_frame(rows, SpireAisDataRepository.DATA_BETWEEN_DATE_DTYPES)
+            if len(rows) < chunk_size:
+                return
+            # id is the first column, created_at the last one
+            last = (rows[-1][-1], rows[-1][0])
+
+    @staticmethod
+    def data_between_date_statement(created_updated_after: datetime, created_updated_before: datetime) -> Select:
+        return select(
             sql_model.SpireAisData.id,
             sql_model.SpireAisData.spire_update_statement,
             sql_model.SpireAisData.vessel_mmsi,
@@ -112,28 +184,7 @@ class SpireAisDataRepository:
                 sql_model.SpireAisData.created_at > created_updated_after,
                 sql_model.SpireAisData.created_at <= created_updated_before
             )
-        ).order_by(sql_model.SpireAisData.created_at.asc())
-        result = session.execute(stmt)
-        return pd.DataFrame(result, columns=[
-            "id",
-            "spire_update_statement",
-            "vessel_mmsi",
-            "vessel_id",
-            "position_accuracy",
-            "position_collection_type",
-            "position_course",
-            "position_heading",
-            "position_latitude",
-            "position_longitude",
-            "position_maneuver",
-            "position_navigational_status",
-            "position_rot",
-            "position_speed",
-            "position_timestamp",
-            "position_update_timestamp",
-            "created_at"
-        ],
-                            )
+        ).order_by(sql_model.SpireAisData.created_at.asc(), sql_model.SpireAisData.id.asc())
 
     def get_all_data_by_mmsi(
             self,
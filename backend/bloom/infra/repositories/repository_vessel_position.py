@@ -10,9 +10,43 @@ from sqlalchemy.orm import Session
 from bloom.config import settings
 from bloom.domain.vessel_position import VesselPosition
 from bloom.infra.database import sql_model
+from bloom.infra.database.bulk_copy import copy_frame, to_ewkb
+from bloom.infra.database.frame_reader import DATETIME, GEOMETRY, fetch_frame
 
 from bloom.logger import logger
 
+VESSEL_POSITION_COPY_COLUMNS = [
+    "vessel_id",
+    "timestamp",
+    "accuracy",
+    "collection_type",
+    "course",
+    "heading",
+    "latitude",
+    "longitude",
+    "maneuver",
+    "navigational_status",
+    "rot",
+    "speed",
+]
+
+POSITIONS_CREATED_AFTER_DTYPES = {
+    "id": "int64",
+    "timestamp": DATETIME,
+    "accuracy": "object",
+    "collection_type": "object",
+    "course": "float64",
+    "heading": "float64",
+    "longitude": "float64",
+    "latitude": "float64",
+    "rot": "float64",
+    "speed": "float64",
+    "created_at": DATETIME,
+    "vessel_id": "int64",
+    "mmsi": "Int64",
+    "position": GEOMETRY,
+}
+
 
 class VesselPositionRepository:
     def __init__(self, session_factory: Callable) -> None:
@@ -29,6 +63,19 @@ class VesselPositionRepository:
         session.add_all(orm_list)
         return [VesselPositionRepository.map_to_domain(orm) for orm in orm_list]
 
+    def batch_create_vessel_position_from_frame(self, session: Session, positions: pd.DataFrame) -> int:
+        """Writes positions with COPY, without domain objects
+
+        :param pd.DataFrame positions: fields "vessel_id", "timestamp", "accuracy", "collection_type",
+            "course", "heading", "latitude", "longitude", "maneuver", "navigational_status", "rot",
+            "speed". The position is computed from longitude and latitude
+
+        :return int: number of positions written
+        """
+        df = positions[VESSEL_POSITION_COPY_COLUMNS].copy()
+        df["position"] = to_ewkb(df["longitude"], df["latitude"])
+        return copy_frame(session, sql_model.VesselPosition.__tablename__, df)
+
     def get_all_vessel_last_positions(self, session: Session) -> List[VesselPosition]:
         
         stmt=select(sql_model.VesselPosition)\
@@ -54,24 +101,29 @@ class VesselPositionRepository:
             return []
 
     def get_positions_with_vessel_created_updated_after(self, session: Session,
-                                                        created_updated_after: datetime) -> pd.DataFrame:
-        stmt = select(sql_model.VesselPosition.id, sql_model.VesselPosition.timestamp,
-                      sql_model.VesselPosition.accuracy, sql_model.VesselPosition.collection_type,
-                      sql_model.VesselPosition.course, sql_model.VesselPosition.heading,
-                      sql_model.VesselPosition.position, sql_model.VesselPosition.longitude,
-                      sql_model.VesselPosition.latitude, sql_model.VesselPosition.rot,
-                      sql_model.VesselPosition.speed, sql_model.VesselPosition.created_at,
-                      sql_model.Vessel.id, sql_model.Vessel.mmsi).where(
+                                                        created_updated_after: datetime,
+                                                        with_position: bool = False) -> pd.DataFrame:
+        """Positions created after a date, sorted by created_at, with the id and mmsi of their vessel.
+
+        :param bool with_position: adds the "position" column of shapely points, not selected by
+            default as "longitude" and "latitude" hold the same coordinates
+        """
+        columns = [sql_model.VesselPosition.id, sql_model.VesselPosition.timestamp,
+                   sql_model.VesselPosition.accuracy, sql_model.VesselPosition.collection_type,
+                   sql_model.VesselPosition.course, sql_model.VesselPosition.heading,
+                   sql_model.VesselPosition.longitude, sql_model.VesselPosition.latitude,
+                   sql_model.VesselPosition.rot, sql_model.VesselPosition.speed,
+                   sql_model.VesselPosition.created_at, sql_model.Vessel.id, sql_model.Vessel.mmsi]
+        dtypes = dict(POSITIONS_CREATED_AFTER_DTYPES)
+        if with_position:
+            columns.append(sql_model.VesselPosition.position)
+        else:
+            del dtypes["position"]
+        stmt = select(*columns).where(
             sql_model.VesselPosition.created_at > created_updated_after
         ).join(sql_model.Vessel, sql_model.VesselPosition.vessel_id == sql_model.Vessel.id).order_by(
             sql_model.VesselPosition.created_at.asc())
-
-        result = session.execute(stmt)
-        df = pd.DataFrame(result,
-                          columns=["id", "timestamp", "accuracy", "collection_type", "course", "heading", "position",
-                                   "longitude", "latitude", "rot", "speed", "created_at", "vessel_id", "mmsi"])
-        df["position"] = df["position"].apply(to_shape)
-        return df
+        return fetch_frame(session, stmt, dtypes, decode_geometries=True)
 
     @staticmethod
     def map_to_sql(position: VesselPosition) -> sql_model.VesselPosition:
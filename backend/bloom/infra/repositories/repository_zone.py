@@ -1,6 +1,9 @@
 from contextlib import AbstractContextManager
 from typing import Any, List, Union, Optional
 
+import pandas as pd
+import shapely
+
 from bloom.domain.zone import Zone, ZoneListView, ZoneSummary
 from bloom.domain.zone_category import ZoneCategory
 from bloom.infra.database import sql_model
@@ -48,6 +51,32 @@ class ZoneRepository:
                        for model in session.execute(session.query(sql_model.Zone)).scalars()]
             return PaginatedResult[list[Zone]](payload=payload)
 
+    def get_zones_without_geometry(self, session: Session) -> list[Zone]:
+        q = session.query(
+            sql_model.Zone.id,
+            sql_model.Zone.category,
+            sql_model.Zone.sub_category,
+            sql_model.Zone.name,
+            sql_model.Zone.json_data,
+            sql_model.Zone.created_at,
+            sql_model.Zone.enable,
+        ).all()
+        return [Zone(id=z.id, category=z.category, sub_category=z.sub_category, name=z.name,
+                     json_data=z.json_data, created_at=z.created_at, enable=z.enable) for z in q]
+
+    def get_zones_tiles(self, session: Session, max_vertices: int = 256) -> pd.DataFrame:
+        """Returns the geometries of the zones cut with ST_Subdivide in tiles of at most max_vertices
+        vertices, to build a geo.ZoneIndex
+
+        :return pd.DataFrame: fields "zone_id", "geometry" (shapely)
+        """
+        rows = session.execute(text("""SELECT id, ST_AsBinary(ST_Subdivide(geometry, :max_vertices))
+                                FROM dim_zone WHERE geometry IS NOT NULL"""),
+                               {"max_vertices": max_vertices}).all()
+        df = pd.DataFrame(rows, columns=["zone_id", "geometry"])
+        df["geometry"] = shapely.from_wkb([bytes(wkb) for wkb in df["geometry"]])
+        return df
+
     def get_all_zones_summary(self, session: Session) -> list[ZoneSummary]:
         q = session.query(
             sql_model.Zone.id,
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, Request
 from bloom.config import settings
 import redis
 from bloom.config import settings
-from bloom.dependencies import (X_API_KEY_HEADER,check_apikey)
+from bloom.dependencies import (X_API_KEY_HEADER,check_apikey,get_response_cache)
 from bloom.container import UseCases
 
 router = APIRouter()
@@ -10,5 +10,17 @@ router = APIRouter()
 @router.get("/cache/all/flush")
 async def cache_all_flush(request:Request,key: str = Depends(X_API_KEY_HEADER)):
     check_apikey(key)
-    UseCases().cache_service().flushall()
-    return {"code":0}
\ No newline at end of file
+    await get_response_cache(request).flush()
+    return {"code":0}
+
+@router.get("/cache/tags/{tag}/flush")
+async def cache_tag_flush(request:Request,tag:str,key: str = Depends(X_API_KEY_HEADER)):
+    check_apikey(key)
+    count = await get_response_cache(request).invalidate([tag])
+    return {"code":0,"count":count}
+
+@router.get("/cache/stats")
+async def cache_stats(request:Request,key: str = Depends(X_API_KEY_HEADER)):
+    check_apikey(key)
+    metrics = get_response_cache(request).metrics
+    return {route: route_metrics.as_dict() for route, route_metrics in sorted(metrics.items())}
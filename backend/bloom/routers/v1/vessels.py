@@ -83,7 +83,7 @@ async def get_vessel(request: Request, # used by @cache
         return json.loads(vessel_repository.map_to_domain(data).model_dump_json()) if data else {}
 
 @router.get("/vessels/all/positions/last")
-@cache
+@cache(tags=["positions"])
 async def list_all_vessel_last_position(request: Request, # used by @cache
                                         nocache:bool=False, # used by @cache
                                         key: str = Depends(X_API_KEY_HEADER)):
@@ -99,7 +99,7 @@ async def list_all_vessel_last_position(request: Request, # used by @cache
     return json_data
 
 @router.get("/vessels/{vessel_id}/positions/last")
-@cache
+@cache(tags=["positions"])
 async def get_vessel_last_position(request: Request, # used by @cache
                                    vessel_id: int,
                                    nocache:bool=False, # used by @cache
@@ -231,7 +231,7 @@ async def get_vessel(request: Request, # used by @cache
 
 
 @router.get("/vessels/all/positions/last")
-@cache
+@cache(tags=["positions"])
 async def list_all_vessel_last_position(request: Request, # used by @cache
                                         nocache:bool=False, # used by @cache
                                         key: str = Depends(X_API_KEY_HEADER)):
@@ -269,7 +269,7 @@ async def list_all_vessel_last_position(request: Request, # used by @cache
         return positions
     
 @router.get("/vessels/{vessel_id}/positions/last")
-@cache
+@cache(tags=["positions"])
 async def get_vessel_last_position(request: Request, # used by @cache
                                    vessel_id: str,
                                    nocache:bool=False, # used by @cache
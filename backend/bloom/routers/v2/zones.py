@@ -52,13 +52,12 @@ class ZoneSummary(Base):
     created_at = Column("created_at", DateTime(timezone=True))
 
 @router.get("/zones")
-#@cache
+@cache
 async def list_zones(request: Request,
                      nocache: bool = False,
                      key: str = Depends(X_API_KEY_HEADER),
                      range: Annotated[RangeHeader, Depends(RangeHeaderParser)] = None):
     check_apikey(key)
-    print(f"Range:{range}")
     use_cases = UseCases()
     db = use_cases.db()
     with db.session() as session:
@@ -1,38 +1,69 @@
-from typing import Any
+import asyncio
+from pathlib import Path
+from typing import Any, Optional
 
+from aiohttp import ClientError
 from bloom.config import settings
 from bloom.domain.vessel import Vessel
 from bloom.infra.http.spire_api_utils import Paging
 from bloom.logger import logger
-from gql import Client
-from gql.transport.requests import RequestsHTTPTransport
-from requests import exceptions
+from gql import Client, gql
+from gql.client import AsyncClientSession
+from gql.transport.aiohttp import AIOHTTPTransport
+from gql.transport.exceptions import TransportProtocolError, TransportServerError
+from graphql import print_schema
+
+
+def is_transient(error: Exception) -> bool:
+    """True if a failed request may succeed when retried: server errors (5xx, 429 or without
+    status), invalid responses, network errors and timeouts. GraphQL errors of the response
+    (TransportQueryError: invalid query, expired token...) and the other HTTP errors are not."""
+    if isinstance(error, TransportServerError):
+        return error.code is None or error.code >= 500 or error.code == 429
+    return isinstance(error, (TransportProtocolError, ClientError, asyncio.TimeoutError))
 
 
 class GetVesselsFromSpire:
-    def __init__(self) -> None:
-        spire_token = settings.spire_token
+    """Fetches the vessels from the Spire GraphQL API.
 
-        self.transport = RequestsHTTPTransport(
-            url="https://api.sml.kpler.com/graphql",
-            headers={"Authorization": "Bearer " + spire_token},
-            verify=True,
-            retries=3,
-            timeout=30,
-        )
+    The MMSI list is split in shards of spire_shard_size vessels, fetched concurrently over one
+    aiohttp session with at most spire_max_concurrency requests at once. Each shard follows its
+    own pages, a failed request is retried spire_max_retries times with an exponential backoff
+    when the failure is transient (see is_transient).
+    """
+
+    def __init__(self, url: Optional[str] = None, schema_path: Optional[str] = None) -> None:
+        self.url = url or settings.spire_api_url
+        self.headers = {"Authorization": "Bearer " + settings.spire_token}
+        self.schema_path = Path(schema_path or settings.spire_schema_path)
+        self.shard_size = settings.spire_shard_size
+        self.max_concurrency = settings.spire_max_concurrency
+        self.max_retries = settings.spire_max_retries
+        self.retry_backoff = settings.spire_retry_backoff
+        self.timeout = settings.spire_timeout
+
+    def create_transport(self) -> AIOHTTPTransport:
+        return AIOHTTPTransport(url=self.url, headers=self.headers, ssl=True,
+                                timeout=self.timeout)
 
-    def create_client(self) -> Client:
-        logger.info(f"Connecting to {self.transport.url}...")
-        try:
-            client = Client(transport=self.transport, fetch_schema_from_transport=True)
-        except exceptions.ConnectTimeout:
-            logger.exception("Connection failed")
-            raise
-        return client
+    async def load_schema(self) -> str:
+        """Returns the schema of the API (SDL), downloaded on the first call and then read from
+        schema_path"""
+        if self.schema_path.is_file():
+            return self.schema_path.read_text()
+        logger.info(f"Downloading the schema of {self.url}...")
+        client = Client(transport=self.create_transport(), fetch_schema_from_transport=True,
+                        execute_timeout=self.timeout)
+        async with client:
+            schema = print_schema(client.schema)
+        self.schema_path.parent.mkdir(parents=True, exist_ok=True)
+        self.schema_path.write_text(schema)
+        return schema
 
     def create_query_string(self, vessels: list[Vessel]) -> str:
-        mmsi_list = [vessel.mmsi for vessel in vessels]
+        return self.create_mmsi_query_string([vessel.mmsi for vessel in vessels])
 
+    def create_mmsi_query_string(self, mmsi_list: list[int]) -> str:
         return (
             """
         query {
@@ -91,13 +122,56 @@ class GetVesselsFromSpire:
         """
         )
 
-    def get_raw_vessels_from_spire(self, vessels: list[Vessel]) -> list[dict[str, Any]]:
-        query_string = self.create_query_string(vessels)
-        client = self.create_client()
+    async def execute(self, session: AsyncClientSession, query: str,
+                      semaphore: asyncio.Semaphore) -> dict[str, Any]:
+        """Executes a query, retried with an exponential backoff when the request fails"""
+        document = gql(query)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    return await session.execute(document)
+            except (TransportServerError, TransportProtocolError, ClientError,
+                    asyncio.TimeoutError) as e:
+                if not is_transient(e):
+                    raise
+                if attempt == self.max_retries:
+                    logger.error(f"Execution of the query failed after {attempt + 1} attempts")
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(f"Execution of the query failed ({e!r}), retry in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def fetch_shard(self, session: AsyncClientSession, mmsi_list: list[int],
+                          semaphore: asyncio.Semaphore) -> list[dict[str, Any]]:
+        """Fetches all the pages of the vessels of a shard"""
         paging = Paging()
+        initial_query = self.create_mmsi_query_string(mmsi_list)
+        query = initial_query
+        nodes = []
+        while True:
+            response = await self.execute(session, query, semaphore)
+            nodes += response["vessels"]["nodes"]
+            endcursor, hasnextpage = paging.get_pageinfo_elements(response)
+            if paging._should_stop_paging(endcursor, hasnextpage):
+                return nodes
+            query = paging.insert_into_query_header(initial_query, endcursor)
 
-        raw_vessels = paging.page_and_get_response(
-            client,
-            query_string,
-        )
+    async def fetch_raw_vessels(self, mmsi_list: list[int]) -> list[dict[str, Any]]:
+        shards = [mmsi_list[i:i + self.shard_size]
+                  for i in range(0, len(mmsi_list), self.shard_size)]
+        schema = await self.load_schema()
+        logger.info(f"Connecting to {self.url}, {len(shards)} shards of {self.shard_size} "
+                    f"vessels...")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        client = Client(transport=self.create_transport(), schema=schema,
+                        execute_timeout=self.timeout)
+        async with client as session:
+            shards_nodes = await asyncio.gather(
+                *(self.fetch_shard(session, shard, semaphore) for shard in shards)
+            )
+        raw_vessels = [node for nodes in shards_nodes for node in nodes]
+        logger.info(f"Number of vessel scrapped from Spire {len(raw_vessels)}")
         return raw_vessels
+
+    def get_raw_vessels_from_spire(self, vessels: list[Vessel]) -> list[dict[str, Any]]:
+        return asyncio.run(self.fetch_raw_vessels([vessel.mmsi for vessel in vessels]))
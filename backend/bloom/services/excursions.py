@@ -0,0 +1,132 @@
+from datetime import timedelta
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from bloom.domain.excursion import Excursion
+
+# average speed to take when vessel exit a port (in knot/h)
+average_exit_speed = 7
+
+
+def new_excursion(vessel_id: int, departure_at, departure_port_id: Union[int, None],
+                  departure_position: Union[Point, None]) -> Excursion:
+    return Excursion(
+        vessel_id=vessel_id,
+        departure_port_id=departure_port_id,
+        departure_at=departure_at,
+        departure_position=departure_position,
+        arrival_port_id=None,
+        arrival_at=None,
+        arrival_position=None,
+        excursion_duration=timedelta(0),
+        total_time_at_sea=timedelta(0),
+        total_time_in_amp=timedelta(0),
+        total_time_in_territorial_waters=timedelta(0),
+        total_time_in_zones_with_no_fishing_rights=timedelta(0),
+        total_time_fishing=timedelta(0),
+        total_time_fishing_in_amp=timedelta(0),
+        total_time_fishing_in_territorial_waters=timedelta(0),
+        total_time_fishing_in_zones_with_no_fishing_rights=timedelta(0),
+        total_time_default_ais=timedelta(0)
+    )
+
+
+def assign_excursions(segments: pd.DataFrame, last_segments: pd.DataFrame,
+                      last_arrivals: dict[int, dict]) -> tuple[np.ndarray, list[Excursion], list[dict], set[int]]:
+    """Opens and closes the excursions of a batch of segments in memory, without any database call.
+
+    logic :
+    if segment ends in a port while ongoing excursion is open, then we close the excursion
+    else, if the ongoing excursion is open, then we use the ongoing excursion_id for the segment
+    else, we create a new excursion whose id will become the ongoing excursion_id for this segment and the future ones
+    additionnaly, when we create a new excursion, if the vessel is 'new' then we create an 'empty' excursion
+    else, if the first segment of this new excursion is of type 'DEFAULT_AIS', we estimate the time of departure based
+    on its ending position, distance traveled and a given average exit speed
+    A new excursion (not 'empty') departs from the arrival port and position of the last excursion of the vessel.
+
+    New excursions have no id yet: they get a local key -1, -2, ... (-1 - their index in the returned
+    list) used as excursion_id until they are inserted.
+
+    :param pd.DataFrame segments: as returned by build_segments, with a "port" field (port id or NaN)
+    :param pd.DataFrame last_segments: fields "vessel_id", "excursion_id", "arrival_port_id" as
+        returned by get_last_vessel_id_segments
+    :param dict last_arrivals: {vessel_id: {"arrival_port_id", "arrival_position"}} of the last
+        excursion of the vessels, as returned by get_last_excursions_arrivals
+
+    :return tuple: excursion_id of each segment (NaN if the segment is out of any excursion),
+        new excursions, closures of existing excursions {"id", "arrival_port_id", "arrival_at",
+        "longitude", "latitude"}, ids of the ports to flag with has_excursion
+    """
+    excursion_ids = np.full(len(segments), np.nan)
+    new_excursions: list[Excursion] = []
+    closures: list[dict] = []
+    port_ids: set[int] = set()
+    if segments.empty:
+        return excursion_ids, new_excursions, closures, port_ids
+
+    vessels_last_segment = last_segments.drop_duplicates("vessel_id").set_index("vessel_id")
+    rows = segments[["vessel_id", "port", "type", "distance", "timestamp_start", "timestamp_end",
+                     "end_longitude", "end_latitude"]].itertuples(index=False, name=None)
+    current_vessel_id = None
+    for i, (vessel_id, port, type, distance, timestamp_start, timestamp_end, longitude, latitude) in enumerate(rows):
+        if vessel_id != current_vessel_id:
+            current_vessel_id = vessel_id
+            last_arrival = last_arrivals.get(vessel_id, {})
+            last_arrival_port_id = last_arrival.get("arrival_port_id")
+            last_arrival_position = last_arrival.get("arrival_position")
+            if vessel_id in vessels_last_segment.index:
+                # if there's a last segment for this vessel, then it's not the first time a position for this vessel is received
+                is_new_vessel = False
+                # checks if the excursion of the last segment is closed or not
+                arrival_port_id = vessels_last_segment.at[vessel_id, "arrival_port_id"]
+                if pd.notna(arrival_port_id) and arrival_port_id >= 0:
+                    open_ongoing_excursion = False
+                else:
+                    open_ongoing_excursion = True
+                    ongoing_excursion_id = int(vessels_last_segment.at[vessel_id, "excursion_id"])
+            else:
+                # if there's no last segment for this vessel, then it's the first time a position for this vessel is received
+                is_new_vessel = True
+                open_ongoing_excursion = False
+
+        if port >= 0:
+            if open_ongoing_excursion:
+                port_id = int(port)
+                if ongoing_excursion_id < 0:
+                    excursion = new_excursions[-1 - ongoing_excursion_id]
+                    excursion.arrival_port_id = port_id
+                    excursion.arrival_at = timestamp_end
+                    excursion.arrival_position = Point(longitude, latitude)
+                else:
+                    closures.append({"id": ongoing_excursion_id, "arrival_port_id": port_id,
+                                     "arrival_at": timestamp_end, "longitude": longitude, "latitude": latitude})
+                port_ids.add(port_id)
+                last_arrival_port_id, last_arrival_position = port_id, Point(longitude, latitude)
+                excursion_ids[i] = ongoing_excursion_id
+                open_ongoing_excursion = False
+        elif open_ongoing_excursion:
+            excursion_ids[i] = ongoing_excursion_id
+        else:
+            if is_new_vessel:
+                excursion = new_excursion(int(vessel_id), timestamp_end, None, Point(longitude, latitude))
+                is_new_vessel = False
+            else:
+                if type == "DEFAULT_AIS":
+                    departure_at = timestamp_end - timedelta(0, 3600 * distance / average_exit_speed)
+                else:
+                    departure_at = timestamp_start
+                excursion = new_excursion(int(vessel_id), departure_at, last_arrival_port_id,
+                                          last_arrival_position)
+                if last_arrival_port_id is not None:
+                    port_ids.add(last_arrival_port_id)
+            new_excursions.append(excursion)
+            # the new excursion is now the last excursion of the vessel
+            last_arrival_port_id, last_arrival_position = None, None
+            ongoing_excursion_id = -len(new_excursions)
+            open_ongoing_excursion = True
+            excursion_ids[i] = ongoing_excursion_id
+
+    return excursion_ids, new_excursions, closures, port_ids
@@ -1,9 +1,199 @@
 from typing import List
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+from geopy import distance
 
 from bloom.container import UseCases
 from bloom.config import settings
+from bloom.domain.zone import Zone
+
+# mean earth radius (in km), same value as geopy.distance.great_circle
+EARTH_RADIUS = 6371.009
+# WGS84 ellipsoid
+WGS84_SEMI_MAJOR_AXIS = 6378.137
+WGS84_FLATTENING = 1 / 298.257223563
+WGS84_SEMI_MINOR_AXIS = (1 - WGS84_FLATTENING) * WGS84_SEMI_MAJOR_AXIS
+
+KM_PER_UNIT = {
+    "km": 1.0,
+    "nm": 1.852,
+}
+
+
+def haversine_distance(latitudes_1, longitudes_1, latitudes_2, longitudes_2) -> np.ndarray:
+    """Great-circle distance in km between two arrays of positions, on a spherical earth."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float))
+                              for a in (latitudes_1, longitudes_1, latitudes_2, longitudes_2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def wgs84_distance(latitudes_1, longitudes_1, latitudes_2, longitudes_2,
+                   tolerance: float = 1e-12, max_iterations: int = 20) -> np.ndarray:
+    """Geodesic distance in km between two arrays of positions, on the WGS84 ellipsoid.
+
+    Vincenty's inverse formula, iterated on the whole arrays at once. The few nearly antipodal
+    pairs on which it doesn't converge within max_iterations are computed with
+    geopy.distance.geodesic.
+    """
+    lat1, lon1, lat2, lon2 = (np.asarray(a, dtype=float)
+                              for a in (latitudes_1, longitudes_1, latitudes_2, longitudes_2))
+    a, b, f = WGS84_SEMI_MAJOR_AXIS, WGS84_SEMI_MINOR_AXIS, WGS84_FLATTENING
+    L = np.radians(lon2 - lon1)
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        lambda_ = L
+        converged = np.zeros(L.shape, dtype=bool)
+        for _ in range(max_iterations):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.hypot(cos_u2 * sin_lambda, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lambda / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # equatorial line: cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous_lambda = lambda_
+            lambda_ = L + (1 - c) * f * sin_alpha * (
+                    sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            # NaN positions are considered as converged, their distance is NaN
+            converged = ~(np.abs(lambda_ - previous_lambda) > tolerance)
+            if converged.all():
+                break
+
+        u_2 = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_2 / 16384 * (4096 + u_2 * (-768 + u_2 * (320 - 175 * u_2)))
+        big_b = u_2 / 1024 * (256 + u_2 * (-128 + u_2 * (74 - 47 * u_2)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        result = b * big_a * (sigma - delta_sigma)
+
+    result = np.where(sin_sigma == 0, 0.0, result)
+    for i in np.flatnonzero(~converged):
+        result.flat[i] = distance.geodesic((lat1.flat[i], lon1.flat[i]), (lat2.flat[i], lon2.flat[i])).km
+    return result
+
+
+def compute_distances(latitudes_1, longitudes_1, latitudes_2, longitudes_2,
+                      unit: str = "km", method: str = "wgs84") -> np.ndarray:
+    """Computes distances between two arrays of positions in one call.
+
+    Positions with a NaN coordinate get a NaN distance.
+
+    :param latitudes_1, longitudes_1, latitudes_2, longitudes_2: arrays (or Series) of coordinates
+        in degrees
+    :param str unit: "km" or "nm" (nautical miles)
+    :param str method: "wgs84" for the geodesic distance on the WGS84 ellipsoid (same as
+        geopy.distance.distance) or "haversine" for the faster great-circle distance
+
+    :return np.ndarray: distances
+    """
+    if method == "haversine":
+        result = haversine_distance(latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+    elif method == "wgs84":
+        result = wgs84_distance(latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+    else:
+        raise ValueError(f"Unknown distance method {method}")
+    return result / KM_PER_UNIT[unit]
+
+
+class PortIndex:
+    """In memory index of the ports, to find the ports of many positions without querying the
+    database for each of them.
+
+    Gives the same results as PortRepository.get_closest_port_in_range: the closest port (geodesic
+    distance to its geometry_point) among the ports whose geometry_buffer contains the position.
+    """
+
+    def __init__(self, ports: pd.DataFrame) -> None:
+        """
+        :param pd.DataFrame ports: fields "id", "longitude", "latitude", "geometry_buffer" as
+            returned by PortRepository.get_ports_buffers
+        """
+        self.port_ids = ports["id"].to_numpy()
+        self.longitudes = ports["longitude"].to_numpy(dtype=float)
+        self.latitudes = ports["latitude"].to_numpy(dtype=float)
+        self.tree = shapely.STRtree(ports["geometry_buffer"].to_numpy())
+
+    def find_closest_ports_in_range(self, longitudes, latitudes, range: float) -> np.ndarray:
+        """Finds the closest port in range of each position.
+
+        :param longitudes, latitudes: arrays (or Series) of coordinates in degrees
+        :param float range: maximal distance to the port (in meters)
+
+        :return np.ndarray: id of the port of each position, NaN if not in a port
+        """
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        result = np.full(longitudes.shape, np.nan)
+        if len(self.port_ids) == 0 or len(longitudes) == 0:
+            return result
+
+        # candidate (position, port) pairs: positions within the buffer of the port
+        positions, ports = self.tree.query(shapely.points(longitudes, latitudes), predicate="within")
+        distances = compute_distances(latitudes[positions], longitudes[positions],
+                                      self.latitudes[ports], self.longitudes[ports]) * 1000
+        in_range = distances < range
+        positions, ports, distances = positions[in_range], ports[in_range], distances[in_range]
+
+        # keep the closest port of each position
+        order = np.lexsort((distances, positions))
+        positions, ports = positions[order], ports[order]
+        is_closest = np.ones(len(positions), dtype=bool)
+        is_closest[1:] = positions[1:] != positions[:-1]
+        result[positions[is_closest]] = self.port_ids[ports[is_closest]]
+        return result
+
+
+class ZoneIndex:
+    """In memory index of the zones, to find the zones of many segments at once.
+
+    The zones are cut in small tiles (see ZoneRepository.get_zones_tiles) indexed in a STRtree, so
+    that testing a point doesn't need the whole geometry of a large zone. A segment is in a zone
+    when both its start and end positions are in the zone, as in
+    SegmentRepository.find_segments_in_zones.
+    """
+
+    def __init__(self, zones: list[Zone], tiles: pd.DataFrame) -> None:
+        """
+        :param list[Zone] zones: zones, without geometry (see ZoneRepository.get_zones_without_geometry)
+        :param pd.DataFrame tiles: fields "zone_id", "geometry"
+        """
+        self.zones = {zone.id: zone for zone in zones}
+        self.tile_zone_ids = tiles["zone_id"].to_numpy()
+        self.tree = shapely.STRtree(tiles["geometry"].to_numpy())
+
+    def find_zones_ids(self, positions) -> pd.DataFrame:
+        """:return pd.DataFrame: fields "position" (index in positions), "zone_id" """
+        positions, tiles = self.tree.query(np.asarray(positions), predicate="intersects")
+        # a position on the border of two tiles of a zone is found twice
+        return pd.DataFrame({"position": positions,
+                             "zone_id": self.tile_zone_ids[tiles]}).drop_duplicates()
+
+    def find_segments_zones(self, start_positions, end_positions) -> list[list[Zone]]:
+        """Finds the zones of each segment.
+
+        :param start_positions, end_positions: arrays of shapely points
+
+        :return list[list[Zone]]: zones of each segment, in the order of the segments
+        """
+        result = [[] for _ in range(len(start_positions))]
+        if len(self.tile_zone_ids) == 0 or len(start_positions) == 0:
+            return result
+        in_zones = self.find_zones_ids(start_positions).merge(self.find_zones_ids(end_positions))
+        in_zones.sort_values(["position", "zone_id"], inplace=True)
+        for position, zone_id in in_zones.itertuples(index=False, name=None):
+            result[position].append(self.zones[zone_id])
+        return result
+
 
 def find_positions_in_port_buffer(vessel_positions: List[tuple]) -> List[tuple]:
     """Assigns vessel positions to their port if any. If a vessel is not in a port,
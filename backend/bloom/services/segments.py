@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from bloom.services.geo import compute_distances
+
+# segments lasting longer than this (in seconds) are considered as an AIS default
+default_ais_min_duration = 2100
+
+POSITION_TO_END_COLUMNS = {
+    "timestamp": "timestamp_end",
+    "heading": "heading_at_end",
+    "speed": "speed_at_end",
+    "longitude": "end_longitude",
+    "latitude": "end_latitude",
+}
+END_TO_START_COLUMNS = {
+    "timestamp_end": "timestamp_start",
+    "heading_at_end": "heading_at_start",
+    "speed_at_end": "speed_at_start",
+    "end_longitude": "start_longitude",
+    "end_latitude": "start_latitude",
+}
+LAST_SEGMENT_TO_START_COLUMNS = {
+    "timestamp_end": "timestamp_start",
+    "heading_at_end": "heading_at_start",
+    "speed_at_end": "speed_at_start",
+    "longitude": "start_longitude",
+    "latitude": "start_latitude",
+}
+SEGMENT_COLUMNS = [
+    "vessel_id",
+    "mmsi",
+    "timestamp_start",
+    "timestamp_end",
+    "heading_at_start",
+    "heading_at_end",
+    "speed_at_start",
+    "speed_at_end",
+    "start_longitude",
+    "start_latitude",
+    "end_longitude",
+    "end_latitude",
+    "distance",
+    "segment_duration",
+    "type",
+    "average_speed",
+    "last_vessel_segment",
+]
+
+
+def build_segments(positions: pd.DataFrame, last_segments: pd.DataFrame) -> pd.DataFrame:
+    """Builds the segments of every vessel of a batch of positions in one pass.
+
+    The batch is sorted once by vessel and timestamp, each position becomes the end of a segment
+    whose start is the previous position of the same vessel. The first segment of each vessel
+    starts at the end of its last known segment or, for a vessel never seen before, at its first
+    position set up 1s behind in time (so timestamp_start != timestamp_end).
+    Segments with same timestamp_start and timestamp_end (no update) are removed.
+
+    :param pd.DataFrame positions: fields "vessel_id", "mmsi", "timestamp", "heading", "speed",
+        "longitude", "latitude"
+    :param pd.DataFrame last_segments: fields "vessel_id", "timestamp_end", "heading_at_end",
+        "speed_at_end", "longitude", "latitude" as returned by get_last_vessel_id_segments
+
+    :return pd.DataFrame: one row per segment, see SEGMENT_COLUMNS. Vessels are kept in the order
+        of their first position in the batch, segments are sorted by timestamp for each vessel
+    """
+    if positions.empty:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS)
+
+    ends = positions[["vessel_id", "mmsi", *POSITION_TO_END_COLUMNS]].rename(
+        columns=POSITION_TO_END_COLUMNS,
+    )
+    # vessels are processed in the order of their first position in the batch
+    ends["vessel_rank"] = pd.factorize(ends["vessel_id"])[0]
+    ends.sort_values(["vessel_rank", "timestamp_end"], kind="stable", inplace=True)
+    ends.reset_index(drop=True, inplace=True)
+
+    # every end point but the last one of each vessel is the start point of the next segment
+    starts = ends.groupby("vessel_rank", sort=False)[list(END_TO_START_COLUMNS)].shift(1)
+    starts.rename(columns=END_TO_START_COLUMNS, inplace=True)
+
+    # start point of the first segment of each vessel
+    is_first = ~ends["vessel_rank"].duplicated()
+    first_ends = ends.loc[is_first]
+    seeds = first_ends[list(END_TO_START_COLUMNS)].rename(columns=END_TO_START_COLUMNS)
+    seeds["timestamp_start"] = seeds["timestamp_start"] - timedelta(0, 1)
+    if last_segments is not None and last_segments.shape[0] > 0:
+        known_seeds = last_segments.drop_duplicates("vessel_id").set_index("vessel_id")[
+            list(LAST_SEGMENT_TO_START_COLUMNS)
+        ].rename(columns=LAST_SEGMENT_TO_START_COLUMNS)
+        known_seeds = known_seeds.reindex(first_ends["vessel_id"])
+        known_seeds.index = first_ends.index
+        is_known = first_ends["vessel_id"].isin(last_segments["vessel_id"])
+        seeds.loc[is_known] = known_seeds.loc[is_known]
+    starts.loc[is_first] = seeds
+
+    df = pd.concat([ends, starts], axis=1)
+    # removing segment with same timestamp_start and timestamp_end (no update)
+    df = df[df["timestamp_start"] != df["timestamp_end"]].copy()
+    df.reset_index(drop=True, inplace=True)
+
+    # calculate distance
+    df["distance"] = compute_distances(df["start_latitude"], df["start_longitude"],
+                                       df["end_latitude"], df["end_longitude"], unit="nm")
+
+    # calculate duration in seconds
+    df["segment_duration"] = (df["timestamp_end"] - df["timestamp_start"]).dt.total_seconds()
+
+    # set default type as AT_SEA, DEFAULT_AIS for segment with duration > 35 min
+    df["type"] = np.where(df["segment_duration"] >= default_ais_min_duration, "DEFAULT_AIS", "AT_SEA")
+
+    # calculate average speed in knot
+    df["average_speed"] = df["distance"] / (df["segment_duration"] / 3600)
+
+    # set last_vessel_segment on the most recent segment of each vessel
+    df["last_vessel_segment"] = (~df["vessel_rank"].duplicated(keep="last")).astype(int)
+
+    return df[SEGMENT_COLUMNS]
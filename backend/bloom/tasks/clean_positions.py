@@ -2,55 +2,146 @@ import argparse
 import warnings
 from datetime import datetime,timedelta, timezone
 from time import perf_counter
+from typing import Optional
 
-import numpy as np
 import pandas as pd
-from geopy import distance
-from shapely.geometry import Point
 
 from bloom.container import UseCases
-from bloom.domain.vessel_position import VesselPosition
 from bloom.infra.repositories.repository_task_execution import TaskExecutionRepository
 from bloom.logger import logger
+from bloom.services.geo import compute_distances
 
 warnings.filterwarnings("ignore")
 
 
-# distance.distance takes pair of (lat, lon) tuples:
-def get_distance(current_position: tuple, last_position: tuple):
-    if np.isnan(last_position[0]) or np.isnan(last_position[1]):
-        return np.nan
-
-    return distance.geodesic(current_position, last_position).km
-
-
-def map_vessel_position_to_domain(row: pd.Series) -> VesselPosition:
-    return VesselPosition(
-        vessel_id=row["vessel_id"],
-        timestamp=row["position_timestamp"],
-        accuracy=row["position_accuracy"],
-        collection_type=row["position_collection_type"],
-        course=row["position_course"],
-        heading=row["position_heading"],
-        position=Point(row["position_longitude"], row["position_latitude"]),
-        latitude=row["position_latitude"],
-        longitude=row["position_longitude"],
-        maneuver=row["position_maneuver"],
-        navigational_status=row["position_navigational_status"],
-        rot=row["position_rot"],
-        speed=row["speed"],
+# fields of the Spire data written to vessel_positions
+POSITION_COLUMNS = {
+    "vessel_id": "vessel_id",
+    "position_timestamp": "timestamp",
+    "position_accuracy": "accuracy",
+    "position_collection_type": "collection_type",
+    "position_course": "course",
+    "position_heading": "heading",
+    "position_latitude": "latitude",
+    "position_longitude": "longitude",
+    "position_maneuver": "maneuver",
+    "position_navigational_status": "navigational_status",
+    "position_rot": "rot",
+    "speed": "speed",
+}
+
+
+def clean_batch(batch: pd.DataFrame, last_positions: pd.DataFrame,
+                excursions: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Steps 4 to 8: flags the positions of a batch of Spire data to keep.
+
+    The speed of each position is computed from the previous ping of the vessel, kept or not: its
+    previous ping in the batch, or the last ping of the previous batch (last_positions) for its
+    first ping. The stationary pings of a vessel in port are dropped even when it is far from its
+    last kept position, and the result does not depend on how the positions are split in batches.
+
+    :param pd.DataFrame batch: as returned by get_all_data_between_date, without missing positions
+    :param pd.DataFrame last_positions: last known ping of each vessel, fields "vessel_id",
+        "timestamp_end", "longitude", "latitude"
+    :param pd.DataFrame excursions: current excursions, as returned by get_current_excursions
+
+    :return tuple: positions to keep, last_positions updated with the last ping of each vessel
+    """
+    # Step 4: merge batch with last_positions on vessel_id.
+    # If column _merge == "left_only" --> this is a new vessel (keep it)
+    batch = batch.merge(
+        last_positions,
+        how="left",
+        on="vessel_id",
+        suffixes=["", "_segment"],
+        indicator=True,
+    )
+    batch.rename(columns={"_merge": "new_vessel"}, inplace=True)
+    batch["new_vessel"] = batch["new_vessel"] == "left_only"
+
+    # Step 5: merge batch with excursions
+    # If column _merge == "left_only" --> the excursion is closed
+    batch = batch.merge(
+        excursions,
+        how="left",
+        on="vessel_id",
+        suffixes=["", "_excursion"],
+        indicator=True,
+    )
+    batch.rename(columns={"_merge": "excursion_closed"}, inplace=True)
+    batch["excursion_closed"] = batch["excursion_closed"] == "left_only"
+
+    # Step 6: compute speed between previous and current position
+    # Step 6.0. The previous position of a vessel is its previous position in the batch, sorted by
+    # timestamp, or its last known position for its first position in the batch.
+    # Pings repeated with the same timestamp, in the batch or as the last known ping, are dropped.
+    batch["position_timestamp"] = pd.to_datetime(batch["position_timestamp"], utc=True)
+    batch["timestamp_end"] = pd.to_datetime(batch["timestamp_end"], utc=True)
+    batch.sort_values(["vessel_id", "position_timestamp"], kind="stable", inplace=True)
+    batch.drop_duplicates(["vessel_id", "position_timestamp"], inplace=True)
+    batch = batch.loc[batch["position_timestamp"] != batch["timestamp_end"]].reset_index(drop=True)
+    previous = batch.groupby("vessel_id", sort=False)[
+        ["position_timestamp", "position_longitude", "position_latitude"]
+    ].shift(1)
+    in_batch = previous["position_timestamp"].notna()
+    batch.loc[in_batch, "timestamp_end"] = previous.loc[in_batch, "position_timestamp"]
+    batch.loc[in_batch, "longitude"] = previous.loc[in_batch, "position_longitude"]
+    batch.loc[in_batch, "latitude"] = previous.loc[in_batch, "position_latitude"]
+    # only the first position of a new vessel has no previous position
+    batch["new_vessel"] &= ~in_batch
+
+    # Step 6.1. Compute distance in km between previous and current position
+    batch["distance_since_last_position"] = compute_distances(
+        batch["position_latitude"], batch["position_longitude"],
+        batch["latitude"], batch["longitude"],
+        unit="km",
     )
 
+    # Step 6.2. Compute time in hours between previous and current position
+    ## If timestamp_end is NULL --> new_vessel is TRUE (record will be kept)
+    ## --> fillna with anything to avoid exception
+    batch["timestamp_end"] = batch["timestamp_end"].fillna(batch["position_timestamp"])
+    batch["time_since_last_position"] = (
+            batch["position_timestamp"] - batch["timestamp_end"]
+    )
+    batch["hours_since_last_position"] = (
+            batch["time_since_last_position"].dt.total_seconds() / 3600
+    )
 
-def to_coords(row: pd.Series) -> pd.Series:
-    if pd.isna(row["end_position"]) is False:
-        row["longitude"] = row["end_position"].x
-        row["latitude"] = row["end_position"].y
+    # Step 6.3. Compute speed: speed = distance / time
+    batch["speed"] = (
+            batch["distance_since_last_position"] / batch["hours_since_last_position"]
+    )
+    batch["speed"] *= 0.5399568  # Conversion km/h to
+    batch["speed"] = batch["speed"].fillna(batch["position_speed"])
+    # Step 7: apply to_keep flag: keep only positions WHERE:
+    # - row["new_vessel"] is True, i.e. there is a new vessel_id
+    # - OR speed is not close to 0, i.e. vessel moved significantly since previous position
+    batch["to_keep"] = batch["new_vessel"] | ~(  # detect new vessels
+            batch["excursion_closed"]  # if last excursion closed
+            & (batch["speed"] <= 0.01)  # and speed < 0.01: don't keep
+    )
 
-    return row
+    # the last ping of each vessel, kept or not, is its previous ping for the next batch
+    last_pings = batch.drop_duplicates("vessel_id", keep="last")[
+        ["vessel_id", "position_timestamp", "position_longitude", "position_latitude"]
+    ].rename(
+        columns={"position_timestamp": "timestamp_end", "position_longitude": "longitude",
+                 "position_latitude": "latitude"},
+    )
 
+    # Step 8: filter unflagged rows to insert to DB
+    batch = batch.loc[batch["to_keep"]].copy()
 
-def run(batch_time):
+    last_positions = pd.concat([last_positions, last_pings], ignore_index=True)
+    last_positions["timestamp_end"] = pd.to_datetime(last_positions["timestamp_end"], utc=True)
+    last_positions = last_positions.sort_values("timestamp_end", kind="stable").drop_duplicates(
+        "vessel_id", keep="last",
+    )
+    return batch, last_positions
+
+
+def run(batch_time: int, chunk_size: Optional[int] = None):
     use_cases = UseCases()
     db = use_cases.db()
     spire_repository = use_cases.spire_ais_data_repository()
@@ -59,114 +150,63 @@ def run(batch_time):
     vessel_position_repository = use_cases.vessel_position_repository()
     process_start=datetime.now(timezone.utc)
     point_in_time=None
-    position_count=None
+    position_count=0
     with db.session() as session:
         point_in_time = TaskExecutionRepository.get_point_in_time(
             session, "clean_positions",
         )
         batch_limit = point_in_time + timedelta(days=batch_time)
-        # Step 1: load SPIRE batch: read from SpireAisData
-        logger.info(f"Lecture des nouvelles positions de Spire en base")
-        batch = spire_repository.get_all_data_between_date(session, point_in_time, batch_limit)
-
-        # Recherche de la date de l'enregistrement traité le plus récent.
-        # Cette date est stockée comme date d'exécution du traitement ce qui permettra de repartir de cette date
-        # à la prochaine execution pour traiter les enregistrements + récents
-        max_created = max(batch["created_at"]) if len(batch) > 0 else batch_limit
-        logger.info(f"Traitement des positions entre le {point_in_time} et le {max_created}")
-        position_count=len(batch)
-        logger.info(f"{position_count} nouvelles positions de Spire")
-        batch.dropna(
-            subset=[
-                "position_latitude",
-                "position_longitude",
-                "position_timestamp",
-                "position_update_timestamp",
-            ],
-            inplace=True,
-        )
 
         # Step 2: load excursion from fct_excursion where date_arrival IS NULL
         excursions = excursion_repository.get_current_excursions(session)
 
         # Step 3: load last_segment where last_vessel_segment == 1
-        last_segment = segment_repository.get_last_vessel_id_segments(session)
-        last_segment["longitude"] = None
-        last_segment["latitude"] = None
-        last_segment = last_segment.apply(to_coords, axis=1)
-
-        # Step 4: merge batch with last_segment on vessel_id.
-        # If column _merge == "left_only" --> this is a new vessel (keep it)
-        batch = batch.merge(
-            last_segment,
-            how="left",
-            on="vessel_id",
-            suffixes=["", "_segment"],
-            indicator=True,
-        )
-        batch.rename(columns={"_merge": "new_vessel"}, inplace=True)
-        batch["new_vessel"] = batch["new_vessel"] == "left_only"
-
-        # Step 5: merge batch with excursions
-        # If column _merge == "left_only" --> the excursion is closed
-        batch = batch.merge(
-            excursions,
-            how="left",
-            on="vessel_id",
-            suffixes=["", "_excursion"],
-            indicator=True,
-        )
-        batch.rename(columns={"_merge": "excursion_closed"}, inplace=True)
-        batch["excursion_closed"] = batch["excursion_closed"] == "left_only"
-
-        # Step 6: compute speed between last and current position
-        # Step 6.1. Compute distance in km between last and current position
-        batch["distance_since_last_position"] = batch.apply(
-            lambda row: get_distance(
-                (row["position_latitude"], row["position_longitude"]),
-                (row["latitude"], row["longitude"]),
-            ),
-            axis=1,
-        )
-
-        # Step 6.2. Compute time in hours between last and current position
-        ## If timestamp_end is NULL --> new_vessel is TRUE (record will be kept)
-        ## --> fillna with anything to avoid exception
-        batch.loc[batch["timestamp_end"].isna(), "timestamp_end"] = batch.loc[
-            batch["timestamp_end"].isna(), "position_timestamp"
-        ].copy()
-        batch["timestamp_end"] = pd.to_datetime(batch["timestamp_end"], utc=True)
-        batch["position_timestamp"] = pd.to_datetime(batch["position_timestamp"], utc=True)
-        batch["time_since_last_position"] = (
-                batch["position_timestamp"] - batch["timestamp_end"]
-        )
-        batch["hours_since_last_position"] = (
-                batch["time_since_last_position"].dt.seconds / 3600
-        )
-
-        # Step 6.3. Compute speed: speed = distance / time
-        batch["speed"] = (
-                batch["distance_since_last_position"] / batch["hours_since_last_position"]
-        )
-        batch["speed"] *= 0.5399568  # Conversion km/h to
-        batch["speed"] = batch["speed"].fillna(batch["position_speed"])
-        batch.replace([np.nan], [None], inplace=True)
-        # Step 7: apply to_keep flag: keep only positions WHERE:
-        # - row["new_vessel"] is True, i.e. there is a new vessel_id
-        # - OR speed is not close to 0, i.e. vessel moved significantly since last position
-        batch["to_keep"] = (batch["new_vessel"] == True) | ~(  # detect new vessels
-                (batch["excursion_closed"] == True)  # if last excursion closed
-                & (batch["speed"] <= 0.01)  # and speed < 0.01: don't keep
-        )
+        last_segment = segment_repository.get_last_vessel_id_segments(session, coordinates=True)
+        last_positions = last_segment[["vessel_id", "timestamp_end", "longitude", "latitude"]]
 
-        # Step 8: filter unflagged rows to insert to DB
-        batch = batch.loc[batch["to_keep"] == True].copy()
-
-        # Step 9: insert to DataBase
-        clean_positions = batch.apply(map_vessel_position_to_domain, axis=1).values.tolist()
-        vessel_position_repository.batch_create_vessel_position(session, clean_positions)
+    # Step 1: load SPIRE batch: read from SpireAisData
+    # with a chunk size, the batch is read and processed chunk by chunk
+    logger.info(f"Lecture des nouvelles positions de Spire en base")
+    max_created = None
+    with db.session() as session:
+        if chunk_size:
+            batches = spire_repository.iter_data_between_date(session, point_in_time, batch_limit, chunk_size)
+        else:
+            batches = [spire_repository.get_all_data_between_date(session, point_in_time, batch_limit)]
+        for batch in batches:
+            if len(batch) == 0:
+                continue
+            # a chunk may end in the middle of the rows of a created_at: the previous chunks are
+            # committed with their point in time once a chunk starts after it, so that an
+            # interrupted run resumes after the last created_at completely processed
+            if max_created is not None and batch["created_at"].iloc[0] > max_created:
+                TaskExecutionRepository.set_point_in_time(session, "clean_positions", max_created)
+                session.commit()
+            # Recherche de la date de l'enregistrement traité le plus récent.
+            # Cette date est stockée comme date d'exécution du traitement ce qui permettra de repartir de cette date
+            # à la prochaine execution pour traiter les enregistrements + récents
+            max_created = max(batch["created_at"])
+            logger.info(f"Traitement des positions entre le {point_in_time} et le {max_created}")
+            position_count += len(batch)
+            logger.info(f"{len(batch)} nouvelles positions de Spire")
+            batch.dropna(
+                subset=[
+                    "position_latitude",
+                    "position_longitude",
+                    "position_timestamp",
+                    "position_update_timestamp",
+                ],
+                inplace=True,
+            )
+            batch, last_positions = clean_batch(batch, last_positions, excursions)
+
+            # Step 9: insert to DataBase
+            clean_positions = batch[list(POSITION_COLUMNS)].rename(columns=POSITION_COLUMNS)
+            vessel_position_repository.batch_create_vessel_position_from_frame(session, clean_positions)
+            logger.info(f"Ecriture de {len(clean_positions)} positions dans la table vessel_positions")
+        if max_created is None:
+            max_created = batch_limit
         TaskExecutionRepository.set_point_in_time(session, "clean_positions", max_created)
-        logger.info(f"Ecriture de {len(clean_positions)} positions dans la table vessel_positions")
         session.commit()
         if point_in_time:
             TaskExecutionRepository.set_duration(session,
@@ -191,10 +231,18 @@ if __name__ == "__main__":
         required=False,
         default=7,
     )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=int,
+        help="number of positions read and committed at once, whole batch if not set",
+        required=False,
+        default=None,
+    )
     args = parser.parse_args()
     time_start = perf_counter()
     logger.info("DEBUT - Nettoyage des positions")
-    run(args.batch_time)
+    run(args.batch_time, args.chunk_size)
     time_end = perf_counter()
     duration = time_end - time_start
     logger.info(f"FIN - Nettoyage des positions en {duration:.2f}s")
@@ -1,17 +1,12 @@
 import warnings
 from datetime import datetime, timedelta, timezone
 from time import perf_counter
-from typing import Optional
 
 import numpy as np
 import pandas as pd
-from geoalchemy2.shape import to_shape
-from geopy import distance
 from shapely.geometry import Point
-from sqlalchemy.orm import Session
 
 from bloom.container import UseCases
-from bloom.domain.excursion import Excursion
 from bloom.domain.segment import Segment
 from bloom.infra.repositories.repository_task_execution import TaskExecutionRepository
 from bloom.logger import logger
@@ -19,6 +14,10 @@ from bloom.domain.rel_segment_zone import RelSegmentZone
 from bloom.infra.repositories.repository_rel_segment_zone import RelSegmentZoneRepository
 from bloom.infra.repositories.repository_port import PortRepository
 from bloom.domain.metrics import Metrics #1
+from bloom.services.excursions import assign_excursions
+from bloom.services.geo import PortIndex, ZoneIndex
+from bloom.services.segments import build_segments
+from bloom.tasks import invalidate_cache
 
 warnings.filterwarnings("ignore")
 
@@ -26,74 +25,6 @@ warnings.filterwarnings("ignore")
 threshold_distance_to_port = 5000
 # maximal average speed of a vessel to check if it's in a port (in knot)
 maximal_speed_to_check_if_in_port = 0.1
-# average speed to take when vessel exit a port (in knot/h)
-average_exit_speed = 7
-
-
-def to_coords(row: pd.Series) -> pd.Series:
-    if pd.isna(row["end_position"]) is False:
-        row["longitude"] = row["end_position"].x
-        row["latitude"] = row["end_position"].y
-
-    return row
-
-
-def add_excursion(session: Session, vessel_id: int, departure_at: datetime,
-                  departure_position: Optional[Point] = None) -> int:
-    use_cases = UseCases()
-    excursion_repository = use_cases.excursion_repository()
-    port_repository = use_cases.port_repository()
-
-    result = excursion_repository.get_param_from_last_excursion(session, vessel_id)
-
-    if result:
-        arrival_port_id = result["arrival_port_id"]
-        arrival_position = to_shape(result["arrival_position"]) if result["arrival_position"] else None
-    else:
-        arrival_port_id = None
-        arrival_position = None
-
-    new_excursion = Excursion(
-        vessel_id=vessel_id,
-        departure_port_id=arrival_port_id if departure_position is None else None,
-        departure_at=departure_at,
-        departure_position=arrival_position if departure_position is None else departure_position,
-        arrival_port_id=None,
-        arrival_at=None,
-        arrival_position=None,
-        excursion_duration=timedelta(0),
-        total_time_at_sea=timedelta(0),
-        total_time_in_amp=timedelta(0),
-        total_time_in_territorial_waters=timedelta(0),
-        total_time_in_zones_with_no_fishing_rights=timedelta(0),
-        total_time_fishing=timedelta(0),
-        total_time_fishing_in_amp=timedelta(0),
-        total_time_fishing_in_territorial_waters=timedelta(0),
-        total_time_fishing_in_zones_with_no_fishing_rights=timedelta(0),
-        total_time_default_ais=timedelta(0)
-    )
-    new_excursion = excursion_repository.create_excursion(session, new_excursion)
-
-    if departure_position is None :
-        port_repository.update_port_has_excursion(session, arrival_port_id)
-
-    return new_excursion.id
-
-
-def close_excursion(session: Session, excursion_id: int, port_id: int, latitude: float, longitude: float,
-                    arrived_at: datetime) -> None:
-    use_cases = UseCases()
-    excursion_repository = use_cases.excursion_repository()
-    port_repository = use_cases.port_repository()
-
-    excursion = excursion_repository.get_excursion_by_id(session, excursion_id)
-
-    if excursion:
-        excursion.arrival_port_id = port_id
-        excursion.arrival_at = arrived_at
-        excursion.arrival_position = Point(longitude, latitude)
-        excursion_repository.update_excursion(session, excursion)
-        port_repository.update_port_has_excursion(session, port_id)
 
 
 def run():
@@ -103,9 +34,8 @@ def run():
     vessel_position_repository = use_cases.vessel_position_repository()
     port_repository = use_cases.port_repository()
     excursion_repository = use_cases.excursion_repository()
+    zone_repository = use_cases.zone_repository()
     metrics_repository = use_cases.metrics_repository() #1
-    nb_created_excursion = 0
-    nb_closed_excursion = 0
 
     process_start = datetime.now(timezone.utc)
     point_in_time = None
@@ -118,216 +48,39 @@ def run():
         batch = vessel_position_repository.get_positions_with_vessel_created_updated_after(session, point_in_time)
         position_count=len(batch)
         logger.info(f"{position_count} nouvelles positions")
-        last_segment = segment_repository.get_last_vessel_id_segments(session)
-        last_segment["longitude"] = None
-        last_segment["latitude"] = None
-        last_segment = last_segment.apply(to_coords, axis=1)
+        last_segment = segment_repository.get_last_vessel_id_segments(session, coordinates=True)
 
         logger.info("Création des excursions")
-        result = pd.DataFrame()
-        for vessel_id in batch["vessel_id"].unique():
-            df_end = batch.loc[batch["vessel_id"] == vessel_id].copy()
-            df_end.rename(columns={"timestamp": "timestamp_end",
-                            "heading": "heading_at_end",
-                            "speed": "speed_at_end",
-                            "longitude": "end_longitude",
-                            "latitude": "end_latitude"
-                            }, inplace=True)
-            df_end.sort_values("timestamp_end", inplace=True)
-            df_end.reset_index(drop=True, inplace=True)
-            # get every end entry but the last one ; each one of them will be the start point of a segment
-            if len(df_end)>1:
-                df_start = df_end.iloc[0:-1, :].copy()
-                for col in df_start.columns:
-                    df_start.rename(columns={col: col.replace("end", "start")}, inplace=True)
-                vessel_last_segment = pd.DataFrame()
-                if last_segment.shape[0] > 0:
-                    vessel_last_segment = last_segment.loc[
-                        last_segment["vessel_id"] == vessel_id, ["mmsi", "timestamp_end", "heading_at_end", "speed_at_end",
-                                                                    "end_position", "excursion_id", "arrival_port_id"]]
-                    vessel_last_segment["start_latitude"] = vessel_last_segment["end_position"].apply(lambda x: x.y)
-                    vessel_last_segment["start_longitude"] = vessel_last_segment["end_position"].apply(lambda x: x.x)
-                    vessel_last_segment.drop("end_position", inplace=True, axis=1)
-                    vessel_last_segment.rename(columns={"timestamp_end": "timestamp_start",
-                                                        "heading_at_end": "heading_at_start",
-                                                        "speed_at_end": "speed_at_start",
-                                                        }, inplace=True)
-                if vessel_last_segment.shape[0] > 0:
-                    # if there's a last segment for this vessel, then it's not the first time a position for this vessel is received
-                    is_new_vessel = False
-                    # and it becomes the start point of the first new segment
-                    df_start.loc[-1] = vessel_last_segment.iloc[0]
-                    df_start.sort_index(inplace=True)
-                    df_start.reset_index(drop=True, inplace=True)
-                    # checks if the excursion of the last segment is closed or not
-                    if vessel_last_segment["arrival_port_id"].iloc[0] >= 0:
-                        open_ongoing_excursion = False
-                    else:
-                        open_ongoing_excursion = True
-                        ongoing_excursion_id = int(vessel_last_segment["excursion_id"].iloc[0])
-
-                else:
-                    # if there's no last segment for this vessel, then it's the first time a position for this vessel is received
-                    is_new_vessel = True
-                    # so we duplicate the starting point to have the first segment while setting it up 1s behind in time (so timestamp_start != timestamp_end)
-                    df_start.loc[-1] = df_start.loc[0]
-                    df_start["timestamp_start"].iloc[-1] += timedelta(0, -1)
-                    df_start.sort_index(inplace=True)
-                    df_start.reset_index(drop=True, inplace=True)
-                    open_ongoing_excursion = False
-                # concat start and end point together
-                df = pd.concat([df_start, df_end], axis=1)
-                # removing segment with same timestamp_start and timestamp_end (no update)
-                df = df[df["timestamp_start"] != df["timestamp_end"]].copy()
-                # reseting index
-                df.reset_index(inplace=True, drop=True)
-                if (df.shape[0] > 0):
-                    # calculate distance
-                    def get_distance_in_nautical_miles(x) -> float:
-                        p1 = (x.start_latitude, x.start_longitude)
-                        p2 = (x.end_latitude, x.end_longitude)
-                        return distance.distance(p1, p2).nautical
-
-                    df["distance"] = df.apply(get_distance_in_nautical_miles, axis=1)
-            else:
-                #df_start=df_end.copy()
-                vessel_last_segment = pd.DataFrame()
-                if last_segment.shape[0] > 0:
-                    vessel_last_segment = last_segment.loc[
-                        last_segment["vessel_id"] == vessel_id, ["mmsi", "timestamp_end", "heading_at_end", "speed_at_end",
-                                                                    "end_position", "excursion_id", "arrival_port_id"]]
-                    vessel_last_segment["start_latitude"] = vessel_last_segment["end_position"].apply(lambda x: x.y)
-                    vessel_last_segment["start_longitude"] = vessel_last_segment["end_position"].apply(lambda x: x.x)
-                    vessel_last_segment.drop("end_position", inplace=True, axis=1)
-                    vessel_last_segment.rename(columns={"timestamp_end": "timestamp_start",
-                                                        "heading_at_end": "heading_at_start",
-                                                        "speed_at_end": "speed_at_start",
-                                                        }, inplace=True)
-                if vessel_last_segment.shape[0] > 0:
-                    # if there's a last segment for this vessel, then it's not the first time a position for this vessel is received
-                    is_new_vessel = False
-                    df_start= vessel_last_segment
-                    df_start.reset_index(drop=True, inplace=True)
-                    # checks if the excursion of the last segment is closed or not
-                    if vessel_last_segment["arrival_port_id"].iloc[0] >= 0:
-                        open_ongoing_excursion = False
-                    else:
-                        open_ongoing_excursion = True
-                        ongoing_excursion_id = int(vessel_last_segment["excursion_id"].iloc[0])
-
-                else:
-                    # if there's no last segment for this vessel, then it's the first time a position for this vessel is received
-                    is_new_vessel = True
-                    # so we duplicate the starting point to have the first segment while setting it up 1s behind in time (so timestamp_start != timestamp_end)
-                    df_start = df_end.copy()
-                    for col in df_start.columns:
-                        df_start.rename(columns={col: col.replace("end", "start")}, inplace=True)                    
-                    df_start["timestamp_start"] += timedelta(0, -1)
-                    df_start.sort_index(inplace=True)
-                    df_start.reset_index(drop=True, inplace=True)
-                    open_ongoing_excursion = False
-                # concat start and end point together
-                df = pd.concat([df_start, df_end], axis=1)
-                # removing segment with same timestamp_start and timestamp_end (no update)
-                df = df[df["timestamp_start"] != df["timestamp_end"]].copy()
-                # reseting index
-                df.reset_index(inplace=True, drop=True)
-
-            if (df.shape[0] > 0):
-                # calculate distance
-                def get_distance_in_nautical_miles(x) -> float:
-                    p1 = (x.start_latitude, x.start_longitude)
-                    p2 = (x.end_latitude, x.end_longitude)
-                    return distance.distance(p1, p2).nautical
-
-                df["distance"] = df.apply(get_distance_in_nautical_miles, axis=1)
-
-                # calculate duration in seconds
-                def get_duration(x) -> float:
-                    return (x.timestamp_end - x.timestamp_start).total_seconds()
-
-                df["segment_duration"] = df.apply(get_duration, axis=1)
-
-                # set default type as AT_SEA
-                df["type"] = "AT_SEA"
-
-                # set type as default_ais for segment with duration > 35 min
-                df.loc[df["segment_duration"] >= 2100, "type"] = "DEFAULT_AIS"
-
-                # calculate average speed in knot
-                df["average_speed"] = df["distance"] / (df["segment_duration"] / 3600)
-
-                # set last_vessel_segment
-                df["last_vessel_segment"] = 0
-                if len(df) >1 :
-                    df["last_vessel_segment"].iloc[-1] = 1
-                else : 
-                    df["last_vessel_segment"] = 1
-
-                # check if segment ends in a port (only for segment with average_speed < maximal_speed_to_check_if_in_port or with type 'DEFAULT_AIS')
-            def get_port(x, session):
-                if x.type == 'DEFAULT_AIS' or x.average_speed < maximal_speed_to_check_if_in_port:
-                    res = port_repository.get_closest_port_in_range(session, x.end_longitude, x.end_latitude,
-                                                                    threshold_distance_to_port)
-                    if res:
-                        (port_id, distance) = res
-                        return port_id
-                    else:
-                        return None
-                else:
-                    return None
-            df["port"] = df.apply(get_port, axis=1, args=(session,))
-
-            # get or create new excursion
-            # logic :
-            # if segment ends in a port while ongoing excursion is open, then we close the excursion
-            # else, if the ongoing excursion is open, then we use the ongoing excursion_id for the segment
-            # else, we create a new excursion whose id will become the ongoing excursion_id for this segment and the future ones
-            # additionnaly, when we create a new excursion, if the vessel is 'new' then we create an 'empty' excursion
-            # else, if the first segment of this new excursion is of type 'DEFAULT_AIS', we estimate the time of departure based
-            # on its ending position, distance traveled and a given average exit speed
-            df["excursion_id"] = np.NaN
-            for a in df.index:
-                if df["port"].iloc[a] is not None and df["port"].iloc[a] >= 0:
-                    if (open_ongoing_excursion):
-                        close_excursion(session, ongoing_excursion_id, int(df["port"].iloc[a]),
-                                        df["end_latitude"].iloc[a],
-                                        df["end_longitude"].iloc[a],
-                                        df["timestamp_end"].iloc[a])  # put the close excursion function here
-                        df["excursion_id"].iloc[a] = ongoing_excursion_id
-                        open_ongoing_excursion = False
-                        nb_closed_excursion += 1
-                elif open_ongoing_excursion:
-                    df["excursion_id"].iloc[a] = ongoing_excursion_id
-                else:
-                    if is_new_vessel:
-                        ongoing_excursion_id = add_excursion(session, int(vessel_id),
-                                                                df["timestamp_end"].iloc[a],
-                                                                Point(df["end_longitude"].iloc[a],
-                                                                    df["end_latitude"].iloc[
-                                                                        a]))
-                        is_new_vessel = False
-                        nb_created_excursion += 1
-                    else:
-                        def get_time_of_departure():
-                            if (df['type'].iloc[a] == 'DEFAULT_AIS'):
-                                return df['timestamp_end'].iloc[a] - timedelta(0, 3600 * df['distance'].iloc[
-                                    a] / average_exit_speed)
-                            else:
-                                return df["timestamp_start"].iloc[a]
-
-                        ongoing_excursion_id = add_excursion(session, int(vessel_id),
-                                                                get_time_of_departure())  # put the create new excursion function here
-                        nb_created_excursion += 1
-                    open_ongoing_excursion = True
-                    df["excursion_id"].iloc[a] = ongoing_excursion_id
-            # concat the result for current vessel in the result dataframe
-            if (df.shape[0] > 0):
-                result = pd.concat([result, df[df["excursion_id"] >= 0]], axis=0)
+        segments = build_segments(batch, last_segment)
+        # vessels whose cached API responses are evicted once the changes are committed
+        changed_vessel_ids = set(segments["vessel_id"].dropna().astype(int).tolist())
+        # check if segment ends in a port (only for segment with average_speed < maximal_speed_to_check_if_in_port or with type 'DEFAULT_AIS')
+        port_index = PortIndex(port_repository.get_ports_buffers(session))
+        check_port = ((segments["type"] == "DEFAULT_AIS")
+                      | (segments["average_speed"] < maximal_speed_to_check_if_in_port)).to_numpy()
+        segments["port"] = np.nan
+        segments.loc[check_port, "port"] = port_index.find_closest_ports_in_range(
+            segments.loc[check_port, "end_longitude"], segments.loc[check_port, "end_latitude"],
+            threshold_distance_to_port,
+        )
+        last_arrivals = excursion_repository.get_last_excursions_arrivals(
+            session, segments["vessel_id"].unique().tolist(),
+        )
+        excursion_ids, new_excursions, closures, port_ids = assign_excursions(segments, last_segment,
+                                                                             last_arrivals)
+        # new excursions are inserted first to replace their local key by their id
+        new_ids = np.array(excursion_repository.batch_insert_excursion(session, new_excursions), dtype=float)
+        is_new = excursion_ids < 0
+        excursion_ids[is_new] = new_ids[(-1 - excursion_ids[is_new]).astype(int)]
+        excursion_repository.batch_close_excursion(session, closures)
+        port_repository.batch_update_port_has_excursion(session, port_ids)
+        segments["excursion_id"] = excursion_ids
+        result = segments[segments["excursion_id"] >= 0].reset_index(drop=True)
+        nb_created_excursion = len(new_excursions)
+        nb_closed_excursion = len(closures) + sum(e.arrival_port_id is not None for e in new_excursions)
         logger.info(f"{nb_created_excursion} excursion(s) créées")
         logger.info(f"{nb_closed_excursion} excursion(s) cloturés")
         logger.info("Création des segments")
-        result.reset_index(drop=True, inplace=True)
         new_segments = []
         for i in result.index:
             new_segment = Segment(
@@ -356,22 +109,29 @@ def run():
         # On vide un peu la mémoire
         session.flush()
         new_segments = None
-        df = None
 
         # Recherche des zones et calcul / mise à jour des stats
         logger.info("Mise en relation des segments avec les zones et calcul des statistiques d'excursion")
-        result = segment_repository.find_segments_in_zones_created_updated_after(session, point_in_time)
+        zone_index = ZoneIndex(zone_repository.get_zones_without_geometry(session),
+                               zone_repository.get_zones_tiles(session))
+        created_segments = segment_repository.get_segments_created_after(session, point_in_time)
+        segments_zones = zone_index.find_segments_zones([s.start_position for s in created_segments],
+                                                        [s.end_position for s in created_segments])
+        result = dict(zip(created_segments, segments_zones))
+        vessels = segment_repository.get_vessels_by_segment_ids(session, [s.id for s in created_segments])
+        changed_vessel_ids.update(vessel.id for vessel in vessels.values())
+        excursions = excursion_repository.get_excursions_by_ids(
+            session, list({s.excursion_id for s in created_segments}),
+        )
         new_rels = []
-        excursions = {}
         segments = []
         new_metricss=[]
         max_created_updated = point_in_time
-        i=0
         for segment, zones in result.items():
             segment_in_zone = False
-            vessel_attributes= segment_repository.get_vessel_attribute_by_segment_created_updated_after(session, segment.id, point_in_time)#metrics_repository.get_vessel_excursion_segment_by_id(session,segment.id) #1
+            # every segment belongs to an excursion, hence to a vessel
+            vessel_attributes = vessels[segment.id]
             types='AT_SEA'
-            zones_names=[]
             for zone in zones:
                 if segment.type == "DEFAULT_AIS":
                     # Issue 234: ne pas créer les relations pour les segments en default AIS
@@ -423,8 +183,7 @@ def run():
                 segments.append(segment)
 
             # Mise à jour de l'excursion avec le temps passé dans chaque type de zone
-            excursion = excursions.get(segment.excursion_id,
-                                       excursion_repository.get_excursion_by_id(session, segment.excursion_id))
+            excursion = excursions[segment.excursion_id]
             if segment.in_amp_zone:
                 if segment.type == "AT_SEA":
                     excursion.total_time_in_amp += segment.segment_duration
@@ -462,16 +221,28 @@ def run():
                 max_created_updated = segment.created_at
 
         
-        excursion_repository.batch_update_excursion(session, excursions.values())
+        excursion_repository.batch_update_excursion_durations(session, list(excursions.values()))
         logger.info(f"{len(excursions.values())} excursions mises à jour")
-        segment_repository.batch_update_segment(session, segments)
+        segment_repository.batch_update_segment_zones_flags(session, segments)
         logger.info(f"{len(segments)} segments mis à jour")
         RelSegmentZoneRepository.batch_create_rel_segment_zone(session, new_rels)
         logger.info(f"{len(new_rels)} associations(s) créées")
         metrics_repository.batch_create_metrics(session, new_metricss) #1
         logger.info(f"{len(new_metricss)} metrics(s) créés") #1
-        vessels_ids = set(exc.vessel_id for exc in excursions.values())
-        nb_last = segment_repository.update_last_segments(session, vessels_ids)
+        # the new last segment of a vessel replaces its previous one, known in memory, unless it starts
+        # before the end of the previous one (late positions): these vessels are recomputed in database
+        new_last = pd.DataFrame([(vessels[s.id].id, s.id, s.timestamp_start) for s in created_segments],
+                                columns=["vessel_id", "segment_id", "timestamp_start"])
+        new_last = new_last.sort_values("timestamp_start").drop_duplicates("vessel_id", keep="last")
+        new_last = new_last.merge(last_segment[["vessel_id", "segment_id", "timestamp_end"]], how="left",
+                                  on="vessel_id", suffixes=("", "_previous"))
+        is_late = new_last["timestamp_start"] < new_last["timestamp_end"]
+        incremental = new_last[~is_late]
+        nb_last = segment_repository.replace_last_segments(
+            session, incremental["segment_id_previous"].dropna().astype(int).tolist(),
+            incremental["segment_id"].unique().tolist(),
+        )
+        nb_last += segment_repository.update_last_segments(session, new_last.loc[is_late, "vessel_id"].tolist())
         logger.info(f"{nb_last} derniers segments mis à jour")
         now = datetime.now(timezone.utc)
         TaskExecutionRepository.set_point_in_time(session, "create_update_excursions_segments", now)
@@ -487,6 +258,8 @@ def run():
                                              now,
                                              position_count)
         session.commit()
+    # the metrics routes read the mart_metrics__* marts, invalidated once they are rebuilt
+    invalidate_cache.run(["positions", *(f"vessel:{id}" for id in changed_vessel_ids)])
 
 
 if __name__ == "__main__":
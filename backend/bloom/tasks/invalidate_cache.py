@@ -0,0 +1,34 @@
+import argparse
+from collections.abc import Iterable
+
+import redis
+
+from bloom.container import UseCases
+from bloom.infra.cache import invalidate_tags
+from bloom.logger import logger
+
+
+def run(tags: Iterable[str]) -> None:
+    """Evicts the cached API responses of the tags. Called by the tasks once their changes are
+    committed: a Redis failure is logged without failing the task, the entries then expire."""
+    tags = sorted(set(tags))
+    if not tags:
+        return
+    try:
+        count = invalidate_tags(UseCases().cache_service(), tags)
+    except redis.RedisError as e:
+        logger.warning(f"Invalidation du cache impossible pour {', '.join(tags)}: {e}")
+        return
+    logger.info(f"{count} réponse(s) en cache invalidée(s) pour {', '.join(tags)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Invalidate cached API responses")
+    parser.add_argument(
+        "tags",
+        nargs="+",
+        help="tags of the responses to evict: vessels, zones, ports, metrics, positions, "
+             "vessel:<id>, zone:<id>, port:<id>",
+    )
+    args = parser.parse_args()
+    run(args.tags)
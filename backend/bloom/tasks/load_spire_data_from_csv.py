@@ -1,15 +1,36 @@
+import argparse
 from pathlib import Path
 from time import perf_counter
+from typing import Optional
 
 import pandas as pd
 from bloom.config import settings
 from bloom.container import UseCases
 from bloom.domain.spire_ais_data import SpireAisData
+from bloom.infra.database import sql_model
 from bloom.infra.database.errors import DBException
 from bloom.logger import logger
 from pydantic import ValidationError
 from shapely import wkb
+from sqlalchemy import BigInteger, DateTime, Double, Integer, SmallInteger
 import numpy as np
+import psycopg2
+
+# type of the columns of spire_ais_data loaded from the CSV
+CSV_COLUMN_TYPES = {
+    column.name: column.type for column in sql_model.SpireAisData.__table__.columns
+    if column.name != "id"
+}
+REQUIRED_COLUMNS = ["spire_update_statement"]
+
+
+def integer_range(column_type: Integer) -> np.iinfo:
+    """Range of the values of an integer column"""
+    if isinstance(column_type, BigInteger):
+        return np.iinfo(np.int64)
+    if isinstance(column_type, SmallInteger):
+        return np.iinfo(np.int16)
+    return np.iinfo(np.int32)
 
 
 def map_to_domain(row: pd.Series) -> SpireAisData:
@@ -74,11 +95,137 @@ def run(csv_file_name: str):
     logger.info(f"{total} ais data créés")
 
 
+def normalize_chunk(chunk: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """Converts the columns of a chunk of the CSV, read as strings, to the types of the columns
+    of spire_ais_data.
+
+    :return tuple: converted chunk, reason of the rejection of each row (NA if it is valid)
+    """
+    df = pd.DataFrame(index=chunk.index)
+    reasons = pd.Series(None, index=chunk.index, dtype=object)
+
+    def reject(invalid: pd.Series, reason: str) -> None:
+        reasons[invalid & reasons.isna()] = reason
+
+    for column in chunk.columns.intersection(list(CSV_COLUMN_TYPES)):
+        values = chunk[column]
+        stripped = values.str.strip()
+        missing = stripped == ""
+        column_type = CSV_COLUMN_TYPES[column]
+        if isinstance(column_type, DateTime):
+            converted = pd.to_datetime(stripped, utc=True, errors="coerce", format="ISO8601")
+        elif isinstance(column_type, Integer):
+            # parsed as python ints, exact even above 2**53 unlike a float64 conversion
+            is_integer = stripped.str.fullmatch(r"[+-]?\d+(\.0*)?")
+            is_number = pd.to_numeric(stripped, errors="coerce").notna()
+            reject(~is_integer & is_number, f"{column}: entier invalide")
+            integers = stripped[is_integer].str.replace(r"\.0*$", "", regex=True).map(int)
+            bounds = integer_range(column_type)
+            in_range = integers.map(lambda value: int(bounds.min) <= value <= int(bounds.max))
+            reject(pd.Series(chunk.index.isin(in_range.index[~in_range.astype(bool)]),
+                             index=chunk.index), f"{column}: valeur hors limites")
+            integers = integers[in_range.astype(bool)]
+            converted = pd.Series(pd.array(integers.tolist(), dtype="Int64"),
+                                  index=integers.index).reindex(chunk.index)
+        elif isinstance(column_type, Double):
+            converted = pd.to_numeric(stripped, errors="coerce")
+            is_infinite = np.isinf(converted)
+            reject(is_infinite, f"{column}: valeur hors limites")
+            converted = converted.where(~is_infinite)
+        else:
+            converted = values.where(~missing)
+        reject(~missing & converted.isna(), f"{column}: valeur invalide")
+        df[column] = converted
+    for column in REQUIRED_COLUMNS:
+        if column not in df.columns:
+            reject(pd.Series(True, index=chunk.index), f"{column}: colonne manquante")
+        else:
+            reject(df[column].isna(), f"{column}: valeur manquante")
+    return df, reasons
+
+
+def run_bulk(csv_file_name: str, chunk_size: int = 100000,
+             rejected_file_name: Optional[str] = None) -> None:
+    """Loads a CSV file in spire_ais_data with COPY, by chunks of chunk_size rows, each one
+    committed. Rows with invalid values are written to rejected_file_name (by default the CSV
+    file name suffixed with .rejected.csv) with the reason of their rejection, as well as the
+    rows of a chunk whose COPY failed. An interrupted load is resumed by loading the file again
+    without its first committed chunks."""
+    use_cases = UseCases()
+    db = use_cases.db()
+    spire_ais_data_repository = use_cases.spire_ais_data_repository()
+
+    rejected_file = Path(rejected_file_name or f"{csv_file_name}.rejected.csv")
+    total = 0
+    rejected = 0
+    with db.session() as session:
+        chunks = pd.read_csv(csv_file_name, sep=";", dtype=str, keep_default_na=False,
+                             chunksize=chunk_size)
+        for chunk in chunks:
+            df, reasons = normalize_chunk(chunk)
+            try:
+                loaded = spire_ais_data_repository.copy_ais_data_frame(
+                    session, df.loc[reasons.isna()],
+                )
+                session.commit()
+            except psycopg2.Error as e:
+                # the chunk is rejected, the chunks already committed are kept
+                session.rollback()
+                logger.error(f"Echec du COPY des lignes {chunk.index[0]} à {chunk.index[-1]}, "
+                             f"lignes rejetées: {e}")
+                loaded = 0
+                reasons = reasons.fillna(f"COPY: {str(e).strip()}")
+            is_rejected = reasons.notna()
+            if is_rejected.any():
+                rejected_rows = chunk.loc[is_rejected].assign(
+                    reject_reason=reasons[is_rejected],
+                )
+                rejected_rows.to_csv(rejected_file, sep=";", index=False,
+                                     mode="a" if rejected else "w", header=rejected == 0)
+                rejected += len(rejected_rows)
+            total += loaded
+            logger.info(f"{total} ais data chargés, {rejected} rejetés")
+    if rejected:
+        logger.warning(f"{rejected} lignes rejetées écrites dans {rejected_file}")
+    logger.info(f"{total} ais data créés")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load Spire AIS data from a CSV file")
+    parser.add_argument(
+        "filename",
+        nargs="?",
+        help="CSV file to load, spire_positions_subset.csv of the data folder if not set",
+        default=Path(settings.data_folder).joinpath("./spire_positions_subset.csv"),
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="load the file by chunks with COPY, rejected rows are written to a side file",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=int,
+        help="number of rows read and written at once in bulk mode",
+        required=False,
+        default=100000,
+    )
+    parser.add_argument(
+        "-r",
+        "--rejected-file",
+        help="file of the rows rejected in bulk mode, <filename>.rejected.csv if not set",
+        required=False,
+        default=None,
+    )
+    args = parser.parse_args()
     time_start = perf_counter()
-    file_name = Path(settings.data_folder).joinpath("./spire_positions_subset.csv")
+    file_name = args.filename
     logger.info(f"DEBUT - Chargement des données AIS Spire depuis le fichier {file_name}")
-    run(file_name)
+    if args.bulk:
+        run_bulk(file_name, args.chunk_size, args.rejected_file)
+    else:
+        run(file_name)
     time_end = perf_counter()
     duration = time_end - time_start
     logger.info(f"FIN - Chargement des données AIS Spire en {duration:.2f}s")
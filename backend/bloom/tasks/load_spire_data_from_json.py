@@ -1,43 +1,142 @@
 import argparse
+import glob
 import json
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 from time import perf_counter
+from typing import Any, Optional, TextIO
 
 from bloom.container import UseCases
-from bloom.infra.http.spire_api_utils import map_raw_vessels_to_domain
+from bloom.infra.http.spire_api_utils import map_raw_vessel_to_row
 from bloom.logger import logger
-from pydantic import ValidationError
 
+# size of the blocks read from a dump file (characters)
+READ_SIZE = 1 << 20
+WHITESPACES = " \t\r\n"
 
-def run(file_name: str) -> None:
+
+def iter_json_array(handle: TextIO, read_size: int = READ_SIZE) -> Iterator[Any]:
+    """Yields the elements of the JSON array of a file one by one, reading it by blocks"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    opened = False
+    separators = WHITESPACES
+    while True:
+        while position < len(buffer) and buffer[position] in separators:
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of the JSON array")
+            block = handle.read(read_size)
+            buffer, position, eof = buffer[position:] + block, 0, not block
+            continue
+        if not opened:
+            if buffer[position] != "[":
+                raise ValueError("The file is not a JSON array")
+            opened = True
+            separators = WHITESPACES + ","
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = None
+        if end is None or (end == len(buffer) and not eof):
+            # the element may continue in the next block
+            block = handle.read(read_size)
+            buffer, position, eof = buffer[position:] + block, 0, not block
+            continue
+        yield value
+        position = end
+
+
+def find_files(path: str) -> list[Path]:
+    """Dump files of a path: a file, every spire_*.json file of a directory or a glob pattern"""
+    if Path(path).is_dir():
+        return sorted(Path(path).glob("spire_*.json"))
+    return sorted(Path(file) for file in glob.glob(path))
+
+
+def load_file(file_name: Path, chunk_size: int) -> tuple[int, int]:
+    """Loads a dump file in spire_ais_data, by COPY of chunk_size rows, in one transaction.
+
+    :return tuple: number of rows loaded, number of vessels rejected
+    """
     use_cases = UseCases()
     spire_ais_data_repository = use_cases.spire_ais_data_repository()
     db = use_cases.db()
 
     logger.info(f"Loading spire data from {file_name}")
-    orm_data = []
-    try:
-        with Path.open(file_name) as json_data, db.session() as session:
-            raw_vessels = json.load(json_data)
-            spire_ais_data = map_raw_vessels_to_domain(raw_vessels)
-            orm_data = spire_ais_data_repository.batch_create_ais_data(spire_ais_data, session)
-            session.commit()
-    except ValidationError as e:
-        logger.error("Erreur de validation des données JSON")
-        logger.error(e.errors())
-    logger.info(f"{len(orm_data)} vessel data loaded")
+    rejected = 0
+
+    def rows(raw_vessels: Iterator[dict[str, Any]]) -> Iterator[tuple]:
+        nonlocal rejected
+        for vessel in raw_vessels:
+            try:
+                yield map_raw_vessel_to_row(vessel)
+            except ValueError as e:
+                rejected += 1
+                logger.warning(f"{file_name}: vessel {vessel.get('id')} rejected, {e}")
+
+    loaded = 0
+    with Path(file_name).open() as json_data, db.session() as session:
+        valid_rows = rows(iter_json_array(json_data))
+        while chunk := list(islice(valid_rows, chunk_size)):
+            loaded += spire_ais_data_repository.copy_ais_data_rows(session, chunk)
+        session.commit()
+    logger.info(f"{file_name}: {loaded} vessel data loaded, {rejected} rejected")
+    return loaded, rejected
+
+
+def run(path: str, chunk_size: int = 10000, workers: Optional[int] = None) -> None:
+    files = find_files(path)
+    if not files:
+        logger.warning(f"No file to load for {path}")
+        return
+    if len(files) == 1 or workers == 1:
+        results = [load_file(file, chunk_size) for file in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load_file, files, [chunk_size] * len(files)))
+    loaded = sum(result[0] for result in results)
+    rejected = sum(result[1] for result in results)
+    logger.info(f"{len(files)} files, {loaded} vessel data loaded, {rejected} rejected")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Load Spire data from file JSON file")
     parser.add_argument(
         "filename",
-        help="Path to JSON file to load",
+        help="Path to JSON file to load, directory of spire_*.json files or glob pattern",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=int,
+        help="number of rows written by COPY statement",
+        required=False,
+        default=10000,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="number of files loaded in parallel, number of processors if not set",
+        required=False,
+        default=None,
     )
     args = parser.parse_args()
     time_start = perf_counter()
     logger.info(f"DEBUT - Chargement des données JSON depuis le fichier {args.filename}")
-    run(args.filename)
+    run(args.filename, args.chunk_size, args.workers)
     time_end = perf_counter()
     duration = time_end - time_start
     logger.info(f"FIN - Chargement des données JSON en {duration:.2f}s")
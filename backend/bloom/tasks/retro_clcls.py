@@ -24,8 +24,9 @@ with db.session() as session:
     excursion_repository = use_cases.excursion_repository()
 
     result= segment_repository.find_segments_in_zones(session)
+    vessels = segment_repository.get_vessels_by_segment_ids(session, [s.id for s in result])
+    excursions = excursion_repository.get_excursions_by_ids(session, list({s.excursion_id for s in result}))
     new_rels = []
-    excursions = {}
     segments = []
     for segment, zones in result.items():
         segment_in_zone = False
@@ -37,12 +38,12 @@ with db.session() as session:
             if zone.category == "amp":
                 segment.in_amp_zone = True
             elif zone.category == "Fishing coastal waters (6-12 NM)":
-                country_iso3 = segment_repository.get_vessel_attribute_by_segment(session, segment.id)
+                country_iso3 = vessels[segment.id].country_iso3
                 beneficiaries = zone.json_data.get("beneficiaries", [])
                 if country_iso3 not in beneficiaries:
                     segment.in_zone_with_no_fishing_rights = True
             elif zone.category == "Clipped territorial seas":
-                country_iso3 = segment_repository.get_vessel_attribute_by_segment(session, segment.id)
+                country_iso3 = vessels[segment.id].country_iso3
                 if country_iso3 != "FRA":
                     segment.in_zone_with_no_fishing_rights = True
             elif zone.category == "Territorial seas":
@@ -50,8 +51,7 @@ with db.session() as session:
         if segment_in_zone:
             segments.append(segment)
         # Mise à jour de l'excursion avec le temps passé dans chaque type de zone
-        excursion = excursions.get(segment.excursion_id,
-                                    excursion_repository.get_excursion_by_id(session, segment.excursion_id))
+        excursion = excursions[segment.excursion_id]
         if segment.in_amp_zone:
             if segment.type == "AT_SEA":
                 excursion.total_time_in_amp += segment.segment_duration
@@ -82,9 +82,9 @@ with db.session() as session:
         excursions[excursion.id] = excursion
 
 
-    excursion_repository.batch_update_excursion(session, excursions.values())
+    excursion_repository.batch_update_excursion_durations(session, list(excursions.values()))
     logger.info(f"{len(excursions.values())} excursions mises à jour")
-    segment_repository.batch_update_segment(session, segments)
+    segment_repository.batch_update_segment_zones_flags(session, segments)
     logger.info(f"{len(segments)} segments mis à jour")
     RelSegmentZoneRepository.batch_create_rel_segment_zone(session, new_rels)
     logger.info(f"{len(new_rels)} associations(s) créées")
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import httpx
+from fastapi import FastAPI
+
+from bloom.app import app
+from bloom.config import settings
+from bloom.logger import logger
+
+# number of AMPs loaded by the map (TOTAL_AMPS in frontend/constants/totals.constants.ts),
+# fetched by ranges of 100 zones
+TOTAL_AMPS = 722
+ZONES_RANGES = [f"items={start}-{min(start + 99, TOTAL_AMPS - 1)}"
+                for start in range(0, TOTAL_AMPS, 100)]
+
+# requests of the dashboard and of the map, as sent by the frontend: route, query parameters
+# and headers. The {start_at} and {end_at} placeholders are replaced by the date range of each
+# window
+DEFAULT_REQUESTS = [
+    ("/api/v2/metrics/vessels/activity",
+     {"start_at": "{start_at}", "end_at": "{end_at}", "limit": "5", "order": "DESC",
+      "category": "amp"}, {}),
+    ("/api/v2/metrics/zones/activity",
+     {"category": "amp", "start_at": "{start_at}", "end_at": "{end_at}", "limit": "5",
+      "order": "DESC"}, {}),
+    ("/api/v2/metrics/vessels-at-sea", {"start_at": "{start_at}", "end_at": "{end_at}"}, {}),
+    ("/api/v2/metrics/mpas-visited", {"start_at": "{start_at}", "end_at": "{end_at}"}, {}),
+    ("/api/v2/vessels/all/positions/last", {}, {}),
+] + [("/api/v2/zones", {}, {"range": zones_range}) for zones_range in ZONES_RANGES]
+
+Request = tuple[str, dict[str, str], dict[str, str]]
+
+
+@dataclass
+class WarmUpResult:
+    route: str
+    params: dict[str, str]
+    headers: dict[str, str]
+    status: int
+    elapsed: float
+    size: int
+
+
+def date_range(days: int, tz: str, now: Optional[datetime] = None) -> dict[str, str]:
+    """Date range of the last days as computed by the frontend (getDateRange): from midnight
+    days ago to the end of today in the timezone of the users, in UTC with milliseconds"""
+    today = (now or datetime.now(timezone.utc)).astimezone(ZoneInfo(tz)).date()
+    start = datetime.combine(today - timedelta(days=days), time.min, ZoneInfo(tz))
+    end = datetime.combine(today, time(23, 59, 59, 999000), ZoneInfo(tz))
+    return {name: value.astimezone(timezone.utc).isoformat(timespec="milliseconds")
+            .replace("+00:00", "Z") for name, value in (("start_at", start), ("end_at", end))}
+
+
+def expand(requests: list[Request], windows: list[int], tz: str,
+           now: Optional[datetime] = None) -> list[Request]:
+    """Requests to send: the requests with a date range once per window, the others once"""
+    ranges = [date_range(days, tz, now) for days in windows]
+    expanded = []
+    for route, params, headers in requests:
+        if any("{" in value for value in params.values()):
+            expanded += [(route,
+                          {name: value.format(**dates) for name, value in params.items()},
+                          headers) for dates in ranges]
+        else:
+            expanded.append((route, params, headers))
+    return expanded
+
+
+async def warm(app: FastAPI, requests: list[Request]) -> list[WarmUpResult]:
+    """Sends the requests one by one to the application, in process, with nocache so that their
+    responses are built again and stored in the response cache"""
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://warm-cache",
+                              headers={"x-key": settings.api_key}, timeout=None) as client:
+        for route, params, headers in requests:
+            start = perf_counter()
+            response = await client.get(route, params=params | {"nocache": "true"},
+                                        headers=headers)
+            results.append(WarmUpResult(route, params, headers, response.status_code,
+                                        perf_counter() - start, len(response.content)))
+    return results
+
+
+def run(requests: list[Request], windows: list[int], tz: str) -> None:
+    results = asyncio.run(warm(app, expand(requests, windows, tz)))
+    for result in results:
+        log = logger.info if result.status in (200, 206) else logger.warning
+        log(f"{result.route} {result.params} {result.headers}: HTTP {result.status} en "
+            f"{result.elapsed:.2f}s ({result.size} octets)")
+    failed = sum(result.status not in (200, 206) for result in results)
+    logger.info(f"{len(results)} réponse(s) mises en cache, {failed} en erreur, "
+                f"{sum(result.elapsed for result in results):.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm up the cache of the API responses")
+    parser.add_argument(
+        "-f",
+        "--file",
+        help='JSON file of the requests, [{"route": "/api/v2/...", "params": {...}, "headers": '
+             '{...}}], params may use the {start_at} and {end_at} placeholders. Dashboard and '
+             'map requests if not set',
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-d",
+        "--days",
+        type=int,
+        nargs="+",
+        help="windows of the date ranges, in days",
+        required=False,
+        default=[7],
+    )
+    parser.add_argument(
+        "-t",
+        "--timezone",
+        help="timezone of the frontend users, used to compute the date ranges",
+        required=False,
+        default="Europe/Paris",
+    )
+    args = parser.parse_args()
+    if args.file:
+        requests = [(request["route"], request.get("params", {}), request.get("headers", {}))
+                    for request in json.loads(Path(args.file).read_text())]
+    else:
+        requests = DEFAULT_REQUESTS
+    time_start = perf_counter()
+    logger.info("DEBUT - Préchargement du cache des réponses de l'API")
+    run(requests, args.days, args.timezone)
+    time_end = perf_counter()
+    duration = time_end - time_start
+    logger.info(f"FIN - Préchargement du cache des réponses de l'API en {duration:.2f}s")
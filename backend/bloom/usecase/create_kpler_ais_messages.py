@@ -1,12 +1,14 @@
 import json
+from dataclasses import dataclass
 from time import perf_counter
+from typing import Any, Optional
 import asyncio
 
 from bloom.config import settings
 from bloom.container import UseCases
 from bloom.domain.vessel import Vessel
 from bloom.infra.kpler_api_client import KplerApiClient
-from bloom.infra.http.kpler_api_utils import map_raw_messages_to_domain
+from bloom.infra.http.kpler_api_utils import map_raw_messages_to_columns
 from bloom.infra.repositories.repository_task_execution import TaskExecutionRepository
 from bloom.logger import logger
 from datetime import datetime, timezone
@@ -15,17 +17,29 @@ from pydantic import ValidationError
 import argparse
 
 
+@dataclass
+class ShardMetrics:
+    """Metrics of the ais-latest request of a shard of MMSI (latency in seconds)"""
+    index: int
+    mmsi_count: int
+    latency: float = 0.0
+    features: int = 0
+    error: Optional[str] = None
+
+
 class GetVesselsFromKplerUseCase:
     def __init__(self) -> None:
         self.api_client = KplerApiClient()
         self.messages_page_size = settings.messages_page_size
+        self.max_concurrency = settings.kpler_max_concurrency
+        self.shard_metrics: list[ShardMetrics] = []
 
     async def run(self, dump_path: str):
         use_cases = UseCases()
         vessel_repository = use_cases.vessel_repository()
         kpler_ais_data_repository = use_cases.kpler_ais_data_repository()
         db = use_cases.db()
-        orm_data = []
+        nb_loaded = 0
 
         try:
             current_datetime=None
@@ -56,10 +70,10 @@ class GetVesselsFromKplerUseCase:
                                 except Exception as e:
                                     logger.warning("Echec de l'écriture de la réponse Kpler", exc_info=e)   
                             else:
-                                kpler_ais_data = map_raw_messages_to_domain(raw_messages)
-                                orm_data = kpler_ais_data_repository.batch_create_ais_data(
-                                    kpler_ais_data,
+                                kpler_ais_data = map_raw_messages_to_columns(raw_messages)
+                                nb_loaded = kpler_ais_data_repository.batch_insert_ais_data_columns(
                                     session,
+                                    kpler_ais_data,
                                 )
                                 session.commit()
                         # Vu que l'on a enregistré et commité en bdd une ligne pour signalter qu'une 
@@ -90,26 +104,61 @@ class GetVesselsFromKplerUseCase:
         except Exception as e:
             logger.error("Echec de l'appel API", exc_info=e)
             raise e
-        logger.info(f"{len(orm_data)} données chargées")
+        logger.info(f"{nb_loaded} données chargées")
         session.close()
 
-    async def get_latest_ais_messages(self, vessels: list[Vessel]):
-        pages = []
+    async def get_latest_ais_messages(self, vessels: list[Vessel]) -> list[dict[str, Any]]:
+        """Requests the latest AIS messages of the vessels by shards of messages_page_size MMSI,
+        at most max_concurrency requests at once. The metrics of each shard are kept in
+        shard_metrics."""
         mmsi_list = [vessel.mmsi for vessel in vessels]
-        mmsi_start = 0
-        mmsi_end = self.messages_page_size
-        while mmsi_start <= len(mmsi_list):
-            mmsi_list_string = ", ".join(map(str, mmsi_list[mmsi_start:mmsi_end]))
-            page = await self.api_client.get(
-                "ais-latest",
-                {"filter": f"mmsi IN ({mmsi_list_string})"}
+        shards = [mmsi_list[i:i + self.messages_page_size]
+                  for i in range(0, len(mmsi_list), self.messages_page_size)]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        features = []
+        self.shard_metrics = [ShardMetrics(index=i, mmsi_count=len(shard))
+                              for i, shard in enumerate(shards)]
+        async with self.api_client:
+            results = await asyncio.gather(
+                *(self.get_shard_messages(shard, metrics, semaphore, features)
+                  for shard, metrics in zip(shards, self.shard_metrics)),
+                return_exceptions=True,
             )
-            if page is not None:
-                pages = pages + page['features']
-            mmsi_start += self.messages_page_size + 1
-            mmsi_end += self.messages_page_size + 1
-        await self.api_client.close()
-        return pages
+        errors = [metrics for metrics in self.shard_metrics if metrics.error is not None]
+        latencies = [metrics.latency for metrics in self.shard_metrics]
+        logger.info(f"{len(features)} messages reçus pour {len(shards)} lots de MMSI, "
+                    f"{len(errors)} en erreur, latence max {max(latencies, default=0):.2f}s")
+        api_client = self.api_client
+        logger.info(f"{api_client.request_count} requêtes Kpler dont {api_client.retry_count} "
+                    f"nouveaux essais, {api_client.bytes_received} octets reçus en "
+                    f"{api_client.latency:.2f}s")
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return features
+
+    async def get_shard_messages(self, mmsi_list: list[int], metrics: ShardMetrics,
+                                 semaphore: asyncio.Semaphore,
+                                 features: list[dict[str, Any]]) -> None:
+        """Requests the latest AIS messages of a shard and adds them to features"""
+        mmsi_list_string = ", ".join(map(str, mmsi_list))
+        async with semaphore:
+            start = perf_counter()
+            try:
+                page = await self.api_client.get(
+                    "ais-latest",
+                    {"filter": f"mmsi IN ({mmsi_list_string})"}
+                )
+            except Exception as e:
+                metrics.error = repr(e)
+                logger.warning(f"Echec de la requête ais-latest du lot {metrics.index}: {e!r}")
+                raise
+            finally:
+                metrics.latency = perf_counter() - start
+        if page is not None:
+            features.extend(page['features'])
+            metrics.features = len(page['features'])
+
 
 async def main(dump_path: str):
     usecase = GetVesselsFromKplerUseCase()
@@ -0,0 +1,88 @@
+"""Benchmark of the cleaning stage of clean_positions on a synthetic Spire batch.
+
+Usage: python tests/benchmark_clean_positions.py [--rows 1000000] [--vessels 2000]
+"""
+import argparse
+import io
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from bloom.domain.vessel_position import VesselPosition
+from bloom.infra.database.bulk_copy import to_ewkb, write_csv
+from bloom.infra.repositories.repository_vessel_position import VESSEL_POSITION_COPY_COLUMNS
+from bloom.tasks.clean_positions import POSITION_COLUMNS, clean_batch
+
+
+def synthetic_batch(rows: int, vessels: int) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(0)
+    t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    vessel_ids = rng.integers(0, vessels, rows)
+    timestamps = pd.to_datetime(t0) + pd.to_timedelta(np.sort(rng.integers(0, 7 * 86400, rows)), unit="s")
+    batch = pd.DataFrame({
+        "id": np.arange(rows),
+        "vessel_mmsi": 200000000 + vessel_ids,
+        "vessel_id": vessel_ids,
+        "position_accuracy": "HIGH",
+        "position_collection_type": "terrestrial",
+        "position_course": rng.uniform(0, 360, rows),
+        "position_heading": rng.uniform(0, 360, rows),
+        "position_latitude": rng.uniform(43, 51, rows),
+        "position_longitude": rng.uniform(-5, 8, rows),
+        "position_maneuver": None,
+        "position_navigational_status": "UNDER_WAY_USING_ENGINE",
+        "position_rot": 0.0,
+        "position_speed": rng.uniform(0, 12, rows),
+        "position_timestamp": timestamps,
+        "position_update_timestamp": timestamps,
+        "created_at": timestamps + timedelta(minutes=1),
+    })
+    # a known last position for half of the vessels, an ongoing excursion for half of them
+    known = np.arange(0, vessels, 2)
+    last_positions = pd.DataFrame({
+        "vessel_id": known,
+        "timestamp_end": pd.to_datetime(t0),
+        "longitude": rng.uniform(-5, 8, len(known)),
+        "latitude": rng.uniform(43, 51, len(known)),
+    })
+    excursions = pd.DataFrame({"excursion_id": known[::2], "vessel_id": known[::2], "arrival_at": None})
+    return batch, last_positions, excursions
+
+
+def run(rows: int, vessels: int) -> None:
+    batch, last_positions, excursions = synthetic_batch(rows, vessels)
+
+    start = perf_counter()
+    kept, _ = clean_batch(batch, last_positions, excursions)
+    print(f"clean_batch: {perf_counter() - start:.2f}s, {len(kept)}/{rows} positions kept")
+
+    start = perf_counter()
+    positions = kept[list(POSITION_COLUMNS)].rename(columns=POSITION_COLUMNS)[VESSEL_POSITION_COPY_COLUMNS]
+    positions["position"] = to_ewkb(positions["longitude"], positions["latitude"])
+    write_csv(positions, io.StringIO())
+    print(f"COPY buffer: {perf_counter() - start:.2f}s")
+
+    # previous implementation: one VesselPosition per row, on a sample
+    sample = kept.head(100_000)
+    start = perf_counter()
+    sample.apply(lambda row: VesselPosition(
+        vessel_id=row["vessel_id"], timestamp=row["position_timestamp"], accuracy=row["position_accuracy"],
+        collection_type=row["position_collection_type"], course=row["position_course"],
+        heading=row["position_heading"], position=Point(row["position_longitude"], row["position_latitude"]),
+        latitude=row["position_latitude"], longitude=row["position_longitude"],
+        maneuver=row["position_maneuver"], navigational_status=row["position_navigational_status"],
+        rot=row["position_rot"], speed=row["speed"]), axis=1)
+    elapsed = perf_counter() - start
+    print(f"VesselPosition per row: {elapsed:.2f}s for {len(sample)} rows "
+          f"(~{elapsed * len(kept) / max(len(sample), 1):.2f}s for {len(kept)} rows)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the cleaning stage of clean_positions")
+    parser.add_argument("-r", "--rows", type=int, default=1_000_000, help="number of Spire rows")
+    parser.add_argument("-v", "--vessels", type=int, default=2000, help="number of vessels")
+    args = parser.parse_args()
+    run(args.rows, args.vessels)
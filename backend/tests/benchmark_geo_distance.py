@@ -0,0 +1,42 @@
+"""Benchmark of bloom.services.geo.compute_distances against geopy.
+
+Usage: python tests/benchmark_geo_distance.py [--pairs 1000000]
+"""
+import argparse
+from time import perf_counter
+
+import numpy as np
+from geopy import distance
+
+from bloom.services import geo
+
+
+def run(pairs: int) -> None:
+    rng = np.random.default_rng(0)
+    # positions spread over the french coasts, like the AIS segments
+    lat1 = rng.uniform(41, 51, pairs)
+    lon1 = rng.uniform(-6, 9, pairs)
+    lat2 = lat1 + rng.normal(0, 0.05, pairs)
+    lon2 = lon1 + rng.normal(0, 0.05, pairs)
+
+    results = {}
+    for method in ("haversine", "wgs84"):
+        start = perf_counter()
+        results[method] = geo.compute_distances(lat1, lon1, lat2, lon2, unit="nm", method=method)
+        print(f"compute_distances({method}): {perf_counter() - start:.2f}s")
+
+    start = perf_counter()
+    expected = np.fromiter((distance.distance(p1, p2).nautical
+                            for p1, p2 in zip(zip(lat1, lon1), zip(lat2, lon2))),
+                           dtype=float, count=pairs)
+    print(f"geopy.distance.distance: {perf_counter() - start:.2f}s")
+
+    for method, result in results.items():
+        print(f"{method} max error: {np.max(np.abs(result - expected)) * 1852:.6f}m")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the distance kernel")
+    parser.add_argument("-p", "--pairs", type=int, default=1_000_000, help="number of pairs")
+    args = parser.parse_args()
+    run(args.pairs)
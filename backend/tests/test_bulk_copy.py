@@ -0,0 +1,83 @@
+import io
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import Point
+
+from bloom.infra.database import bulk_copy
+
+
+class Cursor:
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, file):
+        self.copies.append((sql, file.read()))
+
+    def close(self):
+        pass
+
+
+class Session:
+    """Session whose DBAPI connection only records the COPY statements"""
+
+    def __init__(self):
+        self.cursor = Cursor()
+
+    def flush(self):
+        pass
+
+    def connection(self):
+        return SimpleNamespace(connection=SimpleNamespace(cursor=lambda: self.cursor))
+
+
+def test_copy_rows(monkeypatch):
+    session = Session()
+    monkeypatch.setattr(bulk_copy, "COPY_CHUNK_SIZE", 2)
+    point = Point(-4.5, 47.25)
+    rows = [
+        (1, "AT_SEA", datetime(2024, 1, 1, tzinfo=timezone.utc), timedelta(minutes=10), point, True),
+        (2, "", None, None, None, False),
+        (3, "a,b", pd.NaT, None, None, pd.NA),
+        (4, "", None, float("nan"), None, None),
+        (np.int64(5), "", None, np.float64(1.5), None, np.bool_(True)),
+    ]
+
+    count = bulk_copy.copy_rows(session, "fct_segment",
+                                ["id", "type", "timestamp_start", "segment_duration", "start_position",
+                                 "last_vessel_segment"], rows)
+
+    assert count == 5
+    (sql, first), (_, second), (_, third) = session.cursor.copies
+    assert sql == ('COPY fct_segment ("id", "type", "timestamp_start", "segment_duration", '
+                   '"start_position", "last_vessel_segment") FROM STDIN WITH (FORMAT csv)')
+    ewkb = shapely.to_wkb(shapely.set_srid(point, 4326), hex=True, include_srid=True)
+    assert first.splitlines() == [
+        f'1,"AT_SEA","2024-01-01T00:00:00+00:00","600.0 seconds","{ewkb}",t',
+        '2,"",,,,f',
+    ]
+    assert second.splitlines() == ['3,"a,b",,,,', '4,"",,,,']
+    assert third.splitlines() == ['5,"",,1.5,,t']
+
+
+def test_write_csv():
+    df = pd.DataFrame({
+        "vessel_id": [1, 2],
+        "timestamp": pd.to_datetime([datetime(2024, 1, 1, 12, tzinfo=timezone.utc), None], utc=True),
+        "accuracy": ["HIGH", None],
+        "speed": [1.5, np.nan],
+    })
+    df["position"] = bulk_copy.to_ewkb([-4.5, 2.0], [47.25, 50.0])
+    buffer = io.StringIO()
+
+    bulk_copy.write_csv(df, buffer)
+
+    ewkb = shapely.to_wkb(shapely.set_srid(shapely.points([-4.5, 2.0], [47.25, 50.0]), 4326),
+                          hex=True, include_srid=True)
+    assert buffer.getvalue().splitlines() == [
+        f"1,2024-01-01T12:00:00.000000+00:00,HIGH,1.5,{ewkb[0]}",
+        f"2,,,,{ewkb[1]}",
+    ]
@@ -0,0 +1,296 @@
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from bloom.config import settings
+from bloom.dependencies import X_API_KEY_HEADER, cache, check_apikey
+import asyncio
+import dataclasses
+
+import httpx
+
+from bloom.infra.cache import (INVALIDATE_SCRIPT, RELEASE_LOCK_SCRIPT, SET_SCRIPT,
+                               CachedResponse, ResponseCache)
+
+
+class MemoryRedis:
+    """In-memory stand-in of the asyncio Redis client"""
+
+    def __init__(self):
+        self.values = {}
+        self.expirations = {}
+        self.sets = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        self.expirations[key] = ex if px is None else px / 1000
+        return True
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def register_script(self, script):
+        return {RELEASE_LOCK_SCRIPT: self.release, SET_SCRIPT: self.set_tagged,
+                INVALIDATE_SCRIPT: self.invalidate}[script]
+
+    async def release(self, keys, args):
+        if self.values.get(keys[0]) == args[0].encode():
+            del self.values[keys[0]]
+            return 1
+        return 0
+
+    async def set_tagged(self, keys, args):
+        tags = (len(keys) - 1) // 2
+        if any(int(self.values.get(generation, 0)) != expected
+               for generation, expected in zip(keys[1 + tags:], args[2:])):
+            return 0
+        await self.set(keys[0], args[0], ex=args[1])
+        for tag in keys[1:1 + tags]:
+            self.sets.setdefault(tag, set()).add(keys[0])
+            self.expirations[tag] = args[1]
+        return 1
+
+    async def invalidate(self, keys):
+        tags = len(keys) // 2
+        count = 0
+        for tag, generation in zip(keys[:tags], keys[tags:]):
+            for key in self.sets.pop(tag, set()):
+                count += self.values.pop(key, None) is not None
+            self.values[generation] = int(self.values.get(generation, 0)) + 1
+        return count
+
+    async def flushall(self):
+        self.values.clear()
+
+    async def aclose(self):
+        pass
+
+
+def create_app(client: MemoryRedis) -> tuple[FastAPI, list]:
+    app = FastAPI()
+    app.state.response_cache = ResponseCache(client, expiration=60)
+    calls = []
+
+    @app.get("/items/{item_id}")
+    @cache
+    async def read_item(request: Request, item_id: int, size: int = 0, nocache: bool = False):
+        calls.append(item_id)
+        return {"id": item_id, "values": [item_id] * size}
+
+    @app.get("/api/v2/vessels/{vessel_id}/positions/last")
+    @cache(tags=["positions"])
+    async def read_position(request: Request, vessel_id: int, nocache: bool = False):
+        calls.append(vessel_id)
+        return {"vessel_id": vessel_id}
+
+    @app.get("/pages")
+    @cache
+    async def read_pages(request: Request, nocache: bool = False):
+        calls.append(request.headers.get("range"))
+        if "range" not in request.headers:
+            return list(range(10))
+        start, end = map(int, request.headers["range"].removeprefix("items=").split("-"))
+        return JSONResponse(list(range(start, end + 1)), status_code=206,
+                            headers={"Content-Range": f"{start}-{end}/10"})
+
+    return app, calls
+
+
+def test_cache_checks_apikey():
+    client = MemoryRedis()
+    app = FastAPI()
+    app.state.response_cache = ResponseCache(client, expiration=60)
+
+    @app.get("/zones")
+    @cache
+    async def list_zones(request: Request, nocache: bool = False,
+                         key: str = Depends(X_API_KEY_HEADER)):
+        check_apikey(key)
+        return [{"id": 1}]
+
+    http = TestClient(app)
+
+    assert http.get("/zones", headers={"x-key": settings.api_key}).json() == [{"id": 1}]
+    assert http.get("/zones").status_code == 401
+    assert http.get("/zones", headers={"x-key": "wrong"}).status_code == 401
+
+
+def test_cache_key_sorted():
+    client = MemoryRedis()
+    app, calls = create_app(client)
+    http = TestClient(app)
+
+    http.get("/items/4?size=2&lang=fr")
+    http.get("/items/4?lang=fr&nocache=false&size=2")
+
+    assert calls == [4]
+    assert sorted(client.values) == ["/items/4/lang=fr&size=2"]
+
+
+def test_cache_ranges():
+    client = MemoryRedis()
+    app, calls = create_app(client)
+    http = TestClient(app)
+
+    for _ in range(2):
+        first = http.get("/pages", headers={"Range": "items=0-4"})
+        assert first.status_code == 206
+        assert first.headers["content-range"] == "0-4/10"
+        assert first.json() == [0, 1, 2, 3, 4]
+        assert http.get("/pages", headers={"Range": "items=5-9"}).json() == [5, 6, 7, 8, 9]
+        whole = http.get("/pages")
+        assert whole.status_code == 200
+        assert "content-range" not in whole.headers
+
+    assert calls == ["items=0-4", "items=5-9", None]
+    assert sorted(client.values) == ["/pages/", "/pages/#items=0-4", "/pages/#items=5-9"]
+
+
+def test_cache_hits_and_misses():
+    client = MemoryRedis()
+    app, calls = create_app(client)
+    http = TestClient(app)
+
+    for _ in range(3):
+        assert http.get("/items/1").json() == {"id": 1, "values": []}
+    assert http.get("/items/2").json() == {"id": 2, "values": []}
+    assert http.get("/items/1?nocache=true").json() == {"id": 1, "values": []}
+
+    assert calls == [1, 2, 1]
+    assert sorted(client.values) == ["/items/1/", "/items/2/"]
+    assert set(client.expirations.values()) == {60}
+    assert not any(key.startswith("lock:") for key in client.values)
+    metrics = app.state.response_cache.metrics["/items/{item_id}"].as_dict()
+    assert (metrics["hits"], metrics["misses"]) == (2, 3)
+    assert metrics["hit_ratio"] == 0.4
+
+
+def test_cache_etag_and_gzip():
+    client = MemoryRedis()
+    app, calls = create_app(client)
+    http = TestClient(app)
+
+    response = http.get("/items/3?size=1000")
+    etag = response.headers["etag"]
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["values"] == [3] * 1000
+    assert client.values["/items/3/size=1000"].startswith(etag.encode())
+
+    identity = http.get("/items/3?size=1000", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert identity.json() == response.json()
+
+    not_modified = http.get("/items/3?size=1000", headers={"If-None-Match": f'W/{etag}'})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert calls == [3]
+
+
+def test_cache_tags():
+    client = MemoryRedis()
+    app, calls = create_app(client)
+    http = TestClient(app)
+
+    http.get("/api/v2/vessels/7/positions/last")
+    http.get("/items/1")
+
+    key = "/api/v2/vessels/7/positions/last/"
+    assert client.sets == {
+        "tag:vessels": {key},
+        "tag:vessel:7": {key},
+        "tag:positions": {key},
+        "tag:items": {"/items/1/"},
+    }
+    assert client.expirations["tag:vessel:7"] == 60
+
+
+def test_cache_invalidated_during_build():
+    client = MemoryRedis()
+    app = FastAPI()
+    app.state.response_cache = response_cache = ResponseCache(client, expiration=60)
+    versions = []
+
+    @app.get("/api/v2/vessels/{vessel_id}")
+    @cache
+    async def read_vessel(request: Request, vessel_id: int, nocache: bool = False):
+        versions.append(len(versions))
+        if len(versions) == 1:
+            # a task commits a change and evicts the vessel while its response is built
+            await response_cache.invalidate([f"vessel:{vessel_id}"])
+        return {"version": versions[-1]}
+
+    http = TestClient(app)
+
+    assert http.get("/api/v2/vessels/7").json() == {"version": 0}
+    assert "/api/v2/vessels/7/" not in client.values
+    assert http.get("/api/v2/vessels/7").json() == {"version": 1}
+    assert http.get("/api/v2/vessels/7").json() == {"version": 1}
+    assert versions == [0, 1]
+    assert asyncio.run(response_cache.invalidate(["vessels"])) == 1
+    assert client.values["gen:vessels"] == 1
+
+
+async def concurrent_gets(app: FastAPI, count: int, url: str) -> list[httpx.Response]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        return await asyncio.gather(*[http.get(url) for _ in range(count)])
+
+
+def create_slow_app(client: MemoryRedis, calls: list) -> FastAPI:
+    app = FastAPI()
+    app.state.response_cache = ResponseCache(client, expiration=60, stale_expiration=60,
+                                             lock_poll=0.01)
+
+    @app.get("/slow")
+    @cache
+    async def slow(request: Request, nocache: bool = False):
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return {"call": len(calls)}
+
+    return app
+
+
+def test_cache_single_flight():
+    client = MemoryRedis()
+    calls = []
+    worker, other_worker = create_slow_app(client, calls), create_slow_app(client, calls)
+
+    async def requests():
+        return await asyncio.gather(concurrent_gets(worker, 5, "/slow"),
+                                    concurrent_gets(other_worker, 5, "/slow"))
+
+    responses = [r for worker_responses in asyncio.run(requests()) for r in worker_responses]
+
+    # one build for the 2 workers sharing the Redis lock
+    assert calls == [0]
+    assert {response.json()["call"] for response in responses} == {1}
+
+
+def test_cache_stale_while_revalidate():
+    client = MemoryRedis()
+    calls = []
+    app = create_slow_app(client, calls)
+    response_cache = app.state.response_cache
+
+    async def requests():
+        first = await concurrent_gets(app, 1, "/slow")
+        # the entry expires but stays stale for stale_expiration
+        entry = CachedResponse.loads(client.values["/slow/"])
+        client.values["/slow/"] = dataclasses.replace(entry, fresh_until=0).dumps()
+        served = await concurrent_gets(app, 3, "/slow")
+        await asyncio.gather(*response_cache.revalidations)
+        return first + served + await concurrent_gets(app, 1, "/slow")
+
+    responses = asyncio.run(requests())
+
+    assert [response.json()["call"] for response in responses] == [1, 1, 1, 1, 2]
+    assert calls == [0, 1]
+    assert client.expirations["/slow/"] == 120
+    metrics = response_cache.metrics["/slow"].as_dict()
+    assert (metrics["hits"], metrics["stale_hits"], metrics["misses"]) == (4, 3, 1)
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from bloom.tasks.clean_positions import clean_batch
+
+t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def spire_data(vessel_id: int, minutes: int, longitude: float, latitude: float) -> dict:
+    return {
+        "vessel_id": vessel_id,
+        "position_latitude": latitude,
+        "position_longitude": longitude,
+        "position_speed": 0.0,
+        "position_timestamp": t0 + timedelta(minutes=minutes),
+        "created_at": t0 + timedelta(minutes=minutes + 1),
+    }
+
+
+def test_clean_batch():
+    last_positions = pd.DataFrame([
+        {"vessel_id": 1, "timestamp_end": t0, "longitude": -4.0, "latitude": 47.0},
+        {"vessel_id": 2, "timestamp_end": t0, "longitude": -4.0, "latitude": 47.0},
+    ])
+    # vessel 2 is in an excursion
+    excursions = pd.DataFrame([{"excursion_id": 10, "vessel_id": 2, "arrival_at": None}])
+    batch = pd.DataFrame([
+        # vessel 1 is in port, its positions don't move
+        spire_data(1, 10, -4.0, 47.0),
+        spire_data(1, 20, -4.1, 47.0),
+        spire_data(2, 10, -4.0, 47.0),
+        # new vessel
+        spire_data(3, 10, -3.0, 47.0),
+    ])
+
+    kept, last_positions = clean_batch(batch, last_positions, excursions)
+
+    assert list(zip(kept["vessel_id"], kept["position_longitude"])) == [(1, -4.1), (2, -4.0), (3, -3.0)]
+    last_positions = last_positions.set_index("vessel_id")
+    assert last_positions.loc[1, "timestamp_end"] == t0 + timedelta(minutes=20)
+    assert last_positions.loc[3, "longitude"] == -3.0
+    assert len(last_positions) == 3
+
+
+def test_clean_batch_stationary_pings():
+    # vessel 1 entered the port since its last known position
+    last_positions = pd.DataFrame([
+        {"vessel_id": 1, "timestamp_end": t0, "longitude": -4.0, "latitude": 47.0},
+    ])
+    excursions = pd.DataFrame(columns=["excursion_id", "vessel_id", "arrival_at"])
+    batch = pd.DataFrame([
+        spire_data(1, 30, -4.5, 47.0),
+        spire_data(1, 10, -4.5, 47.0),
+        spire_data(1, 20, -4.5, 47.0),
+        spire_data(1, 20, -4.5, 47.0),
+        # new vessel, anchored
+        spire_data(3, 10, -3.0, 47.0),
+        spire_data(3, 20, -3.0, 47.0),
+    ])
+
+    kept, last_positions = clean_batch(batch, last_positions, excursions)
+
+    # only the first ping at anchor is kept, compared to the previous ping in the batch
+    assert list(zip(kept["vessel_id"], kept["position_timestamp"])) == [
+        (1, t0 + timedelta(minutes=10)),
+        (3, t0 + timedelta(minutes=10)),
+    ]
+    # the last ping is the previous ping of the next batch, even if it is not kept
+    assert last_positions.set_index("vessel_id").loc[1, "timestamp_end"] == t0 + timedelta(minutes=30)
+
+
+def test_clean_batch_chunks():
+    last_positions = pd.DataFrame([
+        {"vessel_id": 1, "timestamp_end": t0, "longitude": -4.0, "latitude": 47.0},
+    ])
+    excursions = pd.DataFrame(columns=["excursion_id", "vessel_id", "arrival_at"])
+    batch = pd.DataFrame([
+        spire_data(1, 10, -4.5, 47.0),
+        spire_data(1, 20, -4.5, 47.0),
+        spire_data(1, 20, -4.5, 47.0),
+        spire_data(3, 20, -3.0, 47.0),
+        # moves about 4.5 m since the previous ping: over 0.01 knot in 10 minutes, not in 20
+        spire_data(1, 30, -4.50006, 47.0),
+        spire_data(3, 30, -3.0, 47.0),
+        spire_data(1, 40, -4.6, 47.0),
+        spire_data(3, 40, -3.1, 47.0),
+    ])
+
+    kept, last = clean_batch(batch, last_positions, excursions)
+    kept_chunks = []
+    last_chunks = last_positions
+    for i in range(len(batch)):
+        kept_chunk, last_chunks = clean_batch(batch.iloc[i:i + 1], last_chunks, excursions)
+        kept_chunks.append(kept_chunk)
+    kept_chunks = pd.concat(kept_chunks).sort_values(["vessel_id", "position_timestamp"])
+
+    columns = ["vessel_id", "position_timestamp", "position_longitude"]
+    assert kept[columns].values.tolist() == kept_chunks[columns].values.tolist()
+    assert last.sort_values("vessel_id").values.tolist() == \
+        last_chunks.sort_values("vessel_id").values.tolist()
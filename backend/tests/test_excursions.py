@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from bloom.services.excursions import assign_excursions
+
+t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def segment(vessel_id: int, minutes: int, port: float, type: str = "AT_SEA") -> dict:
+    return {
+        "vessel_id": vessel_id,
+        "port": port,
+        "type": type,
+        "distance": 7.0,
+        "timestamp_start": t0 + timedelta(minutes=minutes - 10),
+        "timestamp_end": t0 + timedelta(minutes=minutes),
+        "end_longitude": -4.0 - vessel_id,
+        "end_latitude": 47.0 + minutes / 100,
+    }
+
+
+def test_assign_excursions():
+    segments = pd.DataFrame([
+        # vessel 1: ongoing excursion 12 closed in port 5, then a new excursion departing from port 5
+        segment(1, 10, np.nan),
+        segment(1, 20, 5),
+        segment(1, 30, 5),
+        segment(1, 70, np.nan, "DEFAULT_AIS"),
+        # vessel 2: new vessel, its first excursion departs from its first position at sea
+        segment(2, 10, 7),
+        segment(2, 20, np.nan),
+        segment(2, 30, 7),
+    ])
+    last_segments = pd.DataFrame([{"vessel_id": 1, "excursion_id": 12, "arrival_port_id": None}])
+    last_arrivals = {1: {"arrival_port_id": 3, "arrival_position": Point(-5.0, 47.0)}}
+
+    excursion_ids, new_excursions, closures, port_ids = assign_excursions(segments, last_segments,
+                                                                          last_arrivals)
+
+    np.testing.assert_array_equal(excursion_ids, [12, 12, np.nan, -1, np.nan, -2, -2])
+    assert closures == [{"id": 12, "arrival_port_id": 5, "arrival_at": t0 + timedelta(minutes=20),
+                         "longitude": -5.0, "latitude": 47.2}]
+    assert port_ids == {5, 7}
+
+    departure, first = new_excursions
+    assert (departure.vessel_id, departure.departure_port_id) == (1, 5)
+    assert departure.departure_position == Point(-5.0, 47.2)
+    # DEFAULT_AIS segment: departure estimated at 7 knots
+    assert departure.departure_at == t0 + timedelta(minutes=10)
+    assert departure.arrival_at is None
+
+    assert (first.vessel_id, first.departure_port_id) == (2, None)
+    assert first.departure_position == Point(-6.0, 47.2)
+    assert first.departure_at == t0 + timedelta(minutes=20)
+    assert (first.arrival_port_id, first.arrival_at) == (7, t0 + timedelta(minutes=30))
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import shapely
+from shapely.geometry import Point
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from bloom.infra.database import sql_model
+from bloom.infra.database.frame_reader import DATETIME, GEOMETRY, fetch_frame, to_frame
+
+DTYPES = {
+    "id": "int64",
+    "timestamp_end": DATETIME,
+    "arrival_port_id": "float64",
+    "mmsi": "Int64",
+    "end_position": GEOMETRY,
+}
+t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+wkb = shapely.to_wkb(Point(-4.5, 47.25), include_srid=True)
+
+
+class Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def test_to_frame():
+    rows = [(1, t0, None, 227000000, memoryview(wkb)), (2, None, 3, None, None)]
+
+    df = to_frame(rows, DTYPES)
+
+    assert df.dtypes.astype(str).tolist() == ["int64", "datetime64[ns, UTC]", "float64", "Int64", "object"]
+    assert np.isnan(df.at[0, "arrival_port_id"]) and df.at[1, "arrival_port_id"] == 3
+    assert df["timestamp_end"].isna().tolist() == [False, True]
+    # geometries are left as WKB unless asked for
+    assert df.at[0, "end_position"] == wkb
+
+    df = to_frame(rows, DTYPES, decode_geometries=True)
+
+    assert df.at[0, "end_position"].equals(Point(-4.5, 47.25))
+    assert df.at[1, "end_position"] is None
+
+
+def test_to_frame_without_rows():
+    df = to_frame([], DTYPES)
+
+    assert df.empty
+    assert df.columns.tolist() == list(DTYPES)
+    assert df["timestamp_end"].dtype == DATETIME
+
+
+def test_fetch_frame():
+    cursor = Cursor([(1, t0, 3, 227000000, wkb)])
+    connection = SimpleNamespace(dialect=postgresql.psycopg2.dialect(),
+                                 connection=SimpleNamespace(cursor=lambda: cursor))
+    stmt = select(sql_model.Segment.id, sql_model.Segment.timestamp_end, sql_model.Excursion.arrival_port_id,
+                  sql_model.Vessel.mmsi, sql_model.Segment.end_position).where(sql_model.Segment.id.in_([1, 2]))
+
+    df = fetch_frame(connection, stmt, DTYPES)
+
+    sql, params = cursor.executed[0]
+    assert "ST_AsEWKB(fct_segment.end_position)" in sql
+    assert params == {"id_1_1": 1, "id_1_2": 2}
+    assert df.at[0, "timestamp_end"] == t0
@@ -0,0 +1,44 @@
+import numpy as np
+from geopy import distance
+
+from bloom.services import geo
+
+
+def random_positions(n: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(-89, 89, n), rng.uniform(-180, 180, n),
+            rng.uniform(-89, 89, n), rng.uniform(-180, 180, n))
+
+
+def test_wgs84_distance_matches_geopy():
+    lat1, lon1, lat2, lon2 = random_positions(2000)
+    # nearly antipodal and coincident positions
+    lat2[:5], lon2[:5] = -lat1[:5], lon1[:5] + 179.9
+    lat2[5:10], lon2[5:10] = lat1[5:10], lon1[5:10]
+
+    result = geo.compute_distances(lat1, lon1, lat2, lon2, unit="nm")
+    expected = [distance.distance(p1, p2).nautical
+                for p1, p2 in zip(zip(lat1, lon1), zip(lat2, lon2))]
+
+    # less than 1mm
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-6 / 1.852)
+
+
+def test_haversine_distance_matches_great_circle():
+    lat1, lon1, lat2, lon2 = random_positions(2000, seed=1)
+
+    result = geo.compute_distances(lat1, lon1, lat2, lon2, unit="km", method="haversine")
+    expected = [distance.great_circle(p1, p2).km
+                for p1, p2 in zip(zip(lat1, lon1), zip(lat2, lon2))]
+    geodesic = [distance.geodesic(p1, p2).km
+                for p1, p2 in zip(zip(lat1, lon1), zip(lat2, lon2))]
+
+    np.testing.assert_allclose(result, expected, rtol=1e-9)
+    np.testing.assert_allclose(result, geodesic, rtol=0.006)
+
+
+def test_distance_with_missing_position():
+    result = geo.compute_distances([47.0, 47.0], [-4.0, -4.0], [np.nan, 47.1], [None, -4.0])
+
+    assert np.isnan(result[0])
+    assert abs(result[1] - distance.geodesic((47.0, -4.0), (47.1, -4.0)).km) < 1e-6
@@ -0,0 +1,24 @@
+from bloom.domain.kpler_ais_data import KplerAisData
+from bloom.infra.http.kpler_api_utils import map_raw_messages_to_columns
+
+MESSAGES = [
+    {
+        "id": 12,
+        "type": "Feature",
+        "properties": {"mmsi": 227000000, "vesselName": "BLOOM", "sog": 10.5, "navStatus": 0.0,
+                       "posDt": "2024-01-01T00:00:00", "destination": None},
+    },
+    {"id": 13},
+]
+
+
+def test_map_raw_messages_to_columns():
+    columns = map_raw_messages_to_columns(MESSAGES)
+
+    assert columns["vessel_mmsi"] == [227000000, None]
+    assert columns["position_navigational_status"] == [0, None]
+    assert columns["payload"] == MESSAGES
+    # same values as the domain mapping
+    domain = KplerAisData.map_from_kpler(MESSAGES[0])
+    for column, values in columns.items():
+        assert values[0] == getattr(domain, column) or column == "position_timestamp", column
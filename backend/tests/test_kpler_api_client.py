@@ -0,0 +1,75 @@
+import asyncio
+from time import monotonic
+
+import pytest
+from aiohttp import ClientResponseError, web
+
+from bloom.infra.kpler_api_client import KplerApiClient, TokenBucket, retry_after
+
+
+async def serve(responses: list[web.Response], call):
+    """Runs call(client) with a client of a stub API answering the responses in order"""
+    requests = []
+
+    async def handle(request: web.Request) -> web.Response:
+        requests.append(request.query)
+        return responses.pop(0)
+
+    app = web.Application()
+    app.router.add_get("/ais-latest", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with KplerApiClient(rate_limiter=TokenBucket(0)) as client:
+            client.api_root = f"http://127.0.0.1:{port}/"
+            client.retry_backoff = 0
+            client.max_retries = 2
+            return await call(client), client, requests
+    finally:
+        await runner.cleanup()
+
+
+def test_get_retries():
+    responses = [
+        web.Response(status=429, headers={"Retry-After": "0"}),
+        web.Response(status=503),
+        web.json_response({"features": [1, 2]}),
+    ]
+
+    result, client, requests = asyncio.run(
+        serve(responses, lambda client: client.get("ais-latest"))
+    )
+
+    assert result == {"features": [1, 2]}
+    assert len(requests) == 3 and requests[0]["format"] == "json"
+    assert (client.request_count, client.retry_count) == (3, 2)
+    assert client.bytes_received > 0
+    assert client.http_session.closed
+
+
+def test_get_client_error():
+    responses = [web.Response(status=404), web.json_response({})]
+
+    with pytest.raises(ClientResponseError):
+        asyncio.run(serve(responses, lambda client: client.get("ais-latest")))
+    # a client error is not retried
+    assert len(responses) == 1
+
+
+def test_token_bucket():
+    async def acquire_all(bucket: TokenBucket, count: int) -> float:
+        start = monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(count)))
+        return monotonic() - start
+
+    # 2 requests at once, then 1 every 1/20s
+    assert asyncio.run(acquire_all(TokenBucket(20, capacity=2), 6)) >= 0.19
+
+
+def test_retry_after():
+    assert retry_after("2") == 2
+    assert retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry_after(None) is None
@@ -0,0 +1,75 @@
+import asyncio
+import re
+
+from aiohttp import web
+
+from bloom.domain.vessel import Vessel
+from bloom.usecase.create_kpler_ais_messages import GetVesselsFromKplerUseCase
+
+
+class KplerStub:
+    """ais-latest endpoint returning one feature per MMSI of the filter, requests for the MMSI
+    999 fail"""
+
+    def __init__(self):
+        self.filters = []
+        self.running = 0
+        self.max_running = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        mmsi_list = [int(mmsi) for mmsi in re.findall(r"\d+", request.query["filter"])]
+        self.filters.append(mmsi_list)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if 999 in mmsi_list:
+            return web.Response(status=500)
+        features = [{"properties": {"mmsi": mmsi}} for mmsi in mmsi_list]
+        return web.json_response({"features": features})
+
+
+async def fetch(stub: KplerStub, mmsi_list: list[int]) -> tuple:
+    app = web.Application()
+    app.router.add_get("/ais-latest", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        usecase = GetVesselsFromKplerUseCase()
+        usecase.api_client.api_root = f"http://127.0.0.1:{port}/"
+        usecase.api_client.retry_backoff = 0
+        usecase.messages_page_size = 3
+        usecase.max_concurrency = 2
+        vessels = [Vessel.model_construct(mmsi=mmsi) for mmsi in mmsi_list]
+        try:
+            return usecase, await usecase.get_latest_ais_messages(vessels)
+        except Exception as e:
+            return usecase, e
+    finally:
+        await runner.cleanup()
+
+
+def test_get_latest_ais_messages():
+    stub = KplerStub()
+    mmsi_list = list(range(100, 110))
+
+    usecase, features = asyncio.run(fetch(stub, mmsi_list))
+
+    # every MMSI is requested once, by shards of 3
+    assert sorted(feature["properties"]["mmsi"] for feature in features) == mmsi_list
+    assert sorted(stub.filters) == [[100, 101, 102], [103, 104, 105], [106, 107, 108], [109]]
+    assert stub.max_running == 2
+    assert [metrics.features for metrics in usecase.shard_metrics] == [3, 3, 3, 1]
+
+
+def test_get_latest_ais_messages_error():
+    stub = KplerStub()
+
+    usecase, error = asyncio.run(fetch(stub, [100, 101, 102, 999]))
+
+    assert isinstance(error, Exception)
+    assert [metrics.error is None for metrics in usecase.shard_metrics] == [True, False]
+    assert usecase.shard_metrics[0].features == 3
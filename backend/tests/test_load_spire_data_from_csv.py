@@ -0,0 +1,62 @@
+import io
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy import BigInteger
+
+from bloom.infra.database.bulk_copy import write_csv
+from bloom.tasks import load_spire_data_from_csv
+from bloom.tasks.load_spire_data_from_csv import normalize_chunk
+
+CSV = """spire_update_statement;vessel_name;vessel_mmsi;position_latitude;position_timestamp
+2024-01-01T00:00:00Z;BLOOM ;227000000;47.5;2024-01-01T00:00:00+01:00
+2024-01-01T00:00:00Z;;227000001.0;;
+2024-01-01T00:00:00Z;BLOOM;22700.5;47.5;
+2024-01-01T00:00:00Z;BLOOM;227000002;north;
+;BLOOM;227000003;47.5;
+2024-01-01T00:00:00Z;BLOOM;227000004;47.5;yesterday
+2024-01-01T00:00:00Z;BLOOM;5000000000;47.5;
+2024-01-01T00:00:00Z;BLOOM;227000005;inf;
+"""
+
+
+def test_normalize_chunk():
+    chunk = pd.read_csv(io.StringIO(CSV), sep=";", dtype=str, keep_default_na=False)
+
+    df, reasons = normalize_chunk(chunk)
+
+    assert reasons.fillna("").tolist() == [
+        "",
+        "",
+        "vessel_mmsi: entier invalide",
+        "position_latitude: valeur invalide",
+        "spire_update_statement: valeur manquante",
+        "position_timestamp: valeur invalide",
+        "vessel_mmsi: valeur hors limites",
+        "position_latitude: valeur hors limites",
+    ]
+    assert df.at[0, "position_timestamp"] == datetime(2023, 12, 31, 23, tzinfo=timezone.utc)
+    assert df.at[0, "vessel_name"] == "BLOOM "
+    assert df["vessel_mmsi"].dtype == "Int64" and df.at[1, "vessel_mmsi"] == 227000001
+
+    buffer = io.StringIO()
+    write_csv(df.loc[reasons.isna()], buffer)
+    assert buffer.getvalue().splitlines() == [
+        "2024-01-01T00:00:00.000000+00:00,BLOOM ,227000000,47.5,2023-12-31T23:00:00.000000+00:00",
+        "2024-01-01T00:00:00.000000+00:00,,227000001,,",
+    ]
+
+
+def test_normalize_chunk_big_integers(monkeypatch):
+    monkeypatch.setitem(load_spire_data_from_csv.CSV_COLUMN_TYPES, "big", BigInteger())
+    chunk = pd.DataFrame({
+        "spire_update_statement": ["2024-01-01T00:00:00Z"] * 5,
+        "big": ["9007199254740993", "9223372036854775807", "9223372036854775808", "",
+                "-9223372036854775808.0"],
+    })
+
+    df, reasons = normalize_chunk(chunk)
+
+    assert reasons.fillna("").tolist() == ["", "", "big: valeur hors limites", "", ""]
+    assert df["big"].dtype == "Int64"
+    assert df["big"].tolist() == [2**53 + 1, 2**63 - 1, pd.NA, pd.NA, -2**63]
@@ -0,0 +1,63 @@
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from bloom.infra.http.spire_api_utils import SPIRE_AIS_DATA_FIELDS, map_raw_vessel_to_row
+from bloom.tasks.load_spire_data_from_json import iter_json_array
+
+VESSEL = {
+    "id": "a1",
+    "updateTimestamp": "2024-01-01T00:00:00.000Z",
+    "staticData": {"mmsi": 227000000, "name": "BLOOM", "dimensions": {"width": 8.0, "length": None}},
+    "lastPositionUpdate": {"latitude": 47, "longitude": -4.5, "speed": 10.5},
+    "currentVoyage": None,
+}
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+def test_iter_json_array(read_size):
+    vessels = [VESSEL, {"id": "b2", "nested": [1, {"x": "]"}]}, 12345, "text"]
+    dump = io.StringIO(json.dumps(vessels, indent=2))
+
+    assert list(iter_json_array(dump, read_size)) == vessels
+
+
+def test_iter_json_array_errors():
+    assert list(iter_json_array(io.StringIO(" [ ] "))) == []
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"vessels": []}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[{"id": 1}, {"id"'), read_size=4))
+
+
+def test_map_raw_vessel_to_row():
+    row = dict(zip(SPIRE_AIS_DATA_FIELDS, map_raw_vessel_to_row(VESSEL)))
+
+    assert row["spire_update_statement"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert (row["vessel_mmsi"], row["vessel_width"], row["vessel_length"]) == (227000000, 8, None)
+    assert type(row["position_latitude"]) is float
+    assert row["voyage_destination"] is None
+    with pytest.raises(ValueError):
+        map_raw_vessel_to_row(VESSEL | {"staticData": {"mmsi": "unknown"}})
+    with pytest.raises(ValueError, match="staticData.mmsi"):
+        map_raw_vessel_to_row(VESSEL | {"staticData": {"mmsi": 5000000000}})
+    with pytest.raises(ValueError, match="lastPositionUpdate.timestamp"):
+        map_raw_vessel_to_row(VESSEL | {"lastPositionUpdate": {"timestamp": "yesterday"}})
+
+
+@pytest.mark.parametrize("timestamp, expected", [
+    ("2024-01-01T12:00:00.1Z", datetime(2024, 1, 1, 12, 0, 0, 100000, tzinfo=timezone.utc)),
+    ("2024-01-01T12:00:00.123456789Z",
+     datetime(2024, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)),
+    ("2024-01-01T14:00:00+02:00", datetime(2024, 1, 1, 12, tzinfo=timezone.utc)),
+    ("2024-01-01T12:00:00", datetime(2024, 1, 1, 12, tzinfo=timezone.utc)),
+])
+def test_parse_timestamp(timestamp, expected):
+    row = dict(zip(SPIRE_AIS_DATA_FIELDS, map_raw_vessel_to_row(VESSEL | {
+        "lastPositionUpdate": {"timestamp": timestamp},
+    })))
+
+    assert row["position_timestamp"] == expected
+    assert row["position_timestamp"].utcoffset() is not None
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from bloom.services.geo import PortIndex
+
+
+def test_find_closest_ports_in_range():
+    ports = pd.DataFrame([
+        {"id": 1, "longitude": -4.0, "latitude": 47.0, "geometry_buffer": Point(-4.0, 47.0).buffer(0.1)},
+        {"id": 2, "longitude": -4.05, "latitude": 47.0, "geometry_buffer": Point(-4.05, 47.0).buffer(0.1)},
+        {"id": 3, "longitude": -3.0, "latitude": 47.0, "geometry_buffer": Point(-3.0, 47.0).buffer(0.01)},
+    ])
+    port_index = PortIndex(ports)
+
+    result = port_index.find_closest_ports_in_range(
+        [-3.99, -4.04, -4.14, -3.0, -3.005, -3.02, np.nan],
+        [47.0, 47.0, 47.0, 47.0, 47.005, 47.0, np.nan],
+        5000,
+    )
+
+    # closest port among the ports whose buffer contains the position
+    assert result[:2].tolist() == [1, 2]
+    # in buffer of port 2 but further than 5000m
+    assert np.isnan(result[2])
+    assert result[3:5].tolist() == [3, 3]
+    # in range of port 3 but outside of its buffer
+    assert np.isnan(result[5])
+    assert np.isnan(result[6])
+
+
+def test_find_closest_ports_without_ports():
+    port_index = PortIndex(pd.DataFrame(columns=["id", "longitude", "latitude", "geometry_buffer"]))
+
+    assert np.isnan(port_index.find_closest_ports_in_range([-4.0], [47.0], 5000)).all()
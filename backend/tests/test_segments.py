@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from bloom.services.segments import build_segments
+
+t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def position(vessel_id: int, minutes: int, longitude: float, latitude: float) -> dict:
+    return {
+        "vessel_id": vessel_id,
+        "mmsi": 1000 + vessel_id,
+        "timestamp": t0 + timedelta(minutes=minutes),
+        "heading": 90.0,
+        "speed": 10.0,
+        "longitude": longitude,
+        "latitude": latitude,
+    }
+
+
+def test_build_segments():
+    batch = pd.DataFrame([
+        position(2, 10, -4.1, 47.1),
+        position(1, 50, -4.0, 47.0),
+        position(2, 0, -4.0, 47.0),
+        position(1, 5, -3.9, 47.0),
+        position(2, 60, -4.2, 47.2),
+    ])
+    last_segment = pd.DataFrame([{
+        "vessel_id": 1,
+        "excursion_id": 12,
+        "timestamp_end": t0,
+        "heading_at_end": 45.0,
+        "speed_at_end": 3.0,
+        "arrival_port_id": None,
+        "mmsi": 1001,
+        "longitude": -3.8,
+        "latitude": 47.0,
+    }])
+
+    segments = build_segments(batch, last_segment)
+
+    # vessels are kept in the order of their first position, segments sorted by timestamp
+    assert segments["vessel_id"].tolist() == [2, 2, 2, 1, 1]
+    # a new vessel starts with a 1s segment on its first position
+    first = segments.iloc[0]
+    assert first["timestamp_start"] == t0 - timedelta(seconds=1)
+    assert first["distance"] == 0
+    # a known vessel starts at the end of its last segment
+    seeded = segments.iloc[3]
+    assert seeded["timestamp_start"] == t0
+    assert (seeded["start_longitude"], seeded["heading_at_start"]) == (-3.8, 45.0)
+    assert segments["segment_duration"].tolist() == [1.0, 600.0, 3000.0, 300.0, 2700.0]
+    assert segments["type"].tolist() == ["AT_SEA", "AT_SEA", "DEFAULT_AIS", "AT_SEA", "DEFAULT_AIS"]
+    assert segments["last_vessel_segment"].tolist() == [0, 0, 1, 0, 1]
+
+
+def test_build_segments_without_update():
+    batch = pd.DataFrame([position(1, 0, -3.8, 47.0)])
+    last_segment = pd.DataFrame([{
+        "vessel_id": 1,
+        "timestamp_end": t0,
+        "heading_at_end": 45.0,
+        "speed_at_end": 3.0,
+        "longitude": -3.8,
+        "latitude": 47.0,
+    }])
+
+    assert build_segments(batch, last_segment).empty
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects import postgresql
+
+from bloom.infra.repositories.repository_spire_ais_data import SpireAisDataRepository
+
+t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def spire_row(row_id: int, created_at: datetime) -> tuple:
+    return (row_id, t0, 227000000, 1, None, None, 0.0, 0.0, 47.0, -4.0, None, None, 0.0, 0.0,
+            t0, t0, created_at)
+
+
+class Session:
+    """Session running the keyset pages on a list of rows sorted by (created_at, id)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.pages = []
+
+    def execute(self, stmt):
+        self.pages.append(stmt.compile(dialect=postgresql.dialect()))
+        params = self.pages[-1].params
+        last = (params["param_1"], params["param_2"]) if "created_at_3" in params else None
+        rows = [row for row in self.rows if last is None or (row[-1], row[0]) > last]
+        return self.Result(rows[:stmt._limit])
+
+    class Result(list):
+        def all(self):
+            return self
+
+
+def test_iter_data_between_date_keyset():
+    # a Spire load of 5 rows with the same created_at, then 2 rows
+    rows = [spire_row(row_id, t0) for row_id in range(1, 6)] \
+        + [spire_row(row_id, t0 + timedelta(minutes=15)) for row_id in (6, 7)]
+    session = Session(rows)
+
+    chunks = list(SpireAisDataRepository(None).iter_data_between_date(
+        session, t0 - timedelta(days=1), t0 + timedelta(days=1), 3))
+
+    assert [chunk["id"].tolist() for chunk in chunks] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert [page.params.get("created_at_3") for page in session.pages] \
+        == [None, t0, t0 + timedelta(minutes=15)]
+    assert [page.params["param_2"] for page in session.pages[1:]] == [3, 6]
+
+
+def test_iter_data_between_date_sql():
+    session = Session([spire_row(row_id, t0) for row_id in range(1, 4)])
+
+    list(SpireAisDataRepository(None).iter_data_between_date(
+        session, t0 - timedelta(days=1), t0 + timedelta(days=1), 2))
+
+    first, second = (" ".join(str(page).split()) for page in session.pages)
+    assert "spire_ais_data.id) >" not in first
+    assert first.endswith("ORDER BY spire_ais_data.created_at ASC, spire_ais_data.id ASC "
+                          "LIMIT %(param_1)s")
+    # the bound on created_at alone is usable by the index on (created_at, id)
+    assert ("spire_ais_data.created_at >= %(created_at_3)s AND (spire_ais_data.created_at, "
+            "spire_ais_data.id) > (%(param_1)s, %(param_2)s) ORDER BY spire_ais_data.created_at "
+            "ASC, spire_ais_data.id ASC LIMIT %(param_3)s") in second
+    assert session.pages[1].params["created_at_3"] == session.pages[1].params["param_1"] == t0
@@ -0,0 +1,172 @@
+import asyncio
+import re
+
+import pytest
+from aiohttp import web
+from gql.transport.exceptions import TransportQueryError, TransportServerError
+
+from bloom.config import settings
+from bloom.services.GetVesselsFromSpire import GetVesselsFromSpire
+
+SCHEMA = """
+type Query {
+  vessels(mmsi: [Int!], after: String): VesselConnection
+}
+
+type VesselConnection {
+  pageInfo: PageInfo
+  nodes: [Vessel]
+}
+
+type PageInfo {
+  hasNextPage: Boolean
+  endCursor: String
+}
+
+type Vessel {
+  id: ID
+  updateTimestamp: String
+  staticData: StaticData
+  lastPositionUpdate: PositionUpdate
+  currentVoyage: Voyage
+}
+
+type StaticData {
+  aisClass: String
+  flag: String
+  name: String
+  callsign: String
+  timestamp: String
+  updateTimestamp: String
+  shipType: String
+  shipSubType: String
+  mmsi: Int
+  imo: Int
+  dimensions: Dimensions
+}
+
+type Dimensions {
+  width: Float
+  length: Float
+}
+
+type PositionUpdate {
+  accuracy: String
+  collectionType: String
+  course: Float
+  heading: Float
+  latitude: Float
+  longitude: Float
+  maneuver: String
+  navigationalStatus: String
+  rot: Float
+  speed: Float
+  timestamp: String
+  updateTimestamp: String
+}
+
+type Voyage {
+  destination: String
+  draught: Float
+  eta: String
+  timestamp: String
+  updateTimestamp: String
+}
+"""
+
+PAGE_SIZE = 2
+
+
+class SpireStub:
+    """GraphQL endpoint returning the vessels of the queried MMSI by pages of PAGE_SIZE, the first
+    request of every shard fails"""
+
+    def __init__(self):
+        self.requests = []
+        self.failed = set()
+        self.running = 0
+        self.max_running = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        query = (await request.json())["query"]
+        mmsi_argument = re.search(r"mmsi: \[([^\]]*)\]", query).group(1)
+        mmsi_list = [int(mmsi) for mmsi in re.findall(r"\d+", mmsi_argument)]
+        after = re.search(r'after: "(\d+)"', query)
+        start = int(after.group(1)) if after else 0
+        self.requests.append((mmsi_list[0], start))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if mmsi_list[0] not in self.failed:
+            self.failed.add(mmsi_list[0])
+            return web.Response(status=503)
+        end = start + PAGE_SIZE
+        nodes = [{"id": str(mmsi), "staticData": {"mmsi": mmsi}} for mmsi in mmsi_list[start:end]]
+        page_info = {"hasNextPage": end < len(mmsi_list), "endCursor": str(end)}
+        return web.json_response({"data": {"vessels": {"pageInfo": page_info, "nodes": nodes}}})
+
+
+async def fetch(stub: SpireStub, fetcher_options: dict, mmsi_list: list[int]) -> list[dict]:
+    app = web.Application()
+    app.router.add_post("/graphql", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        fetcher = GetVesselsFromSpire(url=f"http://127.0.0.1:{port}/graphql", **fetcher_options)
+        fetcher.shard_size = 5
+        fetcher.max_concurrency = 2
+        fetcher.retry_backoff = 0
+        return await fetcher.fetch_raw_vessels(mmsi_list)
+    finally:
+        await runner.cleanup()
+
+
+def test_fetch_raw_vessels(tmp_path):
+    schema_path = tmp_path / "spire_schema.graphql"
+    schema_path.write_text(SCHEMA)
+    stub = SpireStub()
+    mmsi_list = list(range(100, 112))
+
+    raw_vessels = asyncio.run(fetch(stub, {"schema_path": str(schema_path)}, mmsi_list))
+
+    # 3 shards (5, 5 and 2 vessels), each one paged and retried once
+    assert sorted(vessel["staticData"]["mmsi"] for vessel in raw_vessels) == mmsi_list
+    assert sorted(stub.requests) == [
+        (100, 0), (100, 0), (100, 2), (100, 4),
+        (105, 0), (105, 0), (105, 2), (105, 4),
+        (110, 0), (110, 0),
+    ]
+    assert stub.max_running == 2
+
+
+class SpireErrorStub:
+    """GraphQL endpoint failing every request, with GraphQL errors or with an HTTP status"""
+
+    def __init__(self, status: int):
+        self.status = status
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response({"errors": [{"message": "Invalid token"}], "data": None})
+
+
+@pytest.mark.parametrize("status, error", [
+    (200, TransportQueryError), (401, TransportServerError), (503, TransportServerError),
+])
+def test_fetch_raw_vessels_errors(tmp_path, status, error):
+    schema_path = tmp_path / "spire_schema.graphql"
+    schema_path.write_text(SCHEMA)
+    stub = SpireErrorStub(status)
+
+    with pytest.raises(error):
+        asyncio.run(fetch(stub, {"schema_path": str(schema_path)}, [100]))
+
+    # only the server errors are retried, spire_max_retries times
+    assert stub.requests == (settings.spire_max_retries + 1 if status == 503 else 1)
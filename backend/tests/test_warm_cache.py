@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from bloom.config import settings
+from bloom.tasks.warm_cache import ZONES_RANGES, expand, warm
+
+REQUESTS = [
+    ("/metrics", {"start_at": "{start_at}", "end_at": "{end_at}", "limit": "5"}, {}),
+    ("/zones", {}, {"range": "items=0-99"}),
+]
+
+
+def test_expand_date_ranges():
+    now = datetime(2024, 7, 15, 22, 30, tzinfo=timezone.utc)  # 16/07 00:30 in Paris
+
+    requests = expand(REQUESTS, [7, 30], "Europe/Paris", now)
+
+    assert requests == [
+        ("/metrics", {"start_at": "2024-07-08T22:00:00.000Z",
+                      "end_at": "2024-07-16T21:59:59.999Z", "limit": "5"}, {}),
+        ("/metrics", {"start_at": "2024-06-15T22:00:00.000Z",
+                      "end_at": "2024-07-16T21:59:59.999Z", "limit": "5"}, {}),
+        ("/zones", {}, {"range": "items=0-99"}),
+    ]
+
+
+def test_warm():
+    app = FastAPI()
+    received = []
+
+    @app.get("/metrics")
+    async def metrics(request: Request):
+        received.append((request.headers["x-key"], dict(request.query_params)))
+        return [1, 2, 3]
+
+    @app.get("/zones")
+    async def zones(request: Request):
+        received.append((request.headers["x-key"], request.headers["range"]))
+        return JSONResponse([], status_code=206)
+
+    requests = expand(REQUESTS, [7], "UTC")
+    results = asyncio.run(warm(app, requests + [("/missing", {}, {})]))
+
+    assert [(r.route, r.status) for r in results] == [
+        ("/metrics", 200), ("/zones", 206), ("/missing", 404),
+    ]
+    assert results[0].size == len(b"[1,2,3]")
+    assert received == [(settings.api_key, requests[0][1] | {"nocache": "true"}),
+                        (settings.api_key, "items=0-99")]
+
+
+def test_zones_ranges():
+    assert ZONES_RANGES[0] == "items=0-99"
+    assert ZONES_RANGES[-1] == "items=700-721"
+    assert len(ZONES_RANGES) == 8
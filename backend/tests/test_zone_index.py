@@ -0,0 +1,28 @@
+import pandas as pd
+from shapely.geometry import Point, box
+
+from bloom.domain.zone import Zone
+from bloom.services.geo import ZoneIndex
+
+
+def test_find_segments_zones():
+    zones = [
+        Zone(id=1, category="amp", name="amp"),
+        Zone(id=2, category="Territorial seas", name="territorial seas"),
+    ]
+    # zone 1 is cut in two tiles, zone 2 covers zone 1
+    tiles = pd.DataFrame([
+        {"zone_id": 1, "geometry": box(0, 0, 1, 1)},
+        {"zone_id": 1, "geometry": box(1, 0, 2, 1)},
+        {"zone_id": 2, "geometry": box(-1, -1, 3, 3)},
+    ])
+    zone_index = ZoneIndex(zones, tiles)
+
+    result = zone_index.find_segments_zones(
+        [Point(0.5, 0.5), Point(0.5, 0.5), Point(2.5, 2.5), Point(5, 5)],
+        [Point(1.5, 0.5), Point(0.5, 2.5), Point(1, 0.5), Point(0.5, 0.5)],
+    )
+
+    # start and end in different tiles of zone 1 (one on the border of a tile)
+    assert [[z.id for z in zones] for zones in result] == [[1, 2], [2], [2], []]
+    assert result[0][0].geometry is None
@@ -6,5 +6,10 @@ cd ${APP_HOME}/backend/dbt_trawlwatch &&\
 dbt deps &&\
 dbt run --select observ_spire_ais_data_retrievals &&\
 dbt run --select itm_vessel_last_raw_position &&\
-dbt run --select mart_dim_vessels__last_positions
+dbt run --select mart_dim_vessels__last_positions &&\
+(cd ${APP_HOME}/backend && python -m bloom.tasks.invalidate_cache positions) &&\
+dbt run --select marts.metrics &&\
+cd ${APP_HOME}/backend &&\
+python -m bloom.tasks.invalidate_cache metrics &&\
+python -m bloom.tasks.warm_cache
 deactivate
\ No newline at end of file